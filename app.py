@@ -9,18 +9,39 @@ Deploy: Render.com
 Cron: cron-job.org (gratuito)
 """
 
-from flask import Flask, render_template_string, jsonify, request
+from flask import Flask, Response, jsonify, request
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from functools import wraps
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
+from html.parser import HTMLParser
 from datetime import datetime
 from dataclasses import dataclass, asdict
 from typing import Optional
 import re
 import sqlite3
+import csv
+import atexit
 import hashlib
+import io
+import json
+import math
 import os
+import queue
+import socket
+import sys
+import unicodedata
+import uuid
 import threading
 import time
+from html import escape as html_escape
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from urllib.parse import urlparse
 
 app = Flask(__name__)
 
@@ -31,37 +52,223 @@ app = Flask(__name__)
 # Telegram (opcional - deixe vazio se não quiser)
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
 TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID', '')
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')  # o benchmark aponta para um falso
 
 # Chave secreta para o cron (evita que qualquer um chame a atualização)
 CRON_SECRET = os.environ.get('CRON_SECRET', 'minha-chave-secreta-123')
 
 # Banco de dados
 DATABASE_PATH = os.environ.get('DATABASE_PATH', 'promocoes.db')
+SQLITE_BUSY_TIMEOUT_MS = 10000         # espera o lock em vez de "database is locked"
+SQLITE_MMAP_BYTES = 64 * 1024 * 1024   # leitura via mmap
+SQLITE_CACHE_STATEMENTS = 256          # statements preparados por conexão
+
+# ============================================================
+# MÉTRICAS
+# ============================================================
+
+# Contadores e histogramas em memória, por processo, expostos em /metrics
+# (formato texto do Prometheus) e /api/metricas (resumo em JSON). Cada
+# observação é um bisect e uma soma sob lock: pode ficar ligado sempre.
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Metricas:
+    def __init__(self, limites=LIMITES_SEGUNDOS):
+        self.limites = limites
+        self.contadores = {}     # (nome, rótulos) -> valor
+        self.histogramas = {}    # (nome, rótulos) -> [contagem por faixa..., +Inf, soma]
+        self.lock = threading.Lock()
+        self.inicio = time.time()
+
+    def contar(self, nome, valor=1, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self.lock:
+            self.contadores[chave] = self.contadores.get(chave, 0) + valor
+
+    def observar(self, nome, segundos, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        i = bisect_left(self.limites, segundos)
+        with self.lock:
+            h = self.histogramas.get(chave)
+            if h is None:
+                h = self.histogramas[chave] = [0] * (len(self.limites) + 2)
+            h[i] += 1
+            h[-1] += segundos
+
+    @contextmanager
+    def medir(self, nome, **rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nome, time.perf_counter() - inicio, **rotulos)
+
+    def cronometrado(self, nome, **rotulos):
+        """Decorator: histograma da duração de cada chamada"""
+        def decorador(funcao):
+            @wraps(funcao)
+            def medida(*args, **kwargs):
+                with self.medir(nome, **rotulos):
+                    return funcao(*args, **kwargs)
+            return medida
+        return decorador
+
+    def _copiar(self):
+        with self.lock:
+            return dict(self.contadores), {k: list(v) for k, v in self.histogramas.items()}
+
+    def prometheus(self, extras=()):
+        """Texto no formato de exposição do Prometheus. extras: [(nome, rótulos, valor)] (gauges)"""
+        def fmt_rotulos(rotulos):
+            if not rotulos:
+                return ''
+            escapar = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            return '{' + ','.join(f'{k}="{escapar(v)}"' for k, v in rotulos) + '}'
+        
+        contadores, histogramas = self._copiar()
+        linhas, tipos = [], set()
+        def tipo(nome, t):
+            if nome not in tipos:
+                tipos.add(nome)
+                linhas.append(f"# TYPE {nome} {t}")
+        
+        for (nome, rotulos), valor in sorted(contadores.items()):
+            tipo(nome, 'counter')
+            linhas.append(f"{nome}{fmt_rotulos(rotulos)} {valor}")
+        for (nome, rotulos), h in sorted(histogramas.items()):
+            tipo(nome, 'histogram')
+            acumulado = 0
+            for limite, n in zip(self.limites + ('+Inf',), h[:-1]):
+                acumulado += n
+                linhas.append(f"{nome}_bucket{fmt_rotulos(rotulos + (('le', limite),))} {acumulado}")
+            linhas.append(f"{nome}_sum{fmt_rotulos(rotulos)} {h[-1]}")
+            linhas.append(f"{nome}_count{fmt_rotulos(rotulos)} {acumulado}")
+        # Todas as amostras de uma métrica juntas, como o formato exige
+        for nome, rotulos, valor in sorted(extras, key=lambda e: e[0]):
+            tipo(nome, 'gauge')
+            linhas.append(f"{nome}{fmt_rotulos(tuple(sorted(rotulos.items())))} {valor}")
+        return '\n'.join(linhas) + '\n'
+
+    def _percentil(self, h, p):
+        total = sum(h[:-1])
+        alvo, acumulado = p * total, 0
+        for limite, n in zip(self.limites + (None,), h[:-1]):
+            acumulado += n
+            if acumulado >= alvo:
+                return limite  # limite superior da faixa (None: acima da última)
+        return None
+
+    def resumo(self):
+        contadores, histogramas = self._copiar()
+        rotulo = lambda nome, rotulos: nome + ''.join(f"[{v}]" for _, v in rotulos)
+        return {
+            'desde': self.inicio,
+            'contadores': {rotulo(n, r): v for (n, r), v in sorted(contadores.items())},
+            'latencias': {
+                rotulo(n, r): {
+                    'n': sum(h[:-1]),
+                    'media_ms': round(h[-1] / max(sum(h[:-1]), 1) * 1000, 2),
+                    'p50_ms_ate': (lambda v: v * 1000 if v else None)(self._percentil(h, 0.5)),
+                    'p95_ms_ate': (lambda v: v * 1000 if v else None)(self._percentil(h, 0.95)),
+                }
+                for (n, r), h in sorted(histogramas.items())
+            },
+        }
+
+metricas = Metricas()
 
 # ============================================================
 # TELEGRAM
 # ============================================================
 
-def enviar_telegram(mensagem):
-    """Envia mensagem para o Telegram"""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        return False
-    
-    try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        response = requests.post(url, json={
-            'chat_id': TELEGRAM_CHAT_ID,
+# Limites do Telegram: ~1 mensagem/s por chat e ~30/s no total
+TELEGRAM_INTERVALO_CHAT = 1.0
+TELEGRAM_INTERVALO_GLOBAL = 1 / 30
+TELEGRAM_TENTATIVAS = 5
+TELEGRAM_BACKOFF_MAX = 60
+
+class LimitadorTelegram:
+    """Espaça os envios por chat e no total; pausa tudo quando o Telegram pede"""
+
+    def __init__(self, intervalo_chat, intervalo_global):
+        self.intervalo_chat = intervalo_chat
+        self.intervalo_global = intervalo_global
+        self.proximo_chat = {}
+        self.proximo_global = 0.0
+        self.lock = threading.Lock()
+
+    def esperar(self, chat_id):
+        with self.lock:
+            agora = time.monotonic()
+            inicio = max(agora, self.proximo_chat.get(chat_id, 0.0), self.proximo_global)
+            self.proximo_chat[chat_id] = inicio + self.intervalo_chat
+            self.proximo_global = inicio + self.intervalo_global
+        if inicio > agora:
+            time.sleep(inicio - agora)
+
+    def pausar(self, segundos):
+        """retry_after do 429 vale para o bot inteiro"""
+        with self.lock:
+            self.proximo_global = max(self.proximo_global, time.monotonic() + segundos)
+
+limitador_telegram = LimitadorTelegram(TELEGRAM_INTERVALO_CHAT, TELEGRAM_INTERVALO_GLOBAL)
+
+def _post_telegram(chat_id, mensagem):
+    """Um POST ao Telegram. Retorna (resultado, retry_after)."""
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    with metricas.medir('telegram_envio_segundos'):
+        response = sessao_http.post(url, json={
+            'chat_id': chat_id,
             'text': mensagem,
             'parse_mode': 'HTML',
             'disable_web_page_preview': False
         }, timeout=10)
-        return response.status_code == 200
-    except Exception as e:
-        print(f"Erro Telegram: {e}")
+    metricas.contar('telegram_respostas_total', status=response.status_code)
+    if response.status_code == 200:
+        return 'ok', None
+    if response.status_code == 429:
+        try:
+            retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+        except ValueError:
+            retry_after = 1
+        return 'erro', float(retry_after)
+    if 400 <= response.status_code < 500:
+        # Mensagem inválida, chat bloqueado...: repetir não adianta
+        print(f"Telegram recusou a mensagem ({response.status_code}): {response.text[:200]}")
+        return 'falha', None
+    return 'erro', None
+
+def _enviar(chat_id, mensagem):
+    """Envia com limite de taxa e novas tentativas.
+
+    Retorna 'ok', 'falha' (recusada, não tente de novo) ou 'erro'
+    (tentativas esgotadas; vale tentar mais tarde).
+    """
+    metricas.contar('telegram_mensagens_total')
+    for tentativa in range(TELEGRAM_TENTATIVAS):
+        limitador_telegram.esperar(chat_id)
+        try:
+            resultado, retry_after = _post_telegram(chat_id, mensagem)
+        except Exception as e:
+            print(f"Erro Telegram: {e}")
+            metricas.contar('telegram_erros_total')
+            resultado, retry_after = 'erro', None
+        if resultado != 'erro':
+            return resultado
+        if retry_after:
+            limitador_telegram.pausar(retry_after)
+        else:
+            time.sleep(min(TELEGRAM_BACKOFF_MAX, 2 ** tentativa))
+    return 'erro'
+
+def enviar_telegram(mensagem, chat_id=None):
+    """Envia mensagem para o Telegram"""
+    chat_id = chat_id or TELEGRAM_CHAT_ID
+    if not TELEGRAM_BOT_TOKEN or not chat_id:
         return False
+    return _enviar(chat_id, mensagem) == 'ok'
 
-def notificar_promocao(promo):
-    """Formata e envia notificação de uma promoção"""
+def formatar_promocao(promo):
     emojis = {
         'passagem': '✈️',
         'milhas': '🎯',
@@ -90,15 +297,13 @@ def notificar_promocao(promo):
     if promo.get('destino'):
         msg += f"📍 {promo['destino']}\n"
     
-    msg += f"\n🔗 {promo.get('url')}"
+    if promo.get('score') is not None:
+        msg += f"📉 {descrever_score(promo)}\n"
     
-    return enviar_telegram(msg)
+    msg += f"\n🔗 {promo.get('url')}"
+    return msg
 
-def notificar_resumo(novas):
-    """Envia resumo das novas promoções"""
-    if not novas:
-        return
-    
+def formatar_resumo(novas):
     msg = f"📊 <b>{len(novas)} novas promoções encontradas!</b>\n\n"
     
     passagens = [p for p in novas if p.get('tipo') == 'passagem']
@@ -123,293 +328,3253 @@ def notificar_resumo(novas):
         maior = max(bonus_vals)
         msg += f"\n🎁 Maior bônus: <b>{maior}%</b>"
     
-    enviar_telegram(msg)
+    return msg
+
+def destaques(novas, limite=3):
+    """Prioriza: bonificadas com alto %, passagens mais abaixo da mediana da rota"""
+    bonus_altos = sorted(
+        [p for p in novas if p.get('bonus_percentual')],
+        key=lambda x: x.get('bonus_percentual', 0),
+        reverse=True
+    )[:2]
+    
+    # Sem histórico da rota o score é None: essas vão para o fim, pelo preço
+    melhores_passagens = sorted(
+        [p for p in novas if p.get('preco')],
+        key=lambda x: (x.get('score') is None, -(x.get('score') or 0), x.get('preco'))
+    )[:2]
+    
+    return (bonus_altos + melhores_passagens)[:limite]
+
+def formatar_rajada(novas):
+    """Várias promoções de uma vez viram uma mensagem só: resumo + destaques"""
+    msg = formatar_resumo(novas)
+    melhores = destaques(novas)
+    if melhores:
+        msg += "\n\n⭐ <b>Destaques</b>"
+        for p in melhores:
+            valor = f"R$ {p['preco']:,.0f}" if p.get('preco') else f"{p.get('bonus_percentual')}%"
+            msg += f"\n• <b>{valor}</b> {p.get('titulo')}"
+            if p.get('score') is not None:
+                msg += f"\n  📉 {descrever_score(p)}"
+            msg += f"\n  🔗 {p.get('url')}"
+    return msg
+
+def notificar_promocao(promo):
+    """Formata e envia notificação de uma promoção"""
+    return enviar_telegram(formatar_promocao(promo))
+
+def notificar_resumo(novas):
+    """Envia resumo das novas promoções"""
+    if not novas:
+        return
+    enviar_telegram(formatar_resumo(novas))
 
 # ============================================================
 # MODELOS E BANCO
 # ============================================================
 
-@dataclass
-class Promocao:
-    tipo: str
-    titulo: str
-    url: str
-    fonte: str
-    data_encontrada: str = ""
-    preco: Optional[float] = None
-    bonus_percentual: Optional[int] = None
-    programa: Optional[str] = None
-    destino: Optional[str] = None
-    
-    def __post_init__(self):
-        if not self.data_encontrada:
-            self.data_encontrada = datetime.now().strftime("%d/%m %H:%M")
-    
-    @property
-    def hash_id(self) -> str:
-        return hashlib.md5(f"{self.titulo}{self.url}".encode()).hexdigest()[:12]
+@dataclass(slots=True)
+class Promocao:
+    tipo: str
+    titulo: str
+    url: str
+    fonte: str
+    data_encontrada: str = ""
+    preco: Optional[float] = None
+    bonus_percentual: Optional[int] = None
+    programa: Optional[str] = None
+    destino: Optional[str] = None
+    origem: Optional[str] = None
+    score: Optional[float] = None      # % abaixo da mediana da rota (negativo: acima)
+    mediana: Optional[float] = None    # mediana de 90 dias usada no score
+    
+    def __post_init__(self):
+        if not self.data_encontrada:
+            self.data_encontrada = datetime.now().strftime("%d/%m %H:%M")
+    
+    @property
+    def hash_id(self) -> str:
+        return hashlib.md5(f"{self.titulo}{self.url}".encode()).hexdigest()[:12]
+
+_conexoes = threading.local()
+# Conexões herdadas de um fork: não podem ser usadas nem fechadas no filho
+_conexoes_herdadas = []
+
+def _abrir_conexao():
+    conn = sqlite3.connect(DATABASE_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=SQLITE_CACHE_STATEMENTS)
+    conn.row_factory = sqlite3.Row
+    # WAL: leitores não bloqueiam o escritor (e vice-versa)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA mmap_size={SQLITE_MMAP_BYTES}')
+    conn.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    return conn
+
+def get_db():
+    """Conexão da thread atual, aberta uma vez e reaproveitada.
+
+    Não feche a conexão retornada; para escrever use ``with conn:``, que
+    faz commit (ou rollback) da transação.
+    """
+    conn = getattr(_conexoes, 'conn', None)
+    if conn is not None and (_conexoes.pid != os.getpid() or _conexoes.path != DATABASE_PATH):
+        if _conexoes.pid != os.getpid():
+            _conexoes_herdadas.append(conn)
+        else:
+            conn.close()
+        conn = None
+    if conn is None:
+        conn = _abrir_conexao()
+        _conexoes.conn = conn
+        _conexoes.pid = os.getpid()
+        _conexoes.path = DATABASE_PATH
+    return conn
+
+def init_db():
+    conn = get_db()
+    # Só vale para banco novo (os antigos mudam no primeiro `compactar`)
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS promocoes (
+                hash_id TEXT PRIMARY KEY,
+                tipo TEXT,
+                titulo TEXT,
+                url TEXT,
+                fonte TEXT,
+                data_encontrada TEXT,
+                preco REAL,
+                bonus_percentual INTEGER,
+                programa TEXT,
+                destino TEXT,
+                notificado INTEGER DEFAULT 0,
+                origem TEXT,
+                score REAL,
+                mediana REAL,
+                criado_em REAL
+            )
+        ''')
+        # Bancos antigos não têm as colunas novas
+        colunas = {r[1] for r in conn.execute('PRAGMA table_info(promocoes)')}
+        for coluna, tipo in (('origem', 'TEXT'), ('score', 'REAL'), ('mediana', 'REAL'), ('criado_em', 'REAL')):
+            if coluna not in colunas:
+                conn.execute(f'ALTER TABLE promocoes ADD COLUMN {coluna} {tipo}')
+        # Sem data de criação, o histórico começa a contar a retenção agora
+        if 'criado_em' not in colunas:
+            conn.execute('UPDATE promocoes SET criado_em = ?', (time.time(),))
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS config (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS http_cache (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT
+            )
+        ''')
+        # Índices sobre tabela rowid já terminam no rowid: (tipo) serve
+        # para "WHERE tipo=? AND rowid < ? ORDER BY rowid DESC"
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_promocoes_tipo ON promocoes(tipo)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_promocoes_fonte ON promocoes(fonte)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_promocoes_destino ON promocoes(destino)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_promocoes_programa ON promocoes(programa)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_promocoes_preco ON promocoes(preco)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_promocoes_criado ON promocoes(criado_em)')
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_promocoes_score ON promocoes(score) WHERE score IS NOT NULL'
+        )
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_promocoes_pendentes ON promocoes(notificado) WHERE notificado = 0'
+        )
+        # Antes da fila, notificado nunca era atualizado: o histórico não é pendência
+        if not conn.execute("SELECT 1 FROM config WHERE key = 'fila_notificacoes'").fetchone():
+            conn.execute('UPDATE promocoes SET notificado = 1 WHERE notificado = 0')
+            conn.execute("INSERT INTO config VALUES ('fila_notificacoes', '1')")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                tipo TEXT,
+                status TEXT,
+                parametros TEXT,
+                criado_em REAL,
+                iniciado_em REAL,
+                concluido_em REAL,
+                resultado TEXT,
+                erro TEXT
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(tipo, status)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS simhash_faixas (
+                faixa INTEGER,
+                valor INTEGER,
+                hash_id TEXT,
+                simhash INTEGER,
+                destino TEXT,
+                preco REAL,
+                visto_em REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_simhash_faixa ON simhash_faixas(faixa, valor)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_simhash_visto ON simhash_faixas(visto_em)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS duplicatas (
+                hash_id TEXT PRIMARY KEY,
+                canonico TEXT,
+                titulo TEXT,
+                url TEXT,
+                fonte TEXT,
+                visto_em REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_duplicatas_canonico ON duplicatas(canonico)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS agenda_fontes (
+                nome TEXT PRIMARY KEY,
+                intervalo REAL,
+                proxima_em REAL,
+                ultima_em REAL,
+                ultima_com_novas REAL,
+                execucoes INTEGER DEFAULT 0,
+                com_novas INTEGER DEFAULT 0,
+                ultimo_sucesso REAL
+            )
+        ''')
+        if 'ultimo_sucesso' not in {r[1] for r in conn.execute('PRAGMA table_info(agenda_fontes)')}:
+            conn.execute('ALTER TABLE agenda_fontes ADD COLUMN ultimo_sucesso REAL')
+        # Histograma de preços por rota e dia: uma linha por faixa de preço
+        # (2% de largura, escala log), não uma por promoção
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS historico_precos (
+                rota TEXT,
+                dia INTEGER,
+                faixa INTEGER,
+                n INTEGER,
+                PRIMARY KEY (rota, dia, faixa)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS assinantes (
+                id INTEGER PRIMARY KEY,
+                chat_id TEXT UNIQUE,
+                nome TEXT,
+                ativo INTEGER DEFAULT 1,
+                criado_em REAL
+            )
+        ''')
+        # destinos/programas/tipos: listas JSON; NULL aceita qualquer valor
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS regras (
+                id INTEGER PRIMARY KEY,
+                assinante_id INTEGER,
+                destinos TEXT,
+                programas TEXT,
+                tipos TEXT,
+                preco_max REAL,
+                bonus_min INTEGER,
+                score_min REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_regras_assinante ON regras(assinante_id)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS entregas (
+                assinante_id INTEGER,
+                hash_id TEXT,
+                status INTEGER,
+                criado_em REAL,
+                PRIMARY KEY (assinante_id, hash_id)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_entregas_pendentes ON entregas(status) WHERE status = 0')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS leases (
+                nome TEXT PRIMARY KEY,
+                dono TEXT,
+                expira_em REAL
+            )
+        ''')
+        _criar_estatisticas(conn)
+        _criar_busca(conn)
+
+# Esquema pronto para esta versão do código: incremente ao mudar init_db
+VERSAO_ESQUEMA = 1
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: sem trava entre processos (um processo só)
+
+@contextmanager
+def _trava_arquivo(caminho):
+    """Trava exclusiva entre processos, enquanto durar o bloco"""
+    with open(caminho, 'a') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def preparar_banco():
+    """Cria ou migra o esquema, uma vez por banco.
+
+    Os workers do gunicorn sobem juntos: o primeiro trava o arquivo e roda
+    init_db, os outros esperam e encontram o banco já na VERSAO_ESQUEMA.
+    """
+    global FTS_DISPONIVEL
+    conn = get_db()
+    if conn.execute('PRAGMA user_version').fetchone()[0] < VERSAO_ESQUEMA:
+        with _trava_arquivo(DATABASE_PATH + '.lock'):
+            if conn.execute('PRAGMA user_version').fetchone()[0] < VERSAO_ESQUEMA:
+                init_db()
+                conn.execute(f'PRAGMA user_version = {VERSAO_ESQUEMA}')
+    FTS_DISPONIVEL = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'promocoes_fts'"
+    ).fetchone() is not None
+
+# INSERT ... RETURNING existe a partir do SQLite 3.35
+SQLITE_TEM_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+# 15 colunas por linha, abaixo do limite de 999 variáveis dos SQLite antigos
+LINHAS_POR_INSERT = 66
+# IN (...) com uma variável por item, pelo mesmo limite
+ITENS_POR_CONSULTA = 900
+
+COLUNAS_PROMOCAO = ('hash_id, tipo, titulo, url, fonte, data_encontrada, preco, '
+                    'bonus_percentual, programa, destino, notificado, origem, score, mediana, criado_em')
+
+def _linha_promocao(promo: Promocao, agora):
+    return (promo.hash_id, promo.tipo, promo.titulo, promo.url, promo.fonte,
+            promo.data_encontrada, promo.preco, promo.bonus_percentual,
+            promo.programa, promo.destino, 0, promo.origem, promo.score, promo.mediana, agora)
+
+@metricas.cronometrado('db_segundos', operacao='salvar_promocoes')
+def salvar_promocoes(promos, validadores=()) -> set:
+    """Salva várias promoções numa única transação. Retorna os hash_id novos.
+
+    Quase-duplicatas de promoções recentes (mesma oferta em outro site, ou
+    retitulada) não entram: ficam em `duplicatas`, apontando para a canônica.
+    Os validadores HTTP das páginas entram na mesma transação.
+    """
+    novos = set()
+    if not promos:
+        if validadores:
+            conn = get_db()
+            with conn:
+                salvar_validadores(conn, validadores)
+        return novos
+    
+    agora = time.time()
+    conn = get_db()
+    with conn:
+        # IMMEDIATE: a deduplicação lê e grava sem outro escritor no meio
+        conn.execute('BEGIN IMMEDIATE')
+        promos, assinaturas = deduplicar(conn, promos)
+        pontuar_promocoes(conn, promos)
+        if SQLITE_TEM_RETURNING:
+            for i in range(0, len(promos), LINHAS_POR_INSERT):
+                lote = promos[i:i + LINHAS_POR_INSERT]
+                valores = ','.join(['(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)'] * len(lote))
+                params = [v for p in lote for v in _linha_promocao(p, agora)]
+                rows = conn.execute(
+                    f'INSERT INTO promocoes ({COLUNAS_PROMOCAO}) VALUES {valores} '
+                    'ON CONFLICT(hash_id) DO NOTHING RETURNING hash_id',
+                    params
+                ).fetchall()
+                novos.update(row[0] for row in rows)
+        else:
+            for p in promos:
+                cur = conn.execute(
+                    f'INSERT OR IGNORE INTO promocoes ({COLUNAS_PROMOCAO}) '
+                    'VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                    _linha_promocao(p, agora)
+                )
+                if cur.rowcount == 1:
+                    novos.add(p.hash_id)
+        inseridas = [p for p in promos if p.hash_id in novos]
+        indexar_simhash(conn, inseridas, assinaturas)
+        registrar_precos(conn, inseridas)
+        salvar_validadores(conn, validadores)
+    return novos
+
+def salvar_promocao(promo: Promocao) -> bool:
+    """Salva promoção. Retorna True se for nova."""
+    return promo.hash_id in salvar_promocoes([promo])
+
+# ============================================================
+# DEDUPLICAÇÃO
+# ============================================================
+
+# A mesma oferta aparece em mais de um site, ou volta com outro título.
+# SimHash de 64 bits sobre as palavras do título normalizado: títulos
+# quase iguais ficam a poucos bits de distância. Para achar candidatos sem
+# comparar com todo o histórico, o hash é dividido em 4 faixas de 16 bits
+# indexadas; a distância <= 3 garante que ao menos uma faixa é idêntica.
+DEDUP_DISTANCIA = 3
+DEDUP_FAIXAS = 4
+DEDUP_JANELA = 7 * 86400     # só compara com o que foi visto nos últimos 7 dias
+DEDUP_TOLERANCIA_PRECO = 0.1 # preços a mais de 10% são ofertas diferentes
+
+PALAVRAS_VAZIAS = {
+    'a', 'o', 'e', 'de', 'da', 'do', 'das', 'dos', 'em', 'no', 'na', 'por', 'para',
+    'com', 'ate', 'partir', 'r', 'ida', 'volta', 'voos', 'passagens', 'passagem', 'saindo',
+}
+
+def simhash(titulo):
+    pesos = [0] * 64
+    for palavra in re.findall(r'\w+', normalizar(titulo)):
+        if palavra in PALAVRAS_VAZIAS:
+            continue
+        h = int.from_bytes(hashlib.blake2b(palavra.encode(), digest_size=8).digest(), 'big')
+        for i in range(64):
+            pesos[i] += 1 if h >> i & 1 else -1
+    return sum(1 << i for i in range(64) if pesos[i] > 0)
+
+def _faixas(h):
+    bits = 64 // DEDUP_FAIXAS
+    return [(h >> (i * bits)) & ((1 << bits) - 1) for i in range(DEDUP_FAIXAS)]
+
+def _com_sinal(h):
+    """SQLite guarda INTEGER de 64 bits com sinal"""
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+# Além do título: o que separa duas ofertas de títulos parecidos
+CAMPOS_OFERTA = ('destino', 'preco', 'tipo', 'programa', 'bonus_percentual')
+
+def _oferta(p):
+    return tuple(getattr(p, campo) for campo in CAMPOS_OFERTA)
+
+def _mesma_oferta(h1, oferta1, h2, oferta2):
+    """oferta: valores de CAMPOS_OFERTA; campo vazio num dos lados não separa"""
+    if bin(h1 ^ h2).count('1') > DEDUP_DISTANCIA:
+        return False
+    (destino1, preco1, *outros1), (destino2, preco2, *outros2) = oferta1, oferta2
+    if destino1 and destino2 and destino1 != destino2:
+        return False
+    if preco1 and preco2 and abs(preco1 - preco2) > DEDUP_TOLERANCIA_PRECO * max(preco1, preco2):
+        return False
+    # "Smiles 80%" e "Smiles 100%", ou a mesma rota em milhas e em dinheiro
+    return all(v1 is None or v2 is None or v1 == v2 for v1, v2 in zip(outros1, outros2))
+
+def _canonica_recente(conn, h, oferta, agora):
+    filtro = ' OR '.join(['(f.faixa = ? AND f.valor = ?)'] * DEDUP_FAIXAS)
+    params = [v for i, valor in enumerate(_faixas(h)) for v in (i, valor)]
+    # tipo, programa e bônus vêm da promoção (se ainda não foi arquivada)
+    candidatos = conn.execute(
+        f'SELECT DISTINCT f.hash_id, f.simhash, f.destino, f.preco, p.tipo, p.programa, p.bonus_percentual '
+        f'FROM simhash_faixas f LEFT JOIN promocoes p ON p.hash_id = f.hash_id '
+        f'WHERE ({filtro}) AND f.visto_em > ?',
+        params + [agora - DEDUP_JANELA]
+    ).fetchall()
+    for c in candidatos:
+        if _mesma_oferta(h, oferta, c['simhash'] & ((1 << 64) - 1), tuple(c[campo] for campo in CAMPOS_OFERTA)):
+            return c['hash_id']
+    return None
+
+def _hashes_em(conn, tabela, hashes):
+    """Quais destes hash_id já estão na tabela, em lotes de ITENS_POR_CONSULTA"""
+    achados = set()
+    for i in range(0, len(hashes), ITENS_POR_CONSULTA):
+        lote = hashes[i:i + ITENS_POR_CONSULTA]
+        marcas = ','.join('?' * len(lote))
+        achados.update(r[0] for r in conn.execute(
+            f'SELECT hash_id FROM {tabela} WHERE hash_id IN ({marcas})', lote))
+    return achados
+
+def deduplicar(conn, promos, agora=None):
+    """Separa as quase-duplicatas. Retorna (promoções a inserir, {hash_id: simhash})."""
+    agora = agora or time.time()
+    hashes = [p.hash_id for p in promos]
+    existentes = _hashes_em(conn, 'promocoes', hashes)
+    ja_duplicadas = _hashes_em(conn, 'duplicatas', hashes)
+    
+    # As aceitas deste lote também ficam por faixa: comparar com todas é quadrático
+    inserir, assinaturas, faixas_lote = [], {}, {}
+    for p in promos:
+        if p.hash_id in ja_duplicadas:
+            continue
+        if p.hash_id in existentes or p.hash_id in assinaturas:
+            inserir.append(p)  # já conhecida: o INSERT ignora
+            continue
+        h = simhash(p.titulo)
+        oferta = _oferta(p)
+        faixas = list(enumerate(_faixas(h)))
+        canonica = next((a.hash_id for faixa in faixas for a in faixas_lote.get(faixa, ())
+                         if _mesma_oferta(h, oferta, assinaturas[a.hash_id], _oferta(a))),
+                        None) or _canonica_recente(conn, h, oferta, agora)
+        if canonica:
+            conn.execute('INSERT OR IGNORE INTO duplicatas VALUES (?, ?, ?, ?, ?, ?)',
+                         (p.hash_id, canonica, p.titulo, p.url, p.fonte, agora))
+            ja_duplicadas.add(p.hash_id)
+            continue
+        assinaturas[p.hash_id] = h
+        for faixa in faixas:
+            faixas_lote.setdefault(faixa, []).append(p)
+        inserir.append(p)
+    return inserir, assinaturas
+
+def indexar_simhash(conn, promos, assinaturas, agora=None):
+    agora = agora or time.time()
+    linhas = []
+    for p in promos:
+        h = assinaturas.get(p.hash_id)
+        if h is None:
+            continue
+        linhas.extend((i, valor, p.hash_id, _com_sinal(h), p.destino, p.preco, agora)
+                      for i, valor in enumerate(_faixas(h)))
+    conn.executemany('INSERT INTO simhash_faixas VALUES (?, ?, ?, ?, ?, ?, ?)', linhas)
+    # O índice só precisa da janela de comparação
+    conn.execute('DELETE FROM simhash_faixas WHERE visto_em < ?', (agora - DEDUP_JANELA,))
+
+def get_duplicatas(hash_id):
+    """Outras publicações agrupadas na promoção canônica"""
+    return [dict(r) for r in get_db().execute(
+        'SELECT hash_id, titulo, url, fonte FROM duplicatas WHERE canonico = ? ORDER BY visto_em',
+        (hash_id,)
+    ).fetchall()]
+
+# ============================================================
+# HISTÓRICO DE PREÇOS E SCORE
+# ============================================================
+
+# Cada passagem com preço e destino vira uma contagem no histograma
+# diário da rota ("origem→destino", ou só o destino). O score compara o
+# preço com a mediana dos últimos 90 dias da rota: ler a janela custa no
+# máximo dias × faixas linhas pela chave primária, nunca o histórico todo.
+JANELA_PRECOS_DIAS = 90
+LARGURA_FAIXA = 1.02       # faixas de 2%, em escala log
+AMOSTRA_MINIMA = 5         # com menos observações a mediana não diz nada
+
+def rota_de(promo):
+    if promo.tipo != 'passagem' or not promo.preco or not promo.destino:
+        return None
+    return f"{promo.origem}→{promo.destino}" if promo.origem else promo.destino
+
+def _faixa_preco(preco):
+    return round(math.log(preco, LARGURA_FAIXA))
+
+def _dia(agora=None):
+    return int((agora or time.time()) // 86400)
+
+def percentis_rota(conn, rota, percentis=(0.5,), agora=None):
+    """Percentis do preço na janela da rota. Retorna (valores, amostras)."""
+    linhas = conn.execute(
+        'SELECT faixa, SUM(n) FROM historico_precos WHERE rota = ? AND dia > ? '
+        'GROUP BY faixa ORDER BY faixa',
+        (rota, _dia(agora) - JANELA_PRECOS_DIAS)
+    ).fetchall()
+    total = sum(n for _, n in linhas)
+    valores = []
+    for p in percentis:
+        alvo, acumulado = p * total, 0
+        for faixa, n in linhas:
+            acumulado += n
+            if acumulado >= alvo:
+                valores.append(LARGURA_FAIXA ** faixa)
+                break
+        else:
+            valores.append(None)
+    return valores, total
+
+def pontuar_promocoes(conn, promos, agora=None):
+    """Preenche score/mediana comparando com o histórico anterior da rota"""
+    medianas = {}
+    for p in promos:
+        rota = rota_de(p)
+        if rota is None:
+            continue
+        if rota not in medianas:
+            (mediana,), amostras = percentis_rota(conn, rota, agora=agora)
+            medianas[rota] = mediana if amostras >= AMOSTRA_MINIMA else None
+        mediana = medianas[rota]
+        if mediana:
+            p.mediana = round(mediana, 2)
+            p.score = round((mediana - p.preco) / mediana * 100, 1)
+
+def registrar_precos(conn, promos, agora=None):
+    dia = _dia(agora)
+    conn.executemany('''
+        INSERT INTO historico_precos VALUES (?, ?, ?, 1)
+        ON CONFLICT(rota, dia, faixa) DO UPDATE SET n = n + 1
+    ''', [(rota_de(p), dia, _faixa_preco(p.preco)) for p in promos if rota_de(p)])
+
+def descrever_score(promo):
+    """'12% abaixo da mediana de 90 dias para Lisboa'"""
+    score = promo.get('score')
+    if score is None:
+        return None
+    rota = f"{promo['origem']} → {promo['destino']}" if promo.get('origem') else promo.get('destino')
+    direcao = 'abaixo' if score >= 0 else 'acima'
+    return f"{abs(score):.0f}% {direcao} da mediana de {JANELA_PRECOS_DIAS} dias para {rota}"
+
+def get_historico_rota(rota):
+    valores, amostras = percentis_rota(get_db(), rota, (0.25, 0.5, 0.75))
+    p25, mediana, p75 = (round(v, 2) if v else None for v in valores)
+    return {'rota': rota, 'amostras': amostras, 'p25': p25, 'mediana': mediana, 'p75': p75,
+            'janela_dias': JANELA_PRECOS_DIAS}
+
+def _filtros_promocoes(tipo=None, preco_min=None, preco_max=None, destino=None, programa=None, fonte=None):
+    """Cláusulas WHERE comuns à listagem e à exportação. Retorna (filtros, params)."""
+    filtros, params = [], []
+    if tipo and tipo != 'todas':
+        filtros.append('tipo = ?')
+        params.append(tipo)
+    if preco_min is not None:
+        filtros.append('preco >= ?')
+        params.append(preco_min)
+    if preco_max is not None:
+        filtros.append('preco <= ?')
+        params.append(preco_max)
+    if destino:
+        filtros.append('destino = ?')
+        params.append(destino)
+    if programa:
+        filtros.append('programa = ?')
+        params.append(programa)
+    if fonte:
+        filtros.append('fonte = ?')
+        params.append(fonte)
+    return filtros, params
+
+@metricas.cronometrado('db_segundos', operacao='consultar_promocoes')
+def consultar_promocoes(tipo=None, antes=None, preco_min=None, preco_max=None,
+                        destino=None, programa=None, fonte=None, limite=50, ordem='recentes'):
+    """Página de promoções, da mais nova para a mais antiga.
+
+    Com ordem='score', só as que têm score, da mais abaixo da mediana da
+    rota para a menos. Paginação por cursor (keyset): passe em `antes` o
+    `proximo` da página anterior (um rowid, ou (score, rowid) no ranking).
+    Retorna (promocoes, proximo); proximo é None na última página.
+    """
+    if ordem == 'recentes':
+        pagina = promocoes_recentes.pagina(tipo, antes, preco_min, preco_max, destino, programa, fonte, limite)
+        if pagina is not None:
+            registros, proximo = pagina
+            return [r.como_dict() for r in registros], proximo
+    
+    filtros, params = _filtros_promocoes(tipo, preco_min, preco_max, destino, programa, fonte)
+    if ordem == 'score':
+        filtros.append('score IS NOT NULL')
+        if antes is not None:
+            filtros.append('(score < ? OR (score = ? AND rowid < ?))')
+            params.extend([antes[0], antes[0], antes[1]])
+    elif antes is not None:
+        filtros.append('rowid < ?')
+        params.append(antes)
+    
+    where = ('WHERE ' + ' AND '.join(filtros)) if filtros else ''
+    ordenacao = 'score DESC, rowid DESC' if ordem == 'score' else 'rowid DESC'
+    rows = get_db().execute(
+        f'SELECT rowid AS id, * FROM promocoes {where} ORDER BY {ordenacao} LIMIT ?',
+        params + [limite + 1]
+    ).fetchall()
+    
+    promocoes = [dict(row) for row in rows[:limite]]
+    proximo = None
+    if len(rows) > limite:
+        ultima = promocoes[-1]
+        proximo = f"{ultima['score']}:{ultima['id']}" if ordem == 'score' else ultima['id']
+    return promocoes, proximo
+
+def get_promocoes(tipo=None, limite=100):
+    return consultar_promocoes(tipo=tipo, limite=limite)[0]
+
+# Contadores mantidos por triggers: get_stats lê uma linha em vez de
+# varrer a tabela inteira
+SQL_ESTATISTICAS = '''
+    SELECT 1,
+           COALESCE(SUM(tipo IS 'passagem'), 0),
+           COALESCE(SUM(tipo IS 'milhas'), 0),
+           COALESCE(SUM(tipo IS 'transferencia_bonificada'), 0),
+           (SELECT MIN(preco) FROM promocoes WHERE preco > 0),
+           (SELECT MAX(bonus_percentual) FROM promocoes)
+    FROM promocoes
+'''
+
+def _criar_estatisticas(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS estatisticas (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            passagens INTEGER NOT NULL,
+            milhas INTEGER NOT NULL,
+            bonificadas INTEGER NOT NULL,
+            menor_preco REAL,
+            maior_bonus INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS estatisticas_insert AFTER INSERT ON promocoes BEGIN
+            UPDATE estatisticas SET
+                passagens = passagens + (NEW.tipo IS 'passagem'),
+                milhas = milhas + (NEW.tipo IS 'milhas'),
+                bonificadas = bonificadas + (NEW.tipo IS 'transferencia_bonificada'),
+                menor_preco = CASE WHEN NEW.preco > 0 AND (menor_preco IS NULL OR NEW.preco < menor_preco)
+                                   THEN NEW.preco ELSE menor_preco END,
+                maior_bonus = CASE WHEN NEW.bonus_percentual > maior_bonus OR maior_bonus IS NULL
+                                   THEN COALESCE(NEW.bonus_percentual, maior_bonus) ELSE maior_bonus END
+            WHERE id = 1;
+        END
+    ''')
+    # Remoção/alteração do mínimo ou do máximo: só aí recalcula o extremo
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS estatisticas_delete AFTER DELETE ON promocoes BEGIN
+            UPDATE estatisticas SET
+                passagens = passagens - (OLD.tipo IS 'passagem'),
+                milhas = milhas - (OLD.tipo IS 'milhas'),
+                bonificadas = bonificadas - (OLD.tipo IS 'transferencia_bonificada'),
+                menor_preco = CASE WHEN OLD.preco = menor_preco
+                                   THEN (SELECT MIN(preco) FROM promocoes WHERE preco > 0) ELSE menor_preco END,
+                maior_bonus = CASE WHEN OLD.bonus_percentual = maior_bonus
+                                   THEN (SELECT MAX(bonus_percentual) FROM promocoes) ELSE maior_bonus END
+            WHERE id = 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS estatisticas_update
+        AFTER UPDATE OF tipo, preco, bonus_percentual ON promocoes BEGIN
+            UPDATE estatisticas SET
+                passagens = passagens - (OLD.tipo IS 'passagem') + (NEW.tipo IS 'passagem'),
+                milhas = milhas - (OLD.tipo IS 'milhas') + (NEW.tipo IS 'milhas'),
+                bonificadas = bonificadas - (OLD.tipo IS 'transferencia_bonificada')
+                                          + (NEW.tipo IS 'transferencia_bonificada'),
+                menor_preco = CASE WHEN OLD.preco = menor_preco
+                                   THEN (SELECT MIN(preco) FROM promocoes WHERE preco > 0)
+                                   WHEN NEW.preco > 0 AND (menor_preco IS NULL OR NEW.preco < menor_preco)
+                                   THEN NEW.preco ELSE menor_preco END,
+                maior_bonus = CASE WHEN OLD.bonus_percentual = maior_bonus
+                                   THEN (SELECT MAX(bonus_percentual) FROM promocoes)
+                                   WHEN NEW.bonus_percentual > maior_bonus OR maior_bonus IS NULL
+                                   THEN COALESCE(NEW.bonus_percentual, maior_bonus) ELSE maior_bonus END
+            WHERE id = 1;
+        END
+    ''')
+    # Primeira vez (ou banco antigo): calcula a partir do histórico
+    if not conn.execute('SELECT 1 FROM estatisticas WHERE id = 1').fetchone():
+        conn.execute('INSERT INTO estatisticas ' + SQL_ESTATISTICAS)
+
+def reconstruir_estatisticas():
+    """Recalcula os contadores do zero (se algum dia divergirem)"""
+    conn = get_db()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO estatisticas ' + SQL_ESTATISTICAS)
+        marcar_dados_alterados(conn)
+    return get_stats()
+
+@metricas.cronometrado('db_segundos', operacao='get_stats')
+def get_stats():
+    row = get_db().execute(
+        'SELECT passagens, milhas, bonificadas, menor_preco, maior_bonus FROM estatisticas WHERE id = 1'
+    ).fetchone()
+    stats = dict(row) if row else {
+        'passagens': 0, 'milhas': 0, 'bonificadas': 0, 'menor_preco': None, 'maior_bonus': None
+    }
+    stats['total'] = stats['passagens'] + stats['milhas'] + stats['bonificadas']
+    return stats
+
+def get_ultima_atualizacao():
+    conn = get_db()
+    row = conn.execute("SELECT value FROM config WHERE key='ultima_atualizacao'").fetchone()
+    return row[0] if row else None
+
+def set_ultima_atualizacao():
+    conn = get_db()
+    now = datetime.now().strftime("%d/%m/%Y %H:%M")
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO config VALUES ('ultima_atualizacao', ?)", (now,))
+        marcar_dados_alterados(conn)
+    return now
+
+# ============================================================
+# CACHE DE RESPOSTAS
+# ============================================================
+
+# Os dados só mudam quando uma atualização roda; cada mudança incrementa
+# 'versao_dados' no config e invalida tudo o que foi cacheado antes.
+CACHE_MAX_ENTRADAS = int(os.environ.get('CACHE_MAX_ENTRADAS', 256))
+VERSAO_TTL = 1.0   # segundos entre releituras da versão (outros workers)
+
+_versao = {'valor': None, 'lido_em': 0.0}
+
+def marcar_dados_alterados(conn, reescrita=False):
+    """Incrementa a versão dos dados (chamar dentro da transação que alterou).
+
+    reescrita=True quando linhas existentes mudaram ou sumiram (UPDATE,
+    DELETE, VACUUM), não só entraram novas.
+    """
+    chaves = ('versao_dados', 'versao_reescrita') if reescrita else ('versao_dados',)
+    for chave in chaves:
+        conn.execute('''
+            INSERT INTO config VALUES (?, '1')
+            ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+        ''', (chave,))
+    _versao['lido_em'] = 0.0  # relê na próxima consulta deste processo
+
+def versao_dados():
+    agora = time.monotonic()
+    if _versao['valor'] is None or agora - _versao['lido_em'] > VERSAO_TTL:
+        row = get_db().execute("SELECT value FROM config WHERE key='versao_dados'").fetchone()
+        _versao['valor'] = row[0] if row else '0'
+        _versao['lido_em'] = agora
+    return _versao['valor']
+
+class CacheRespostas:
+    """LRU de respostas prontas: chave -> (versao, etag, corpo, mimetype)"""
+
+    def __init__(self, max_entradas):
+        self.max_entradas = max_entradas
+        self.entradas = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, chave, versao):
+        with self.lock:
+            entrada = self.entradas.get(chave)
+            if entrada is None:
+                return None
+            if entrada[0] != versao:
+                del self.entradas[chave]
+                return None
+            self.entradas.move_to_end(chave)
+            return entrada
+
+    def put(self, chave, entrada):
+        with self.lock:
+            self.entradas[chave] = entrada
+            self.entradas.move_to_end(chave)
+            while len(self.entradas) > self.max_entradas:
+                self.entradas.popitem(last=False)
+
+    def limpar(self):
+        with self.lock:
+            self.entradas.clear()
+
+cache_respostas = CacheRespostas(CACHE_MAX_ENTRADAS)
+
+def guardar_resposta(chave, versao, corpo, mimetype):
+    etag = f"{versao}-{hashlib.md5(corpo).hexdigest()[:16]}"
+    entrada = (versao, etag, corpo, mimetype)
+    cache_respostas.put(chave, entrada)
+    return entrada
+
+def cache_resposta(view):
+    """Cacheia a resposta da rota por (caminho, query string) e versão dos dados"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        versao = versao_dados()
+        chave = (request.path, tuple(sorted(request.args.items(multi=True))))
+        entrada = cache_respostas.get(chave, versao)
+        if entrada is None:
+            resposta = app.make_response(view(*args, **kwargs))
+            if resposta.status_code != 200:
+                return resposta
+            entrada = guardar_resposta(chave, versao, resposta.get_data(), resposta.mimetype)
+        
+        _, etag, corpo, mimetype = entrada
+        resposta = app.response_class(corpo, mimetype=mimetype)
+        resposta.set_etag(etag)
+        # O navegador sempre revalida; se nada mudou recebe 304 sem corpo
+        resposta.headers['Cache-Control'] = 'no-cache'
+        return resposta.make_conditional(request)
+    return wrapper
+
+# ============================================================
+# PROMOÇÕES RECENTES EM MEMÓRIA
+# ============================================================
+
+# Quase toda leitura do dashboard e da API é a primeira página, ou as
+# seguintes, das promoções mais novas (filtradas por tipo). Cada processo
+# guarda as últimas RECENTES_MAX num anel, já com o JSON de cada uma
+# pronto, e responde essas páginas sem SQL. O anel segue a versão dos
+# dados: linhas novas (de qualquer worker) entram pelo rowid; UPDATE,
+# DELETE ou VACUUM (versao_reescrita) fazem recarregar tudo.
+RECENTES_MAX = int(os.environ.get('RECENTES_MAX', 2000))
+
+# Valores repetidos em todas as linhas: uma cópia só por processo
+CAMPOS_INTERNADOS = ('tipo', 'fonte', 'programa', 'destino', 'origem')
+
+class RegistroPromocao:
+    """Uma linha de promocoes (rowid AS id, *) e o JSON dela"""
+    __slots__ = ('id', 'hash_id', 'tipo', 'titulo', 'url', 'fonte', 'data_encontrada', 'preco',
+                 'bonus_percentual', 'programa', 'destino', 'notificado', 'origem', 'score', 'mediana',
+                 'criado_em', 'json')
+    CAMPOS = __slots__[:-1]
+
+    def __init__(self, row):
+        for campo in self.CAMPOS:
+            valor = row[campo]
+            if campo in CAMPOS_INTERNADOS and valor is not None:
+                valor = sys.intern(valor)
+            setattr(self, campo, valor)
+        # Mesmo formato do jsonify (chaves ordenadas, compacto)
+        self.json = app.json.dumps(self.como_dict(), separators=(',', ':'))
+
+    def como_dict(self):
+        return {campo: getattr(self, campo) for campo in self.CAMPOS}
+
+    def casa(self, tipo, preco_min, preco_max, destino, programa, fonte):
+        if tipo and tipo != 'todas' and self.tipo != tipo:
+            return False
+        if destino and self.destino != destino:
+            return False
+        if programa and self.programa != programa:
+            return False
+        if fonte and self.fonte != fonte:
+            return False
+        if preco_min is not None and (self.preco is None or self.preco < preco_min):
+            return False
+        if preco_max is not None and (self.preco is None or self.preco > preco_max):
+            return False
+        return True
+
+class PromocoesRecentes:
+    """Anel com as últimas promoções por rowid (a mais antiga em `inicio`)"""
+
+    def __init__(self, capacidade):
+        self.capacidade = capacidade
+        self.anel = [None] * capacidade
+        self.inicio = 0
+        self.tamanho = 0
+        self.completo = True     # o anel tem a tabela inteira
+        self.versao = None
+        self.reescrita = None
+        self.lock = threading.Lock()
+
+    def _em(self, i):
+        """i-ésima da mais antiga para a mais nova"""
+        return self.anel[(self.inicio + i) % self.capacidade]
+
+    def _acrescentar(self, registro):
+        if self.tamanho < self.capacidade:
+            self.anel[(self.inicio + self.tamanho) % self.capacidade] = registro
+            self.tamanho += 1
+        else:
+            self.anel[self.inicio] = registro
+            self.inicio = (self.inicio + 1) % self.capacidade
+            self.completo = False
+
+    def _recarregar(self, conn):
+        rows = conn.execute('SELECT rowid AS id, * FROM promocoes ORDER BY rowid DESC LIMIT ?',
+                            (self.capacidade,)).fetchall()
+        self.anel = [None] * self.capacidade
+        self.inicio = self.tamanho = 0
+        for row in reversed(rows):
+            self._acrescentar(RegistroPromocao(row))
+        self.completo = len(rows) < self.capacidade
+
+    def _novas(self, conn):
+        ultimo = self._em(self.tamanho - 1).id if self.tamanho else 0
+        rows = conn.execute('SELECT rowid AS id, * FROM promocoes WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                            (ultimo, self.capacidade + 1)).fetchall()
+        if len(rows) > self.capacidade:
+            self._recarregar(conn)
+            return
+        for row in rows:
+            self._acrescentar(RegistroPromocao(row))
+
+    def sincronizar(self):
+        versao = versao_dados()
+        if versao == self.versao:
+            return
+        with self.lock:
+            if versao == self.versao:
+                return
+            conn = get_db()
+            row = conn.execute("SELECT value FROM config WHERE key='versao_reescrita'").fetchone()
+            reescrita = row[0] if row else '0'
+            if self.versao is None or reescrita != self.reescrita:
+                self._recarregar(conn)
+                metricas.contar('recentes_recargas_total', modo='completa')
+            else:
+                self._novas(conn)
+                metricas.contar('recentes_recargas_total', modo='novas')
+            self.versao, self.reescrita = versao, reescrita
+
+    def pagina(self, tipo=None, antes=None, preco_min=None, preco_max=None,
+               destino=None, programa=None, fonte=None, limite=50):
+        """(registros, proximo) como em consultar_promocoes, ou None se a
+        página passa do que está no anel"""
+        self.sincronizar()
+        with self.lock:
+            fim = self.tamanho
+            if antes is not None:
+                # rowids crescem ao longo do anel: busca binária pela posição
+                baixo, alto = 0, self.tamanho
+                while baixo < alto:
+                    meio = (baixo + alto) // 2
+                    if self._em(meio).id < antes:
+                        baixo = meio + 1
+                    else:
+                        alto = meio
+                fim = baixo
+            registros = []
+            for i in range(fim - 1, -1, -1):
+                registro = self._em(i)
+                if registro.casa(tipo, preco_min, preco_max, destino, programa, fonte):
+                    registros.append(registro)
+                    if len(registros) > limite:
+                        break
+            else:
+                if not self.completo:
+                    metricas.contar('recentes_consultas_total', resultado='sql')
+                    return None
+        metricas.contar('recentes_consultas_total', resultado='memoria')
+        proximo = registros[limite - 1].id if len(registros) > limite else None
+        return registros[:limite], proximo
+
+promocoes_recentes = PromocoesRecentes(RECENTES_MAX)
+
+# ============================================================
+# BUSCA (FTS5)
+# ============================================================
+
+FTS_DISPONIVEL = False
+
+def _criar_busca(conn):
+    """Índice FTS5 sobre a tabela promocoes, sincronizado por triggers"""
+    global FTS_DISPONIVEL
+    existia = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'promocoes_fts'"
+    ).fetchone()
+    if not existia:
+        # remove_diacritics 2 (SQLite >= 3.27) também ignora acento: "milao" acha "Milão"
+        for tokenizer in ('unicode61 remove_diacritics 2', 'unicode61 remove_diacritics 1'):
+            try:
+                conn.execute(f'''
+                    CREATE VIRTUAL TABLE promocoes_fts USING fts5(
+                        titulo, destino, programa, fonte,
+                        content='promocoes', content_rowid='rowid',
+                        tokenize='{tokenizer}'
+                    )
+                ''')
+                break
+            except sqlite3.OperationalError:
+                continue
+        else:
+            return  # SQLite sem FTS5: /api/busca fica indisponível
+        # Título pesa mais que destino/programa, que pesam mais que a fonte
+        conn.execute("INSERT INTO promocoes_fts(promocoes_fts, rank) VALUES('rank', 'bm25(10.0, 5.0, 5.0, 1.0)')")
+        conn.execute("INSERT INTO promocoes_fts(promocoes_fts) VALUES('rebuild')")
+    
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS promocoes_fts_insert AFTER INSERT ON promocoes BEGIN
+            INSERT INTO promocoes_fts(rowid, titulo, destino, programa, fonte)
+            VALUES (NEW.rowid, NEW.titulo, NEW.destino, NEW.programa, NEW.fonte);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS promocoes_fts_delete AFTER DELETE ON promocoes BEGIN
+            INSERT INTO promocoes_fts(promocoes_fts, rowid, titulo, destino, programa, fonte)
+            VALUES ('delete', OLD.rowid, OLD.titulo, OLD.destino, OLD.programa, OLD.fonte);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS promocoes_fts_update
+        AFTER UPDATE OF titulo, destino, programa, fonte ON promocoes BEGIN
+            INSERT INTO promocoes_fts(promocoes_fts, rowid, titulo, destino, programa, fonte)
+            VALUES ('delete', OLD.rowid, OLD.titulo, OLD.destino, OLD.programa, OLD.fonte);
+            INSERT INTO promocoes_fts(rowid, titulo, destino, programa, fonte)
+            VALUES (NEW.rowid, NEW.titulo, NEW.destino, NEW.programa, NEW.fonte);
+        END
+    ''')
+    FTS_DISPONIVEL = True
+
+def _consulta_fts(texto):
+    """'Smiles 100%' -> '"smiles"* "100"' (todos os termos; palavras por prefixo)"""
+    termos = re.findall(r'\w+', texto.lower())
+    return ' '.join(f'"{t}"' if t.isdigit() else f'"{t}"*' for t in termos)
+
+@metricas.cronometrado('db_segundos', operacao='buscar_texto')
+def buscar_texto(texto, limite=20):
+    """Busca no histórico, ordenada por relevância (BM25), com trecho destacado"""
+    consulta = _consulta_fts(texto)
+    if not consulta:
+        return []
+    rows = get_db().execute('''
+        SELECT p.rowid AS id, p.*,
+               snippet(promocoes_fts, 0, char(2), char(3), '…', 16) AS trecho
+        FROM promocoes_fts
+        JOIN promocoes p ON p.rowid = promocoes_fts.rowid
+        WHERE promocoes_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    ''', (consulta, limite)).fetchall()
+    
+    resultados = []
+    for row in rows:
+        promo = dict(row)
+        # Escapa o título e só então troca os marcadores por <mark>
+        trecho = html_escape(promo['trecho'] or '')
+        promo['trecho'] = trecho.replace('\x02', '<mark>').replace('\x03', '</mark>')
+        resultados.append(promo)
+    return resultados
+
+# ============================================================
+# SCRAPERS
+# ============================================================
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36',
+    'Accept-Language': 'pt-BR,pt;q=0.9',
+}
+
+# Concorrência do scraping
+TIMEOUT_FONTE = 15           # segundos por página
+PRAZO_ATUALIZACAO = 20       # segundos para a rodada inteira
+MAX_CONEXOES_POR_HOST = 2    # não martela o mesmo site
+MAX_DOWNLOADS = 8            # threads do pool de downloads
+
+def _criar_sessao():
+    """Sessão HTTP compartilhada: reaproveita conexões (keep-alive) e aceita compressão"""
+    sessao = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=MAX_DOWNLOADS)
+    sessao.mount('https://', adapter)
+    sessao.mount('http://', adapter)
+    sessao.headers.update(HEADERS)
+    try:
+        import brotli  # noqa: F401 - o urllib3 só decodifica br se o módulo existir
+        sessao.headers['Accept-Encoding'] = 'gzip, deflate, br'
+    except ImportError:
+        sessao.headers['Accept-Encoding'] = 'gzip, deflate'
+    return sessao
+
+sessao_http = _criar_sessao()
+
+_semaforos_host = {}
+_semaforos_lock = threading.Lock()
+
+def _semaforo_host(url):
+    """Limita downloads simultâneos por host"""
+    host = urlparse(url).netloc
+    with _semaforos_lock:
+        if host not in _semaforos_host:
+            _semaforos_host[host] = threading.BoundedSemaphore(MAX_CONEXOES_POR_HOST)
+        return _semaforos_host[host]
+
+def _cabecalhos_condicionais(url):
+    """If-None-Match / If-Modified-Since a partir da última resposta da URL"""
+    try:
+        row = get_db().execute(
+            'SELECT etag, last_modified FROM http_cache WHERE url = ?', (url,)
+        ).fetchone()
+    except sqlite3.Error:
+        return {}
+    cabecalhos = {}
+    if row and row['etag']:
+        cabecalhos['If-None-Match'] = row['etag']
+    if row and row['last_modified']:
+        cabecalhos['If-Modified-Since'] = row['last_modified']
+    return cabecalhos
+
+def _validadores(url, resposta):
+    """(url, etag, last_modified) da resposta, ou None se ela não tem nenhum"""
+    etag = resposta.headers.get('ETag')
+    last_modified = resposta.headers.get('Last-Modified')
+    if not etag and not last_modified:
+        return None
+    return (url, etag, last_modified)
+
+def salvar_validadores(conn, validadores):
+    """Grava os validadores HTTP (chamar dentro da transação que salvou as
+    promoções da página: só depois disso um 304 pode pular a página)"""
+    conn.executemany('INSERT OR REPLACE INTO http_cache VALUES (?,?,?)', validadores)
+
+# Resposta 304: a página respondeu, mas não mudou desde a última extração
+NAO_MODIFICADA = object()
+
+def fetch(url, timeout=TIMEOUT_FONTE):
+    """Baixa a página. Retorna (html, validadores); html é None em erro e
+    NAO_MODIFICADA se não mudou (304). Os validadores só devem ser gravados
+    depois que as promoções da página forem salvas."""
+    host = urlparse(url).hostname
+    try:
+        with _semaforo_host(url), metricas.medir('fetch_segundos', host=host):
+            r = sessao_http.get(url, headers=_cabecalhos_condicionais(url), timeout=timeout)
+        metricas.contar('fetch_respostas_total', host=host, status=r.status_code)
+        metricas.contar('fetch_bytes_total', len(r.content), host=host)
+        if r.status_code == 304:
+            return NAO_MODIFICADA, None
+        if not r.ok:
+            return None, None
+        return r.text, _validadores(url, r)
+    except:
+        metricas.contar('fetch_erros_total', host=host)
+        return None, None
+
+# ============================================================
+# PARSING
+# ============================================================
+
+# 'stream': extrator próprio que para no limite de artigos (padrão); dá o
+#     mesmo resultado da árvore completa do html.parser
+# 'lxml' / 'html.parser': BeautifulSoup montando só os nós de artigo. Em
+#     HTML quebrado pode divergir: o que está fora dos artigos não existe
+#     para o seletor de link nem para fechar tags (e o lxml ainda conserta
+#     o HTML do jeito dele)
+PARSER_HTML = os.environ.get('PARSER_HTML', 'stream')
+
+try:
+    import lxml  # noqa: F401
+    LXML_DISPONIVEL = True
+except ImportError:
+    LXML_DISPONIVEL = False
+
+# Tags sem fechamento: não entram na pilha do extrator
+TAGS_VAZIAS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+               'link', 'meta', 'source', 'track', 'wbr'}
+# Texto dentro delas não entra no get_text() do BeautifulSoup
+TAGS_SEM_TEXTO = {'script', 'style', 'template', 'rt', 'rp'}
+
+def _parse_seletor_simples(seletor):
+    """'a.post-title' -> ('a', {'post-title'}); '.post' -> (None, {'post'})"""
+    tag, *classes = seletor.split('.')
+    return (tag or None, set(classes))
+
+def _parse_seletores(seletores):
+    """'h2 a, h3 a' -> [[('h2', set()), ('a', set())], [('h3', set()), ('a', set())]]"""
+    return [[_parse_seletor_simples(p) for p in s.split()]
+            for s in seletores.split(',') if s.strip()]
+
+def _casa_simples(simples, tag, classes):
+    nome, cls = simples
+    return (nome is None or nome == tag) and cls <= classes
+
+def _casa_composto(composto, tag, classes, pilha):
+    """Último seletor casa o elemento; os anteriores, ancestrais em ordem"""
+    if not _casa_simples(composto[-1], tag, classes):
+        return False
+    i = len(composto) - 2
+    for anc_tag, anc_classes in reversed(pilha):
+        if i < 0:
+            break
+        if _casa_simples(composto[i], anc_tag, anc_classes):
+            i -= 1
+    return i < 0
+
+class _LimiteAtingido(Exception):
+    pass
+
+class ExtratorArtigos(HTMLParser):
+    """Extrator em streaming: lê o HTML até fechar `limite` artigos e para.
+
+    Não monta árvore nenhuma; só acompanha a pilha de tags e guarda o
+    título e o href do primeiro link de cada artigo (equivalente a
+    ``soup.select(artigo)[:limite]`` + ``select_one(link)``).
+
+    A referência é a árvore inteira do html.parser (o caminho antigo),
+    inclusive em HTML quebrado: tag sem fechar fica aberta até o fim (um
+    ``<li>`` sem ``</li>`` aninha o seguinte, e os dois contam), fechamento
+    sem abertura é ignorado, e um ``<a>`` pode ser o link dos artigos de
+    fora e, ao mesmo tempo, um artigo.
+    """
+
+    def __init__(self, seletor_artigo, seletor_link, limite):
+        super().__init__(convert_charrefs=True)
+        self.artigos = [s[0] for s in _parse_seletores(seletor_artigo)]
+        self.links = _parse_seletores(seletor_link)
+        self.limite = limite
+        # Um por artigo, na ordem do documento: None (aberto, sem link ainda),
+        # False (fechou sem link) ou (título, href)
+        self.artigos_achados = []
+        self.abertos = []          # (tamanho da pilha quando abriu, índice) dos artigos abertos
+        self.pilha = []
+        self.capturas = []         # [href, nível, textos, índices dos artigos] dos links abertos
+        self.texto = []
+
+    @property
+    def resultado(self):
+        return [a for a in self.artigos_achados[:self.limite] if a]
+
+    def _fechar_texto(self):
+        if self.capturas and self.texto:
+            pedaco = ''.join(self.texto).strip()
+            if pedaco:
+                for captura in self.capturas:
+                    captura[2].append(pedaco)
+        self.texto = []
+
+    def handle_starttag(self, tag, attrs):
+        self._fechar_texto()
+        if tag in TAGS_VAZIAS:
+            return
+        attrs = dict(attrs)
+        classes = set((attrs.get('class') or '').split())
+        if self.abertos:
+            # Artigos ainda sem link e que nenhum link aberto vai resolver
+            capturados = {i for captura in self.capturas for i in captura[3]}
+            sem_link = [i for _, i in self.abertos
+                        if self.artigos_achados[i] is None and i not in capturados]
+            if sem_link and any(_casa_composto(c, tag, classes, self.pilha) for c in self.links):
+                self.capturas.append([attrs.get('href') or '', len(self.pilha), [], sem_link])
+        # Um <a> pode ser link dos artigos de fora e artigo ele mesmo
+        if any(_casa_simples(a, tag, classes) for a in self.artigos):
+            self.abertos.append((len(self.pilha), len(self.artigos_achados)))
+            self.artigos_achados.append(None)
+        self.pilha.append((tag, classes))
+
+    def handle_endtag(self, tag):
+        self._fechar_texto()
+        # HTML real tem tags sem fechar: desempilha até a correspondente
+        for i in range(len(self.pilha) - 1, -1, -1):
+            if self.pilha[i][0] == tag:
+                break
+        else:
+            return
+        del self.pilha[i:]
+        self._resolver()
+        # Os `limite` primeiros artigos já estão resolvidos: o resto não importa
+        if len(self.artigos_achados) >= self.limite and None not in self.artigos_achados[:self.limite]:
+            raise _LimiteAtingido
+
+    def _resolver(self):
+        """Fecha os links e os artigos que ficaram acima do topo da pilha"""
+        while self.capturas and len(self.pilha) <= self.capturas[-1][1]:
+            href, _, textos, sem_link = self.capturas.pop()
+            for i in sem_link:
+                self.artigos_achados[i] = (''.join(textos), href)
+        while self.abertos and len(self.pilha) <= self.abertos[-1][0]:
+            _, i = self.abertos.pop()
+            if self.artigos_achados[i] is None:
+                self.artigos_achados[i] = False
+
+    def handle_data(self, data):
+        if self.capturas and not any(t in TAGS_SEM_TEXTO for t, _ in self.pilha):
+            self.texto.append(data)
+
+    def handle_comment(self, data):
+        self._fechar_texto()  # comentário separa os textos, como na árvore
+
+    def close(self):
+        super().close()
+        # Fim do documento fecha tudo o que ficou aberto, como na árvore
+        self._fechar_texto()
+        self.pilha = []
+        self._resolver()
+
+def _extrair_links_stream(html, seletor_artigo, seletor_link, limite):
+    extrator = ExtratorArtigos(seletor_artigo, seletor_link, limite)
+    try:
+        # Em blocos, para poder parar cedo sem varrer o resto da página
+        for i in range(0, len(html), 32768):
+            extrator.feed(html[i:i + 32768])
+        extrator.close()
+    except _LimiteAtingido:
+        pass
+    return extrator.resultado
+
+def _filtro_artigos(seletor_artigo):
+    """SoupStrainer que só constrói os nós que casam com o seletor de artigo"""
+    artigos = [s[0] for s in _parse_seletores(seletor_artigo)]
+
+    def casa(nome, attrs):
+        classes = attrs.get('class') or ''
+        if isinstance(classes, str):
+            classes = classes.split()
+        return any(_casa_simples(a, nome, set(classes)) for a in artigos)
+    return SoupStrainer(casa)
+
+def _extrair_links_soup(html, seletor_artigo, seletor_link, limite, parser):
+    soup = BeautifulSoup(html, parser, parse_only=_filtro_artigos(seletor_artigo))
+    links = []
+    for article in soup.select(seletor_artigo)[:limite]:
+        link_elem = article.select_one(seletor_link)
+        if link_elem:
+            links.append((link_elem.get_text(strip=True), link_elem.get('href', '')))
+    return links
+
+def extrair_links(html, seletor_artigo, seletor_link, limite, parser=None):
+    """Título e href do link principal dos primeiros `limite` artigos da página"""
+    parser = parser or PARSER_HTML
+    if parser == 'lxml' and not LXML_DISPONIVEL:
+        parser = 'html.parser'
+    with metricas.medir('parse_segundos', parser=parser):
+        if parser == 'stream':
+            return _extrair_links_stream(html, seletor_artigo, seletor_link, limite)
+        return _extrair_links_soup(html, seletor_artigo, seletor_link, limite, parser)
+
+# ============================================================
+# EXTRAÇÃO
+# ============================================================
+
+# Apelido (minúsculo, sem acento) -> nome exibido. Pode crescer para
+# milhares de cidades: a busca é uma regex em trie, não um loop.
+DESTINOS = {
+    'miami': 'Miami', 'orlando': 'Orlando',
+    'nova york': 'Nova York', 'new york': 'Nova York', 'nova iorque': 'Nova York',
+    'paris': 'Paris', 'londres': 'Londres', 'roma': 'Roma', 'lisboa': 'Lisboa',
+    'porto': 'Porto', 'madrid': 'Madrid', 'madri': 'Madrid', 'barcelona': 'Barcelona',
+    'cancun': 'Cancún', 'buenos aires': 'Buenos Aires', 'santiago': 'Santiago',
+    'dubai': 'Dubai', 'tokyo': 'Tóquio', 'toquio': 'Tóquio', 'los angeles': 'Los Angeles',
+    'milao': 'Milão', 'amsterdam': 'Amsterdam', 'amsterda': 'Amsterdam', 'berlim': 'Berlim',
+    # Mais longos vencem: "Porto Alegre" não vira "Porto"
+    'porto alegre': 'Porto Alegre', 'porto seguro': 'Porto Seguro',
+}
+
+# Código IATA (maiúsculo, no título original) -> nome exibido
+IATA = {
+    'MIA': 'Miami', 'MCO': 'Orlando', 'JFK': 'Nova York', 'EWR': 'Nova York',
+    'CDG': 'Paris', 'ORY': 'Paris', 'LHR': 'Londres', 'LGW': 'Londres', 'FCO': 'Roma',
+    'LIS': 'Lisboa', 'OPO': 'Porto', 'MAD': 'Madrid', 'BCN': 'Barcelona', 'CUN': 'Cancún',
+    'EZE': 'Buenos Aires', 'AEP': 'Buenos Aires', 'SCL': 'Santiago', 'DXB': 'Dubai',
+    'NRT': 'Tóquio', 'HND': 'Tóquio', 'LAX': 'Los Angeles', 'MXP': 'Milão',
+    'AMS': 'Amsterdam', 'BER': 'Berlim',
+}
+
+# Cidades de partida: "saindo de Porto Alegre", "voos de São Paulo para..."
+ORIGENS = {
+    'sao paulo': 'São Paulo', 'rio de janeiro': 'Rio de Janeiro', 'rio': 'Rio de Janeiro',
+    'belo horizonte': 'Belo Horizonte', 'brasilia': 'Brasília', 'porto alegre': 'Porto Alegre',
+    'curitiba': 'Curitiba', 'florianopolis': 'Florianópolis', 'recife': 'Recife',
+    'salvador': 'Salvador', 'fortaleza': 'Fortaleza', 'campinas': 'Campinas',
+    'belem': 'Belém', 'manaus': 'Manaus', 'goiania': 'Goiânia', 'natal': 'Natal',
+}
+
+IATA_ORIGENS = {
+    'GRU': 'São Paulo', 'CGH': 'São Paulo', 'VCP': 'Campinas', 'GIG': 'Rio de Janeiro',
+    'SDU': 'Rio de Janeiro', 'CNF': 'Belo Horizonte', 'BSB': 'Brasília', 'POA': 'Porto Alegre',
+    'CWB': 'Curitiba', 'FLN': 'Florianópolis', 'REC': 'Recife', 'SSA': 'Salvador',
+    'FOR': 'Fortaleza', 'BEL': 'Belém', 'MAO': 'Manaus', 'GYN': 'Goiânia', 'NAT': 'Natal',
+}
+
+PROGRAMAS = {
+    'smiles': 'Smiles', 'latam': 'LATAM Pass', 'latampass': 'LATAM Pass',
+    'azul': 'TudoAzul', 'tudoazul': 'TudoAzul', 'livelo': 'Livelo', 'esfera': 'Esfera',
+}
+
+# Arquivo opcional com mais destinos, uma linha "apelido;Nome" ou "GRU;São Paulo"
+DESTINOS_ARQUIVO = os.environ.get('DESTINOS_ARQUIVO', '')
+
+def normalizar(texto):
+    """Minúsculas e sem acento: 'Milão' -> 'milao'"""
+    decomposto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+def _regex_trie(palavras):
+    """Alternação fatorada por prefixo; com vários candidatos, o mais longo vence"""
+    trie = {}
+    for palavra in palavras:
+        no = trie
+        for c in palavra:
+            no = no.setdefault(c, {})
+        no[''] = {}
+    
+    def montar(no):
+        fim = '' in no
+        ramos = [re.escape(c) + montar(filho) for c, filho in sorted(no.items()) if c]
+        if not ramos:
+            return ''
+        if len(ramos) == 1 and not fim:
+            return ramos[0]
+        grupo = '(?:' + '|'.join(ramos) + ')'
+        return grupo + '?' if fim else grupo
+    
+    return montar(trie)
+
+class MotorExtracao:
+    """Extrai preço, bônus, destino e programa de um título numa passada só.
+
+    O título é normalizado uma vez e percorrido por uma única regex com um
+    grupo nomeado por campo; destinos e programas viram tries compiladas,
+    então o custo não cresce linearmente com o tamanho dos dicionários.
+    """
+
+    def __init__(self, destinos, programas, iata, origens=None, iata_origens=None):
+        self.destinos = {normalizar(k): v for k, v in destinos.items()}
+        self.programas = {normalizar(k): v for k, v in programas.items()}
+        self.iata = dict(iata)
+        # Origem: cidade conhecida depois de "saindo de"/"partindo de", ou
+        # depois de "de" quando o título também tem um destino
+        self.origens = {**self.destinos, **{normalizar(k): v for k, v in (origens or {}).items()}}
+        self.iata_origens = {**self.iata, **(iata_origens or {})}
+        self.regex = re.compile(
+            r'r\$\s*(?P<preco>[\d.,]+)'
+            r'|(?P<pct>\d+)\s*%'
+            r'|\b(?P<bonus>bonus\b|bonificad)'
+            rf'|\b(?P<programa>{_regex_trie(self.programas)})\b'
+            rf'|\b(?P<saindo>saindo |partindo )?de (?P<origem>{_regex_trie(self.origens)})\b'
+            rf'|\b(?P<destino>{_regex_trie(self.destinos)})\b'
+        )
+        self.regex_iata = re.compile(r'\b[A-Z]{3}\b')
+        # "GRU-LIS", "GRU x LIS", "GRU → LIS"
+        self.regex_trecho = re.compile(r'\b([A-Z]{3})\s*(?:-|–|→|x|/)\s*([A-Z]{3})\b')
+
+    def extrair(self, titulo):
+        campos = {'preco': None, 'bonus_percentual': None, 'destino': None,
+                  'programa': None, 'origem': None, 'is_bonus': False}
+        viu_preco = False
+        de_cidade = None  # "de <cidade>" sem "saindo": origem ou destino, conforme o resto
+        for m in self.regex.finditer(normalizar(titulo)):
+            grupo = m.lastgroup
+            if grupo == 'preco':
+                if not viu_preco:  # só o primeiro "R$" conta
+                    viu_preco = True
+                    try:
+                        campos['preco'] = float(m.group('preco').replace('.', '').replace(',', '.'))
+                    except ValueError:
+                        pass
+            elif grupo == 'pct':
+                if campos['bonus_percentual'] is None:
+                    campos['bonus_percentual'] = int(m.group('pct'))
+            elif grupo == 'bonus':
+                campos['is_bonus'] = True
+            elif grupo == 'programa':
+                campos['programa'] = campos['programa'] or self.programas[m.group('programa')]
+            elif grupo == 'origem':
+                if m.group('saindo'):
+                    campos['origem'] = campos['origem'] or self.origens[m.group('origem')]
+                elif de_cidade is None:
+                    de_cidade = m.group('origem')
+            elif grupo == 'destino':
+                campos['destino'] = campos['destino'] or self.destinos[m.group('destino')]
+        if de_cidade is not None:
+            # "Passagens de Miami por R$ 1.999": Miami é o destino
+            if campos['destino'] is None and de_cidade in self.destinos:
+                campos['destino'] = self.destinos[de_cidade]
+            elif campos['origem'] is None:
+                campos['origem'] = self.origens[de_cidade]
+        if campos['origem'] is None:
+            m = self.regex_trecho.search(titulo)
+            if m and m.group(1) in self.iata_origens and m.group(2) in self.iata:
+                campos['origem'] = self.iata_origens[m.group(1)]
+                campos['destino'] = campos['destino'] or self.iata[m.group(2)]
+        if campos['destino'] is None and self.iata:
+            for m in self.regex_iata.finditer(titulo):
+                if m.group() in self.iata:
+                    campos['destino'] = self.iata[m.group()]
+                    break
+        return campos
+
+def _carregar_destinos(caminho):
+    destinos, iata = {}, {}
+    with open(caminho, encoding='utf-8') as f:
+        for linha in f:
+            if ';' not in linha or linha.startswith('#'):
+                continue
+            apelido, nome = (p.strip() for p in linha.split(';', 1))
+            if len(apelido) == 3 and apelido.isupper():
+                iata[apelido] = nome
+            else:
+                destinos[apelido] = nome
+    return destinos, iata
+
+def configurar_extracao(destinos=None, programas=None, iata=None):
+    """Recompila o motor com outros dicionários (None mantém o atual)"""
+    global motor_extracao, DESTINOS, PROGRAMAS, IATA
+    DESTINOS = destinos if destinos is not None else DESTINOS
+    PROGRAMAS = programas if programas is not None else PROGRAMAS
+    IATA = iata if iata is not None else IATA
+    motor_extracao = MotorExtracao(DESTINOS, PROGRAMAS, IATA, ORIGENS, IATA_ORIGENS)
+    return motor_extracao
+
+if DESTINOS_ARQUIVO:
+    _extras, _extras_iata = _carregar_destinos(DESTINOS_ARQUIVO)
+    DESTINOS = {**DESTINOS, **_extras}
+    IATA = {**IATA, **_extras_iata}
+
+motor_extracao = MotorExtracao(DESTINOS, PROGRAMAS, IATA, ORIGENS, IATA_ORIGENS)
+
+def extrair_campos(titulo):
+    return motor_extracao.extrair(titulo)
+
+def extrair_preco(texto):
+    return extrair_campos(texto)['preco']
+
+def extrair_bonus(texto):
+    return extrair_campos(texto)['bonus_percentual']
+
+def extrair_destino(texto):
+    return extrair_campos(texto)['destino']
+
+def identificar_programa(texto):
+    return extrair_campos(texto)['programa']
+
+# ============================================================
+# FONTES E AGENDA
+# ============================================================
+
+@dataclass
+class Fonte:
+    """Um site de promoções: de onde baixar, o que ler e de quanto em quanto tempo"""
+    nome: str                      # também vai para promocoes.fonte
+    urls: list                     # [(url, tipo padrão)]
+    base_url: str                  # prefixo de links relativos
+    seletor_artigo: str
+    seletor_link: str
+    limite: int = 20               # artigos lidos por página
+    intervalo_base: float = 1800   # segundos entre buscas, ponto de partida
+    detecta_bonus: bool = False    # "bônus" no título vira transferencia_bonificada
+    intervalo_min: Optional[float] = None
+    intervalo_max: Optional[float] = None
+
+    def __post_init__(self):
+        self.intervalo_min = self.intervalo_min or self.intervalo_base / 4
+        self.intervalo_max = self.intervalo_max or self.intervalo_base * 8
+
+    def extrair(self, html, tipo_default):
+        promocoes = []
+        for titulo, href in extrair_links(html, self.seletor_artigo, self.seletor_link, self.limite):
+            try:
+                if not href.startswith('http'):
+                    href = self.base_url + href
+                
+                campos = extrair_campos(titulo)
+                is_bonus = self.detecta_bonus and campos['is_bonus']
+                tipo = 'transferencia_bonificada' if is_bonus else tipo_default
+                
+                promo = Promocao(
+                    tipo=tipo,
+                    titulo=titulo[:150],
+                    url=href,
+                    fonte=self.nome,
+                    preco=campos['preco'],
+                    bonus_percentual=campos['bonus_percentual'] if is_bonus else None,
+                    programa=campos['programa'],
+                    destino=campos['destino'],
+                    origem=campos['origem']
+                )
+                promocoes.append(promo)
+            except:
+                continue
+        
+        return promocoes
+
+FONTES = {}
+
+def registrar_fonte(fonte):
+    FONTES[fonte.nome] = fonte
+    return fonte
+
+registrar_fonte(Fonte(
+    nome='Melhores Destinos',
+    urls=[
+        ("https://www.melhoresdestinos.com.br/promocoes-de-passagens-aereas", "passagem"),
+        ("https://www.melhoresdestinos.com.br/categoria/milhas-aereas", "milhas"),
+    ],
+    base_url="https://www.melhoresdestinos.com.br",
+    seletor_artigo='article, .post-item',
+    seletor_link='h2 a, h3 a, a.post-title',
+    limite=25,
+    detecta_bonus=True,
+))
+
+registrar_fonte(Fonte(
+    nome='Passagens Imperdíveis',
+    urls=[("https://www.passagensimperdiveis.com.br", "passagem")],
+    base_url="https://www.passagensimperdiveis.com.br",
+    seletor_artigo='article, .post',
+    seletor_link='h2 a, h3 a, a.title',
+    limite=20,
+))
+
+def baixar_fontes(fontes, validadores=None):
+    """Baixa todas as URLs em paralelo. Retorna {nome: (promocoes, respondeu)}.
+
+    Se `validadores` for uma lista, recebe os validadores HTTP das páginas
+    extraídas dentro do prazo, para salvar_promocoes gravar junto.
+    """
+    resultado = {f.nome: ([], False) for f in fontes}
+    tarefas = [(f, url, tipo) for f in fontes for url, tipo in f.urls]
+    if not tarefas:
+        return resultado
+    
+    pool = ThreadPoolExecutor(max_workers=min(MAX_DOWNLOADS, len(tarefas)))
+    futuros = {pool.submit(fetch, url): (fonte, url, tipo) for fonte, url, tipo in tarefas}
+    try:
+        for futuro in as_completed(futuros, timeout=PRAZO_ATUALIZACAO):
+            fonte, url, tipo = futuros[futuro]
+            html, validador = futuro.result()
+            promocoes, respondeu = resultado[fonte.nome]
+            if html is NAO_MODIFICADA:
+                respondeu = True  # rodada sem novidade, não falha
+            elif html:
+                with metricas.medir('fonte_extracao_segundos', fonte=fonte.nome):
+                    promocoes.extend(fonte.extrair(html, tipo))
+                respondeu = True
+                if validador and validadores is not None:
+                    validadores.append(validador)
+            resultado[fonte.nome] = (promocoes, respondeu)
+    except FuturesTimeout:
+        atrasadas = [futuros[f][1] for f in futuros if not f.done()]
+        metricas.contar('fetch_fora_do_prazo_total', len(atrasadas))
+        print(f"Fontes sem resposta no prazo: {atrasadas}")
+    finally:
+        # Não espera as atrasadas: a resposta delas é descartada
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    return resultado
+
+def buscar_fontes(fontes):
+    """Baixa as fontes em paralelo e junta os resultados conforme chegam"""
+    return [p for promocoes, _ in baixar_fontes(fontes).values() for p in promocoes]
+
+def buscar_melhores_destinos():
+    return buscar_fontes([FONTES['Melhores Destinos']])
+
+def buscar_passagens_imperdiveis():
+    return buscar_fontes([FONTES['Passagens Imperdíveis']])
+
+# Intervalo adaptativo: fonte que trouxe novidade é consultada com mais
+# frequência; fonte parada, cada vez menos (dentro de [min, max])
+FATOR_ACELERA = 0.5
+FATOR_DESACELERA = 1.5
+FOLGA_AGENDA = 120   # o cron externo não é pontual: "quase vencida" conta
+# O líder confere a agenda sozinho (o cron não consegue seguir um
+# intervalo_min menor que o período dele); o cron continua acordando o
+# serviço nos planos que dormem sem tráfego. AGENDA_INTERNA=0 desliga.
+AGENDA_INTERNA = os.environ.get('AGENDA_INTERNA', '1') == '1'
+AGENDA_VERIFICACAO = 60   # segundos entre conferências da agenda pelo líder
+
+def fontes_vencidas(agora=None, folga=FOLGA_AGENDA):
+    agora = agora or time.time()
+    agenda = {row['nome']: row['proxima_em'] for row in get_db().execute(
+        'SELECT nome, proxima_em FROM agenda_fontes'
+    ).fetchall()}
+    return [f for f in FONTES.values() if agenda.get(f.nome, 0) <= agora + folga]
+
+def atualizar_agenda(fonte, novas, respondeu, agora=None):
+    agora = agora or time.time()
+    conn = get_db()
+    row = conn.execute('SELECT intervalo FROM agenda_fontes WHERE nome = ?', (fonte.nome,)).fetchone()
+    intervalo = row['intervalo'] if row else fonte.intervalo_base
+    if respondeu:
+        fator = FATOR_ACELERA if novas else FATOR_DESACELERA
+        intervalo = min(fonte.intervalo_max, max(fonte.intervalo_min, intervalo * fator))
+    with conn:
+        conn.execute('''
+            INSERT INTO agenda_fontes (nome, intervalo, proxima_em, ultima_em, ultima_com_novas, execucoes,
+                                       com_novas, ultimo_sucesso)
+            VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+            ON CONFLICT(nome) DO UPDATE SET
+                intervalo = excluded.intervalo,
+                proxima_em = excluded.proxima_em,
+                ultima_em = excluded.ultima_em,
+                ultima_com_novas = COALESCE(excluded.ultima_com_novas, ultima_com_novas),
+                execucoes = execucoes + 1,
+                com_novas = com_novas + excluded.com_novas,
+                ultimo_sucesso = COALESCE(excluded.ultimo_sucesso, ultimo_sucesso)
+        ''', (fonte.nome, intervalo, agora + intervalo, agora,
+              agora if novas else None, 1 if novas else 0, agora if respondeu else None))
+
+def get_agenda():
+    agenda = {row['nome']: dict(row) for row in get_db().execute('SELECT * FROM agenda_fontes').fetchall()}
+    return [{'nome': f.nome, 'urls': [u for u, _ in f.urls], **agenda.get(f.nome, {})}
+            for f in FONTES.values()]
+
+@metricas.cronometrado('atualizacao_segundos')
+def buscar_todas(notificar=True, forcar=False):
+    """Busca as fontes vencidas (ou todas, com forcar) e notifica as novas"""
+    todas = []
+    novas = []
+    
+    # Todas as fontes de uma vez: o tempo total é o da página mais lenta
+    fontes = list(FONTES.values()) if forcar else fontes_vencidas()
+    validadores = []
+    por_fonte = baixar_fontes(fontes, validadores)
+    for promocoes, _ in por_fonte.values():
+        todas.extend(promocoes)
+    
+    novos_hashes = salvar_promocoes(todas, validadores)
+    hashes_novos = list(novos_hashes)
+    for fonte in fontes:
+        promocoes, respondeu = por_fonte[fonte.nome]
+        novas_fonte = sum(p.hash_id in novos_hashes for p in promocoes)
+        atualizar_agenda(fonte, novas_fonte, respondeu)
+        metricas.contar('fonte_itens_total', len(promocoes), fonte=fonte.nome)
+        metricas.contar('fonte_novas_total', novas_fonte, fonte=fonte.nome)
+        if not respondeu:
+            metricas.contar('fonte_falhas_total', fonte=fonte.nome)
+    for p in todas:
+        if p.hash_id in novos_hashes:
+            novos_hashes.discard(p.hash_id)  # mesma promoção repetida na página
+            novas.append({**asdict(p), 'hash_id': p.hash_id})
+    
+    # As novas ficam pendentes (notificado=0) e o despachante envia em
+    # segundo plano: a atualização não espera o Telegram
+    if hashes_novos:
+        canal = notificar and TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID
+        alertas = distribuir_alertas(novas) if notificar and TELEGRAM_BOT_TOKEN else 0
+        if not canal:
+            marcar_notificacao(hashes_novos, NOTIF_DESCARTADA)
+        if canal or alertas:
+            acordar_despachante()
+    
+    set_ultima_atualizacao()
+    if PAGINA_PRECOMPUTADA:
+        precomputar_pagina()
+    
+    return len(todas), len(novas)
+
+# ============================================================
+# JOBS EM SEGUNDO PLANO
+# ============================================================
+
+# A atualização roda numa thread do worker líder; a rota só enfileira e
+# devolve o id do job. Um lease no SQLite garante um scraping por vez
+# mesmo com vários workers do gunicorn.
+LEASE_SCRAPER = 'scraper'
+LEASE_DURACAO = 300          # segundos; expira se o dono morrer no meio
+JOB_ABANDONADO = 600         # job "ativo" mais velho que isso é ignorado
+JOB_CARENCIA = 60            # segundos entre 'executando' e o lease aparecer
+INTERVALO_VERIFICACAO = 30   # segundos entre varreduras de jobs pendentes
+
+def id_processo():
+    # Calculado na hora: com --preload os workers nascem de um fork do mestre
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def adquirir_lease(nome, dono, duracao=LEASE_DURACAO):
+    """Pega (ou renova) o lease se estiver livre, expirado ou já for nosso"""
+    agora = time.time()
+    conn = get_db()
+    with conn:
+        cur = conn.execute('''
+            INSERT INTO leases VALUES (?, ?, ?)
+            ON CONFLICT(nome) DO UPDATE SET dono = excluded.dono, expira_em = excluded.expira_em
+            WHERE leases.expira_em < ? OR leases.dono = excluded.dono
+        ''', (nome, dono, agora + duracao, agora))
+    return cur.rowcount == 1
+
+def liberar_lease(nome, dono):
+    conn = get_db()
+    with conn:
+        conn.execute('DELETE FROM leases WHERE nome = ? AND dono = ?', (nome, dono))
+
+def expirar_jobs(conn, agora=None):
+    """Marca como erro os jobs de worker morto (chamar dentro de uma transação).
+
+    Ativo há mais de JOB_ABANDONADO, ou 'executando' sem ninguém segurando
+    o lease do scraper em nome dele. Retorna quantos.
+    """
+    agora = agora or time.time()
+    return conn.execute('''
+        UPDATE jobs SET status = 'erro', concluido_em = ?, erro = 'abandonado (worker parou no meio)'
+        WHERE status IN ('pendente', 'executando') AND (
+            criado_em <= ?
+            OR (status = 'executando' AND iniciado_em <= ? AND NOT EXISTS (
+                SELECT 1 FROM leases
+                WHERE nome = ? AND dono LIKE '%:' || jobs.id AND expira_em >= ?
+            ))
+        )
+    ''', (agora, agora - JOB_ABANDONADO, agora - JOB_CARENCIA, LEASE_SCRAPER, agora)).rowcount
+
+def enfileirar_job(tipo='atualizacao', parametros=None):
+    """Cria o job, ou devolve o que já está ativo. Retorna (id, criado)."""
+    agora = time.time()
+    conn = get_db()
+    with conn:
+        # IMMEDIATE: a checagem e o insert não podem intercalar com outro worker
+        conn.execute('BEGIN IMMEDIATE')
+        expirar_jobs(conn, agora)
+        ativo = conn.execute('''
+            SELECT id FROM jobs
+            WHERE tipo = ? AND status IN ('pendente', 'executando') AND criado_em > ?
+            ORDER BY criado_em LIMIT 1
+        ''', (tipo, agora - JOB_ABANDONADO)).fetchone()
+        if ativo:
+            return ativo['id'], False
+        job_id = uuid.uuid4().hex[:12]
+        conn.execute(
+            "INSERT INTO jobs (id, tipo, status, criado_em, parametros) VALUES (?, ?, 'pendente', ?, ?)",
+            (job_id, tipo, agora, json.dumps(parametros or {}))
+        )
+    _acordar_worker()
+    return job_id, True
+
+def get_job(job_id):
+    row = get_db().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    for campo in ('parametros', 'resultado'):
+        job[campo] = json.loads(job[campo]) if job[campo] else None
+    return job
+
+def _finalizar_job(job_id, status, resultado=None, erro=None):
+    metricas.contar('jobs_total', status=status)
+    conn = get_db()
+    with conn:
+        conn.execute(
+            'UPDATE jobs SET status = ?, concluido_em = ?, resultado = ?, erro = ? WHERE id = ?',
+            (status, time.time(), json.dumps(resultado), erro, job_id)
+        )
+
+def _executar_job(job_id):
+    conn = get_db()
+    with conn:
+        cur = conn.execute(
+            "UPDATE jobs SET status = 'executando', iniciado_em = ? WHERE id = ? AND status = 'pendente'",
+            (time.time(), job_id)
+        )
+    if cur.rowcount != 1:
+        return  # outro worker pegou
+    
+    dono = f"{id_processo()}:{job_id}"
+    if not adquirir_lease(LEASE_SCRAPER, dono):
+        # Outro scraping em andamento (ex.: pela linha de comando): tenta depois
+        with conn:
+            conn.execute("UPDATE jobs SET status = 'pendente' WHERE id = ?", (job_id,))
+        return
+    try:
+        job = get_job(job_id)
+        parametros = job['parametros'] or {}
+        if job['tipo'] == 'manutencao':
+            _finalizar_job(job_id, 'concluido', manutencao())
+        else:
+            total, novas = buscar_todas(notificar=parametros.get('notificar', True),
+                                        forcar=parametros.get('forcar', False))
+            _finalizar_job(job_id, 'concluido', {'total': total, 'novas': novas})
+    except Exception as e:
+        _finalizar_job(job_id, 'erro', erro=str(e))
+    finally:
+        liberar_lease(LEASE_SCRAPER, dono)
+
+def _loop_jobs():
+    while True:
+        _evento_jobs.wait(INTERVALO_VERIFICACAO)
+        _evento_jobs.clear()
+        if not sou_lider():
+            continue
+        try:
+            pendentes = get_db().execute(
+                "SELECT id FROM jobs WHERE status = 'pendente' AND criado_em > ? ORDER BY criado_em",
+                (time.time() - JOB_ABANDONADO,)
+            ).fetchall()
+            for row in pendentes:
+                _executar_job(row['id'])
+        except Exception as e:
+            print(f"Erro no worker de jobs: {e}")
+
+_evento_jobs = threading.Event()
+_threads_processo = {}
+_threads_lock = threading.Lock()
+
+def _garantir_thread(nome, alvo):
+    """Sobe a thread de fundo deste processo (threads não sobrevivem ao fork)"""
+    with _threads_lock:
+        if _threads_processo.get(nome) != os.getpid():
+            threading.Thread(target=alvo, name=nome, daemon=True).start()
+            _threads_processo[nome] = os.getpid()
+
+def _acordar_worker():
+    # Nos outros workers o líder acha o job na próxima renovação do lease
+    if sou_lider():
+        _evento_jobs.set()
+
+# ============================================================
+# FILA DE NOTIFICAÇÕES
+# ============================================================
+
+# Coluna promocoes.notificado
+NOTIF_PENDENTE = 0
+NOTIF_ENVIADA = 1
+NOTIF_DESCARTADA = 2     # Telegram desligado, ou mensagem recusada
+
+LEASE_TELEGRAM = 'telegram'
+LIMITE_RAJADA = 3          # mais pendentes que isso vão juntas numa mensagem
+LOTE_NOTIFICACOES = 100
+INTERVALO_DESPACHANTE = 60  # segundos entre varreduras (e após falhas)
+
+def marcar_notificacao(hashes, status):
+    conn = get_db()
+    with conn:
+        conn.executemany('UPDATE promocoes SET notificado = ? WHERE hash_id = ?',
+                         [(status, h) for h in hashes])
+        # notificado vai no JSON das promoções: respostas em cache e o anel
+        # de recentes precisam reler as linhas
+        marcar_dados_alterados(conn, reescrita=True)
+
+def despachar_notificacoes():
+    """Envia as promoções pendentes do canal e dos assinantes.
+    Retorna quantas foram notificadas."""
+    dono = f"{id_processo()}:telegram"
+    if not adquirir_lease(LEASE_TELEGRAM, dono, duracao=120):
+        return 0  # outro worker está enviando
+    
+    enviadas = 0
+    try:
+        enviadas += despachar_entregas(dono)
+        while TELEGRAM_CHAT_ID:
+            pendentes = [dict(row) for row in get_db().execute(
+                'SELECT * FROM promocoes WHERE notificado = ? ORDER BY rowid LIMIT ?',
+                (NOTIF_PENDENTE, LOTE_NOTIFICACOES)
+            ).fetchall()]
+            if not pendentes:
+                break
+            
+            if len(pendentes) > LIMITE_RAJADA:
+                envios = [(pendentes, formatar_rajada(pendentes))]
+            else:
+                envios = [([p], formatar_promocao(p)) for p in pendentes]
+            
+            for promos, mensagem in envios:
+                resultado = _enviar(TELEGRAM_CHAT_ID, mensagem)
+                if resultado == 'erro':
+                    return enviadas  # Telegram fora do ar: continua pendente
+                status = NOTIF_ENVIADA if resultado == 'ok' else NOTIF_DESCARTADA
+                marcar_notificacao([p['hash_id'] for p in promos], status)
+                enviadas += len(promos) if resultado == 'ok' else 0
+            adquirir_lease(LEASE_TELEGRAM, dono, duracao=120)
+    finally:
+        liberar_lease(LEASE_TELEGRAM, dono)
+    return enviadas
+
+_evento_notificacoes = threading.Event()
+
+def _loop_despachante():
+    while True:
+        _evento_notificacoes.wait(INTERVALO_DESPACHANTE)
+        _evento_notificacoes.clear()
+        if not sou_lider():
+            continue
+        try:
+            despachar_notificacoes()
+        except Exception as e:
+            print(f"Erro no despachante: {e}")
+
+def acordar_despachante():
+    if sou_lider():
+        _evento_notificacoes.set()
+
+# ============================================================
+# COORDENAÇÃO ENTRE WORKERS
+# ============================================================
+
+# Com vários workers do gunicorn, todos servem leituras, mas só um (o
+# líder) roda os jobs de scraping e o despachante do Telegram. A
+# liderança é um lease no SQLite renovado por uma thread de cada worker:
+# se o líder morre, outro assume quando o lease expira. Os leases de
+# scraper e telegram continuam valendo dentro de cada operação, então
+# mesmo uma troca de líder no meio não duplica trabalho.
+LEASE_LIDER = 'lider'
+LIDER_DURACAO = 30     # segundos sem renovar até outro worker assumir
+LIDER_INTERVALO = 5    # segundos entre renovações
+
+_lider = {'pid': None, 'agenda_em': 0.0}
+_inicio = {'pid': None}
+_inicio_lock = threading.Lock()
+
+def sou_lider():
+    return _lider['pid'] == os.getpid()
+
+def _loop_lider():
+    dono = id_processo()
+    while True:
+        try:
+            if adquirir_lease(LEASE_LIDER, dono, duracao=LIDER_DURACAO):
+                if not sou_lider():
+                    print(f"{dono} assumiu scraping e notificações")
+                    # Jobs que o líder anterior deixou no meio
+                    conn = get_db()
+                    with conn:
+                        expirar_jobs(conn)
+                    metricas.contar('lider_eleicoes_total')
+                    _lider['pid'] = os.getpid()
+                    _garantir_thread('jobs', _loop_jobs)
+                    _garantir_thread('notificacoes', _loop_despachante)
+                    _evento_notificacoes.set()
+                # Fontes que venceram entre uma chamada do cron e outra
+                agora = time.time()
+                if AGENDA_INTERNA and agora - _lider['agenda_em'] >= AGENDA_VERIFICACAO:
+                    _lider['agenda_em'] = agora
+                    if fontes_vencidas(agora, folga=0):
+                        enfileirar_job(parametros={'notificar': True, 'forcar': False})
+                # Jobs enfileirados por outros workers
+                if get_db().execute("SELECT 1 FROM jobs WHERE status = 'pendente' LIMIT 1").fetchone():
+                    _evento_jobs.set()
+            else:
+                _lider['pid'] = None
+        except Exception as e:
+            print(f"Erro na eleição de líder: {e}")
+        time.sleep(LIDER_INTERVALO)
+
+def _renunciar():
+    if sou_lider():
+        try:
+            liberar_lease(LEASE_LIDER, id_processo())
+        except Exception:
+            pass
+
+def iniciar_processo():
+    """Banco pronto e candidatura a líder, uma vez por processo (pid)"""
+    if _inicio['pid'] == os.getpid():
+        return
+    with _inicio_lock:
+        if _inicio['pid'] == os.getpid():
+            return
+        preparar_banco()
+        _garantir_thread('lider', _loop_lider)
+        atexit.register(_renunciar)
+        _inicio['pid'] = os.getpid()
+
+# ============================================================
+# ALERTAS POR ASSINANTE
+# ============================================================
+
+# Cada assinante (um chat do Telegram) tem suas regras, por exemplo
+# "destino em {Paris, Roma} e preço <= 3000" ou "Smiles e bônus >= 80".
+# As regras ficam num índice em memória: por valor de destino, programa e
+# tipo, e ordenadas pelo limite de preço e de bônus. Para cada promoção só
+# as regras do filtro mais seletivo são conferidas, não todas.
+ENVIOS_PARALELOS = 8      # chats atendidos ao mesmo tempo (o limitador segura os 30/s)
+LOTE_ENTREGAS = 500
+
+@dataclass
+class Regra:
+    id: int
+    assinante_id: int
+    destinos: frozenset = frozenset()
+    programas: frozenset = frozenset()
+    tipos: frozenset = frozenset()
+    preco_max: Optional[float] = None
+    bonus_min: Optional[int] = None
+    score_min: Optional[float] = None
+
+    def casa(self, promo):
+        if self.destinos and promo.get('destino') not in self.destinos:
+            return False
+        if self.programas and promo.get('programa') not in self.programas:
+            return False
+        if self.tipos and promo.get('tipo') not in self.tipos:
+            return False
+        if self.preco_max is not None and not (promo.get('preco') and promo['preco'] <= self.preco_max):
+            return False
+        if self.bonus_min is not None and (promo.get('bonus_percentual') or 0) < self.bonus_min:
+            return False
+        if self.score_min is not None and (promo.get('score') is None or promo['score'] < self.score_min):
+            return False
+        return True
+
+class IndiceRegras:
+    """Regras indexadas por campo; `casar` devolve os assinantes de uma promoção"""
+
+    CAMPOS = (('destino', 'destinos'), ('programa', 'programas'), ('tipo', 'tipos'))
+
+    def __init__(self, regras):
+        self.total = len(regras)
+        # campo -> ({valor: [regras]}, [regras que aceitam qualquer valor])
+        self.por_campo = {}
+        for campo, atributo in self.CAMPOS:
+            por_valor, livres = {}, []
+            for r in regras:
+                for valor in getattr(r, atributo):
+                    por_valor.setdefault(valor, []).append(r)
+                if not getattr(r, atributo):
+                    livres.append(r)
+            self.por_campo[campo] = (por_valor, livres)
+        # Faixas: listas ordenadas pelo limite, cortadas com bisect
+        self.regras_preco = sorted((r for r in regras if r.preco_max is not None), key=lambda r: r.preco_max)
+        self.limites_preco = [r.preco_max for r in self.regras_preco]
+        self.sem_preco = [r for r in regras if r.preco_max is None]
+        self.regras_bonus = sorted((r for r in regras if r.bonus_min is not None), key=lambda r: r.bonus_min)
+        self.limites_bonus = [r.bonus_min for r in self.regras_bonus]
+        self.sem_bonus = [r for r in regras if r.bonus_min is None]
+
+    def candidatas(self, promo):
+        """As regras do filtro que menos deixa passar (as outras já não casam)"""
+        opcoes = []
+        for campo, (por_valor, livres) in self.por_campo.items():
+            especificas = por_valor.get(promo.get(campo), [])
+            opcoes.append((len(especificas) + len(livres), (especificas, livres)))
+        # preco_max >= preço: um sufixo da lista
+        preco = promo.get('preco')
+        i = bisect_left(self.limites_preco, preco) if preco else len(self.regras_preco)
+        opcoes.append((len(self.regras_preco) - i + len(self.sem_preco),
+                       (islice(self.regras_preco, i, None), self.sem_preco)))
+        # bonus_min <= bônus: um prefixo
+        j = bisect_right(self.limites_bonus, promo.get('bonus_percentual') or 0)
+        opcoes.append((j + len(self.sem_bonus), (islice(self.regras_bonus, j), self.sem_bonus)))
+        _, partes = min(opcoes, key=lambda o: o[0])
+        return chain(*partes)
+
+    def casar(self, promo):
+        return {r.assinante_id for r in self.candidatas(promo) if r.casa(promo)}
+
+_indice_regras = {'versao': None, 'indice': IndiceRegras([])}
+
+def _marcar_regras_alteradas(conn):
+    conn.execute('''
+        INSERT INTO config VALUES ('versao_regras', '1')
+        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+    ''')
+
+def validar_regra(destinos=None, programas=None, tipos=None, preco_max=None, bonus_min=None, score_min=None):
+    """Campos da regra conferidos. Levanta ValueError se algum tem o tipo errado."""
+    regra = {}
+    for campo, valor in (('destinos', destinos), ('programas', programas), ('tipos', tipos)):
+        if isinstance(valor, str):
+            valor = [valor]
+        if valor is not None and not (isinstance(valor, list) and all(isinstance(v, str) for v in valor)):
+            raise ValueError(f"{campo}: informe uma lista de textos")
+        regra[campo] = valor
+    for campo, valor in (('preco_max', preco_max), ('bonus_min', bonus_min), ('score_min', score_min)):
+        if valor is not None and (isinstance(valor, bool) or not isinstance(valor, (int, float))):
+            raise ValueError(f"{campo}: informe um número")
+        regra[campo] = valor
+    return regra
+
+def _regra_de_linha(row):
+    lista = lambda v: json.loads(v) if v else None
+    regra = validar_regra(lista(row['destinos']), lista(row['programas']), lista(row['tipos']),
+                          row['preco_max'], row['bonus_min'], row['score_min'])
+    conjunto = lambda v: frozenset(v or ())
+    return Regra(row['id'], row['assinante_id'], conjunto(regra['destinos']), conjunto(regra['programas']),
+                 conjunto(regra['tipos']), regra['preco_max'], regra['bonus_min'], regra['score_min'])
+
+def indice_regras():
+    """Índice das regras ativas; reconstruído quando alguma regra muda"""
+    conn = get_db()
+    row = conn.execute("SELECT value FROM config WHERE key = 'versao_regras'").fetchone()
+    versao = row[0] if row else '0'
+    if versao != _indice_regras['versao']:
+        regras = []
+        for r in conn.execute('''
+            SELECT regras.* FROM regras JOIN assinantes ON assinantes.id = regras.assinante_id
+            WHERE assinantes.ativo = 1
+        '''):
+            try:
+                regras.append(_regra_de_linha(r))
+            except ValueError as e:
+                # Regra gravada antes da validação: ignora só ela
+                print(f"Regra {r['id']} ignorada: {e}")
+        _indice_regras.update(versao=versao, indice=IndiceRegras(regras))
+    return _indice_regras['indice']
+
+def salvar_assinante(chat_id, nome=None, ativo=True):
+    """Cria (ou atualiza) o assinante do chat. Retorna o id."""
+    sql = '''
+        INSERT INTO assinantes (chat_id, nome, ativo, criado_em) VALUES (?, ?, ?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET nome = COALESCE(excluded.nome, nome), ativo = excluded.ativo
+    '''
+    params = (str(chat_id), nome, int(ativo), time.time())
+    conn = get_db()
+    with conn:
+        if SQLITE_TEM_RETURNING:
+            row = conn.execute(sql + ' RETURNING id', params).fetchone()
+        else:
+            conn.execute(sql, params)
+            row = conn.execute('SELECT id FROM assinantes WHERE chat_id = ?', (str(chat_id),)).fetchone()
+        _marcar_regras_alteradas(conn)
+    return row[0]
+
+def adicionar_regra(assinante_id, destinos=None, programas=None, tipos=None,
+                    preco_max=None, bonus_min=None, score_min=None):
+    """Grava a regra do assinante. Levanta ValueError se algum campo tem o tipo errado."""
+    regra = validar_regra(destinos, programas, tipos, preco_max, bonus_min, score_min)
+    destinos, programas, tipos = regra['destinos'], regra['programas'], regra['tipos']
+    lista = lambda v: json.dumps(sorted(v), ensure_ascii=False) if v else None
+    conn = get_db()
+    with conn:
+        cur = conn.execute('''
+            INSERT INTO regras (assinante_id, destinos, programas, tipos, preco_max, bonus_min, score_min)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (assinante_id, lista(destinos), lista(programas), lista(tipos), preco_max, bonus_min, score_min))
+        _marcar_regras_alteradas(conn)
+    return cur.lastrowid
+
+def remover_regra(regra_id):
+    conn = get_db()
+    with conn:
+        cur = conn.execute('DELETE FROM regras WHERE id = ?', (regra_id,))
+        _marcar_regras_alteradas(conn)
+    return cur.rowcount == 1
+
+def get_assinantes():
+    conn = get_db()
+    assinantes = {r['id']: {**dict(r), 'regras': []} for r in conn.execute('SELECT * FROM assinantes ORDER BY id')}
+    for r in conn.execute('SELECT * FROM regras ORDER BY id'):
+        if r['assinante_id'] in assinantes:
+            assinantes[r['assinante_id']]['regras'].append(
+                {**dict(r), **{c: json.loads(r[c]) if r[c] else None for c in ('destinos', 'programas', 'tipos')}}
+            )
+    return list(assinantes.values())
+
+def distribuir_alertas(novas):
+    """Casa as novas com as regras e enfileira as entregas. Retorna quantas."""
+    indice = indice_regras()
+    if not indice.total:
+        return 0
+    agora = time.time()
+    entregas = [(assinante_id, p['hash_id'], NOTIF_PENDENTE, agora)
+                for p in novas for assinante_id in indice.casar(p)]
+    conn = get_db()
+    with conn:
+        conn.executemany('INSERT OR IGNORE INTO entregas VALUES (?, ?, ?, ?)', entregas)
+    return len(entregas)
+
+def enviar_em_massa(mensagens_por_chat):
+    """Envia {chat_id: [mensagens]} em paralelo entre chats, em ordem dentro
+    de cada chat. Retorna {chat_id: [resultado de cada mensagem enviada]};
+    um chat para no primeiro 'erro'."""
+    def enviar_chat(chat_id):
+        resultados = []
+        for mensagem in mensagens_por_chat[chat_id]:
+            resultados.append(_enviar(chat_id, mensagem))
+            if resultados[-1] == 'erro':
+                break
+        return chat_id, resultados
+    
+    if not mensagens_por_chat:
+        return {}
+    with ThreadPoolExecutor(min(ENVIOS_PARALELOS, len(mensagens_por_chat))) as pool:
+        return dict(pool.map(enviar_chat, mensagens_por_chat))
+
+def despachar_entregas(dono):
+    """Envia as entregas pendentes dos assinantes. Retorna quantas foram enviadas."""
+    enviadas = 0
+    conn = get_db()
+    # Quem foi desativado não recebe o que ficou na fila
+    with conn:
+        conn.execute('''
+            UPDATE entregas SET status = ?
+            WHERE status = ? AND assinante_id IN (SELECT id FROM assinantes WHERE ativo = 0)
+        ''', (NOTIF_DESCARTADA, NOTIF_PENDENTE))
+    while True:
+        linhas = conn.execute('''
+            SELECT entregas.assinante_id, assinantes.chat_id, promocoes.*
+            FROM entregas
+            JOIN assinantes ON assinantes.id = entregas.assinante_id
+            JOIN promocoes ON promocoes.hash_id = entregas.hash_id
+            WHERE entregas.status = ? AND assinantes.ativo = 1
+            ORDER BY entregas.assinante_id, promocoes.rowid
+            LIMIT ?
+        ''', (NOTIF_PENDENTE, LOTE_ENTREGAS)).fetchall()
+        if not linhas:
+            return enviadas
+        
+        por_chat = {}
+        for row in linhas:
+            por_chat.setdefault(row['chat_id'], (row['assinante_id'], []))[1].append(dict(row))
+        envios, mensagens = {}, {}
+        for chat_id, (_, promos) in por_chat.items():
+            if len(promos) > LIMITE_RAJADA:
+                envios[chat_id] = [promos]
+            else:
+                envios[chat_id] = [[p] for p in promos]
+            mensagens[chat_id] = [formatar_rajada(g) if len(g) > 1 else formatar_promocao(g[0])
+                                  for g in envios[chat_id]]
+        
+        resultados = enviar_em_massa(mensagens)
+        atualizacoes, houve_erro = [], False
+        for chat_id, lista in resultados.items():
+            assinante_id = por_chat[chat_id][0]
+            for grupo, resultado in zip(envios[chat_id], lista):
+                if resultado == 'erro':
+                    houve_erro = True  # continua pendente
+                    continue
+                status = NOTIF_ENVIADA if resultado == 'ok' else NOTIF_DESCARTADA
+                atualizacoes.extend((status, assinante_id, p['hash_id']) for p in grupo)
+                enviadas += len(grupo) if resultado == 'ok' else 0
+        with conn:
+            conn.executemany('UPDATE entregas SET status = ? WHERE assinante_id = ? AND hash_id = ?',
+                             atualizacoes)
+        if houve_erro:
+            return enviadas  # Telegram fora do ar: tenta na próxima varredura
+        adquirir_lease(LEASE_TELEGRAM, dono, duracao=120)
+
+# ============================================================
+# REEXTRAÇÃO DO HISTÓRICO
+# ============================================================
+
+# Quando a lista de destinos ou as regex mudam, as linhas antigas ficam com
+# preco/destino/programa velhos. `python app.py reextrair` refaz a extração
+# em lotes, num pool de processos, salvando um checkpoint a cada lote.
+CHECKPOINT_REEXTRACAO = 'reextracao_checkpoint'
+
+def _reextrair_lote(linhas):
+    """Roda no processo filho. Recebe as linhas e devolve só as que mudaram."""
+    alteradas = []
+    for rowid, titulo, tipo, preco, bonus, programa, destino, origem in linhas:
+        campos = extrair_campos(titulo)
+        novo_bonus = campos['bonus_percentual'] if tipo == 'transferencia_bonificada' else bonus
+        novos = (campos['preco'], novo_bonus, campos['programa'], campos['destino'], campos['origem'])
+        if novos != (preco, bonus, programa, destino, origem):
+            alteradas.append(novos + (rowid,))
+    return alteradas
+
+def _gravar_reextracao(alteradas, ultimo_rowid):
+    conn = get_db()
+    with conn:
+        if alteradas:
+            conn.executemany(
+                'UPDATE promocoes SET preco = ?, bonus_percentual = ?, programa = ?, destino = ?, origem = ? '
+                'WHERE rowid = ?',
+                alteradas
+            )
+            marcar_dados_alterados(conn, reescrita=True)
+        conn.execute('INSERT OR REPLACE INTO config VALUES (?, ?)', (CHECKPOINT_REEXTRACAO, str(ultimo_rowid)))
+
+def reextrair_historico(lote=2000, processos=None, reiniciar=False):
+    """Reaplica a extração a todo o histórico. Retorna (processadas, alteradas)."""
+    conn = get_db()
+    row = conn.execute('SELECT value FROM config WHERE key = ?', (CHECKPOINT_REEXTRACAO,)).fetchone()
+    ultimo = 0 if reiniciar or not row else int(row[0])
+    if ultimo:
+        print(f"Retomando a partir do rowid {ultimo}")
+    
+    processos = processos or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(processos) if processos > 1 else None
+    # Lotes em voo limitados: a memória fica em O(lote × processos)
+    em_voo = deque()
+    processadas = alteradas = 0
+    inicio = time.perf_counter()
+    
+    def concluir_mais_antigo():
+        nonlocal processadas, alteradas
+        futuro, ultimo_rowid, tamanho = em_voo.popleft()
+        mudancas = futuro.result() if pool else futuro
+        _gravar_reextracao(mudancas, ultimo_rowid)
+        processadas += tamanho
+        alteradas += len(mudancas)
+        taxa = processadas / max(time.perf_counter() - inicio, 1e-9)
+        print(f"{processadas} linhas, {alteradas} alteradas, {taxa:,.0f} linhas/s (rowid {ultimo_rowid})")
+    
+    try:
+        while True:
+            linhas = [tuple(r) for r in conn.execute(
+                'SELECT rowid, titulo, tipo, preco, bonus_percentual, programa, destino, origem '
+                'FROM promocoes WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                (ultimo, lote)
+            ).fetchall()]
+            if not linhas:
+                break
+            ultimo = linhas[-1][0]
+            futuro = pool.submit(_reextrair_lote, linhas) if pool else _reextrair_lote(linhas)
+            em_voo.append((futuro, ultimo, len(linhas)))
+            if len(em_voo) >= processos * 2:
+                concluir_mais_antigo()
+        while em_voo:
+            concluir_mais_antigo()
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    
+    # Terminou: a próxima execução começa do início
+    with conn:
+        conn.execute('DELETE FROM config WHERE key = ?', (CHECKPOINT_REEXTRACAO,))
+    return processadas, alteradas
+
+# ============================================================
+# RETENÇÃO E ARQUIVO
+# ============================================================
+
+# A tabela quente guarda só as promoções recentes. As vencidas (idade por
+# tipo) vão para um SQLite por mês em ARQUIVO_DIR, que continua consultável
+# em /api/arquivo. Depois o espaço livre volta ao disco com
+# incremental_vacuum, sem reescrever o banco a cada execução.
+ARQUIVO_DIR = os.environ.get('ARQUIVO_DIR', 'arquivo')
+RETENCAO_DIAS = {'passagem': 60, 'milhas': 60, 'transferencia_bonificada': 30}
+RETENCAO_PADRAO_DIAS = 60
+RETENCAO_AUXILIARES_DIAS = 30   # jobs concluídos, entregas enviadas, duplicatas
+INTERVALO_MANUTENCAO = 86400
+LOTE_ARQUIVO = 1000
+
+COLUNAS_ARQUIVO_DDL = ('tipo TEXT, titulo TEXT, url TEXT, fonte TEXT, data_encontrada TEXT, preco REAL, '
+                       'bonus_percentual INTEGER, programa TEXT, destino TEXT, notificado INTEGER, '
+                       'origem TEXT, score REAL, mediana REAL, criado_em REAL')
+
+def _arquivo_mes(mes):
+    return os.path.join(ARQUIVO_DIR, f"promocoes-{mes}.db")
+
+def listar_arquivos():
+    """Meses arquivados, do mais recente para o mais antigo ('2026-07', ...)"""
+    if not os.path.isdir(ARQUIVO_DIR):
+        return []
+    return sorted((nome[len('promocoes-'):-len('.db')] for nome in os.listdir(ARQUIVO_DIR)
+                   if re.fullmatch(r'promocoes-\d{4}-\d{2}\.db', nome)), reverse=True)
+
+def _vencidas(conn, agora):
+    """rowid e mês das promoções fora da retenção (já notificadas)"""
+    casos = ' '.join(f"WHEN '{tipo}' THEN {dias}" for tipo, dias in RETENCAO_DIAS.items())
+    return conn.execute(f'''
+        SELECT rowid, strftime('%Y-%m', criado_em, 'unixepoch') FROM promocoes
+        WHERE notificado != 0
+          AND criado_em < ? - 86400 * CASE tipo {casos} ELSE {RETENCAO_PADRAO_DIAS} END
+        ORDER BY rowid LIMIT ?
+    ''', (agora, LOTE_ARQUIVO)).fetchall()
+
+def arquivar_promocoes(agora=None):
+    """Move as promoções vencidas para o arquivo do mês. Retorna quantas."""
+    agora = agora or time.time()
+    os.makedirs(ARQUIVO_DIR, exist_ok=True)
+    conn = get_db()
+    movidas = 0
+    while True:
+        por_mes = {}
+        for rowid, mes in _vencidas(conn, agora):
+            por_mes.setdefault(mes, []).append(rowid)
+        if not por_mes:
+            break
+        for mes, rowids in por_mes.items():
+            marcas = ','.join('?' * len(rowids))
+            # ATTACH não pode acontecer dentro de transação
+            conn.execute('ATTACH DATABASE ? AS arquivo', (_arquivo_mes(mes),))
+            try:
+                # Duas transações: primeiro grava no arquivo, depois apaga daqui.
+                # Se cair no meio, a próxima execução regrava (hash_id é a chave).
+                with conn:
+                    conn.execute(f'''
+                        CREATE TABLE IF NOT EXISTS arquivo.promocoes (
+                            hash_id TEXT PRIMARY KEY, {COLUNAS_ARQUIVO_DDL}
+                        ) WITHOUT ROWID
+                    ''')
+                    conn.execute(f'''
+                        INSERT OR IGNORE INTO arquivo.promocoes ({COLUNAS_PROMOCAO})
+                        SELECT {COLUNAS_PROMOCAO} FROM main.promocoes WHERE rowid IN ({marcas})
+                    ''', rowids)
+                with conn:
+                    # Alerta que não saiu até a promoção vencer não sai mais (e
+                    # pendente, sem a promoção, a limpeza nunca apagaria)
+                    conn.execute(f'''
+                        UPDATE entregas SET status = ?
+                        WHERE status = ? AND hash_id IN (
+                            SELECT hash_id FROM main.promocoes WHERE rowid IN ({marcas}))
+                    ''', (NOTIF_DESCARTADA, NOTIF_PENDENTE, *rowids))
+                    conn.execute(f'DELETE FROM main.promocoes WHERE rowid IN ({marcas})', rowids)
+                    marcar_dados_alterados(conn, reescrita=True)
+            finally:
+                conn.execute('DETACH DATABASE arquivo')
+            movidas += len(rowids)
+    return movidas
+
+def limpar_auxiliares(agora=None):
+    """Apaga o que só importa por pouco tempo. Retorna {tabela: linhas}."""
+    agora = agora or time.time()
+    limite = agora - RETENCAO_AUXILIARES_DIAS * 86400
+    conn = get_db()
+    with conn:
+        expirar_jobs(conn, agora)
+        return {
+            'jobs': conn.execute(
+                "DELETE FROM jobs WHERE status IN ('concluido', 'erro') AND criado_em < ?", (limite,)
+            ).rowcount,
+            'entregas': conn.execute(
+                'DELETE FROM entregas WHERE status != ? AND criado_em < ?', (NOTIF_PENDENTE, limite)
+            ).rowcount,
+            'duplicatas': conn.execute('DELETE FROM duplicatas WHERE visto_em < ?', (limite,)).rowcount,
+            'historico_precos': conn.execute(
+                'DELETE FROM historico_precos WHERE dia <= ?', (_dia(agora) - JANELA_PRECOS_DIAS,)
+            ).rowcount,
+        }
+
+def compactar(paginas=None):
+    """Devolve ao disco as páginas livres. Retorna o tamanho do banco em bytes."""
+    conn = get_db()
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        # Banco antigo: auto_vacuum só muda com um VACUUM completo, uma vez.
+        # O VACUUM pode renumerar os rowid, então o índice de busca é refeito.
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        with conn:
+            if FTS_DISPONIVEL:
+                conn.execute("INSERT INTO promocoes_fts(promocoes_fts) VALUES ('rebuild')")
+            marcar_dados_alterados(conn, reescrita=True)
+    else:
+        # Libera uma página por passo: fetchall executa até o fim (0 = todas as livres)
+        conn.execute(f'PRAGMA incremental_vacuum({int(paginas or 0)})').fetchall()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    pagina = conn.execute('PRAGMA page_size').fetchone()[0]
+    return conn.execute('PRAGMA page_count').fetchone()[0] * pagina
+
+def manutencao():
+    """Arquivamento, limpeza e compactação; roda como job ou pela linha de comando"""
+    inicio = time.perf_counter()
+    resultado = {'arquivadas': arquivar_promocoes(), 'removidas': limpar_auxiliares()}
+    resultado['bytes'] = compactar()
+    resultado['segundos'] = round(time.perf_counter() - inicio, 2)
+    conn = get_db()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO config VALUES (?, ?)', ('ultima_manutencao', str(time.time())))
+    return resultado
+
+def manutencao_vencida():
+    row = get_db().execute("SELECT value FROM config WHERE key = 'ultima_manutencao'").fetchone()
+    return not row or time.time() - float(row[0]) > INTERVALO_MANUTENCAO
+
+def consultar_arquivo(mes, texto=None, tipo=None, destino=None, limite=100):
+    """Promoções de um mês arquivado (só leitura)"""
+    caminho = _arquivo_mes(mes)
+    if not re.fullmatch(r'\d{4}-\d{2}', mes) or not os.path.exists(caminho):
+        return None
+    filtros, params = [], []
+    if texto:
+        filtros.append('titulo LIKE ?')
+        params.append(f"%{texto}%")
+    if tipo:
+        filtros.append('tipo = ?')
+        params.append(tipo)
+    if destino:
+        filtros.append('destino = ?')
+        params.append(destino)
+    where = ('WHERE ' + ' AND '.join(filtros)) if filtros else ''
+    conn = sqlite3.connect(f"file:{caminho}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(r) for r in conn.execute(
+            f'SELECT * FROM promocoes {where} ORDER BY criado_em DESC LIMIT ?', params + [limite]
+        ).fetchall()]
+    finally:
+        conn.close()
+
+# ============================================================
+# EXPORTAÇÃO
+# ============================================================
+
+# Exporta o histórico inteiro (com filtros) em NDJSON, CSV e, se o pyarrow
+# estiver instalado, Arrow IPC ou Parquet. Lê em lotes por rowid (keyset),
+# cada lote numa leitura curta, e entrega cada lote já serializado: a
+# memória não cresce com o tamanho da tabela.
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_DISPONIVEL = True
+except ImportError:
+    PYARROW_DISPONIVEL = False
+
+LOTE_EXPORTACAO = 5000
+COLUNAS_EXPORTACAO = ['id', 'hash_id', 'tipo', 'titulo', 'url', 'fonte', 'data_encontrada', 'preco',
+                      'bonus_percentual', 'programa', 'destino', 'origem', 'score', 'mediana', 'criado_em']
+# Poucos valores distintos, repetidos em todas as linhas: dicionário no Arrow/Parquet
+COLUNAS_DICIONARIO = {'tipo', 'fonte', 'destino', 'programa', 'origem'}
+
+FORMATOS_EXPORTACAO = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+def formatos_disponiveis():
+    return [f for f in FORMATOS_EXPORTACAO if f in ('ndjson', 'csv') or PYARROW_DISPONIVEL]
+
+def epoch_de_data(texto):
+    """'AAAA-MM-DD' (ou com hora, ISO) -> segundos desde a época"""
+    return datetime.fromisoformat(texto).timestamp()
+
+def lotes_exportacao(desde=None, ate=None, lote=LOTE_EXPORTACAO, **filtros_promocao):
+    """Tuplas na ordem de COLUNAS_EXPORTACAO, um lote por vez"""
+    filtros, params = _filtros_promocoes(**filtros_promocao)
+    if desde is not None:
+        filtros.append('criado_em >= ?')
+        params.append(desde)
+    if ate is not None:
+        filtros.append('criado_em < ?')
+        params.append(ate)
+    colunas = ', '.join(['rowid'] + COLUNAS_EXPORTACAO[1:])
+    extra = ''.join(f' AND {f}' for f in filtros)
+    conn = get_db()
+    ultimo = 0
+    while True:
+        linhas = conn.execute(
+            f'SELECT {colunas} FROM promocoes WHERE rowid > ?{extra} ORDER BY rowid LIMIT ?',
+            [ultimo] + params + [lote]
+        ).fetchall()
+        if not linhas:
+            return
+        ultimo = linhas[-1][0]
+        yield [tuple(r) for r in linhas]
+
+class _Coletor:
+    """Destino de escrita do pyarrow que guarda os bytes até serem entregues"""
+
+    def __init__(self):
+        self.partes, self.posicao, self.closed = [], 0, False
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        self.posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self.posicao
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def esvaziar(self):
+        dados, self.partes = b''.join(self.partes), []
+        return dados
+
+def _esquema_arrow():
+    tipos = {'id': pa.int64(), 'preco': pa.float64(), 'bonus_percentual': pa.int64(),
+             'score': pa.float64(), 'mediana': pa.float64(), 'criado_em': pa.float64()}
+    return pa.schema([
+        (c, pa.dictionary(pa.int32(), pa.string()) if c in COLUNAS_DICIONARIO else tipos.get(c, pa.string()))
+        for c in COLUNAS_EXPORTACAO
+    ])
+
+def _lote_arrow(linhas, esquema):
+    colunas = list(zip(*linhas))
+    arrays = []
+    for i, campo in enumerate(esquema):
+        if campo.name in COLUNAS_DICIONARIO:
+            arrays.append(pa.array(colunas[i], pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(colunas[i], campo.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=esquema)
+
+def exportar_promocoes(formato='ndjson', **filtros):
+    """Gerador de bytes do arquivo exportado"""
+    lotes = lotes_exportacao(**filtros)
+    if formato == 'ndjson':
+        for linhas in lotes:
+            yield ''.join(json.dumps(dict(zip(COLUNAS_EXPORTACAO, l)), ensure_ascii=False) + '\n'
+                          for l in linhas).encode()
+    elif formato == 'csv':
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        escritor.writerow(COLUNAS_EXPORTACAO)
+        for linhas in lotes:
+            escritor.writerows(linhas)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+    elif formato in ('arrow', 'parquet') and PYARROW_DISPONIVEL:
+        esquema = _esquema_arrow()
+        coletor = _Coletor()
+        if formato == 'arrow':
+            escritor = pa.ipc.new_stream(coletor, esquema)
+        else:
+            escritor = pq.ParquetWriter(coletor, esquema, compression='zstd')
+        for linhas in lotes:
+            lote = _lote_arrow(linhas, esquema)
+            if formato == 'arrow':
+                escritor.write_batch(lote)
+            else:
+                escritor.write_table(pa.Table.from_batches([lote]))  # um row group por lote
+            yield coletor.esvaziar()
+        escritor.close()
+        yield coletor.esvaziar()
+    else:
+        raise ValueError(f"Formato indisponível: {formato} (disponíveis: {', '.join(formatos_disponiveis())})")
+
+# ============================================================
+# TRANSMISSÃO AO VIVO (SSE)
+# ============================================================
+
+# /api/stream mantém a conexão aberta e empurra só o que mudou. Uma thread
+# por processo observa a versão dos dados (a mesma do cache de respostas)
+# e, quando ela muda, lê as promoções novas e as estatísticas uma vez e
+# distribui o evento já serializado para todos os clientes: painéis
+# parados não consultam o banco.
+#
+# Com o worker gthread cada conexão aberta ocupa uma thread do worker.
+# Acima de SSE_MAX_CLIENTES o stream responde 503 e o painel passa a
+# consultar /api/promocoes de tempos em tempos, deixando threads livres
+# para o resto (cron, API).
+SSE_MAX_CLIENTES = int(os.environ.get('SSE_MAX_CLIENTES', 16))   # de --threads 32
+SSE_INTERVALO = 1.0      # segundos entre checagens da versão
+SSE_HEARTBEAT = 15       # comentário periódico para proxies não cortarem a conexão
+SSE_FILA = 100           # eventos por cliente; quem não consome é desligado
+SSE_MAX_NOVAS = 50       # promoções por evento
+
+def _evento_sse(evento, dados, id_evento=None):
+    linhas = f"id: {id_evento}\n" if id_evento is not None else ''
+    return f"{linhas}event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+def _promocoes_desde(rowid, limite=SSE_MAX_NOVAS):
+    return [dict(r) for r in get_db().execute(
+        'SELECT rowid AS id, * FROM promocoes WHERE rowid > ? ORDER BY rowid LIMIT ?',
+        (rowid, limite)
+    ).fetchall()]
+
+def _ultimo_rowid():
+    return get_db().execute('SELECT COALESCE(MAX(rowid), 0) FROM promocoes').fetchone()[0]
+
+class Transmissor:
+    """Distribui os eventos de um processo para as filas dos clientes conectados"""
+
+    def __init__(self):
+        self.clientes = set()
+        self.lock = threading.Lock()
+        self.com_clientes = threading.Event()
+        self.versao = None
+        self.ultimo_id = None
+        self.stats = None
+
+    def inscrever(self):
+        """Fila do novo cliente, ou None se o limite de conexões foi atingido"""
+        with self.lock:
+            if len(self.clientes) >= SSE_MAX_CLIENTES:
+                return None
+            if self.ultimo_id is None:
+                # Ponto de partida antes da recuperação do cliente (em
+                # eventos_stream): o que for gravado no meio chega por um
+                # dos dois caminhos; repetido a página descarta pelo id
+                self.ultimo_id = _ultimo_rowid()
+            fila = queue.Queue(SSE_FILA)
+            self.clientes.add(fila)
+            self.com_clientes.set()
+        _garantir_thread('transmissor', self._loop)
+        return fila
+
+    def cancelar(self, fila):
+        with self.lock:
+            self.clientes.discard(fila)
+            if not self.clientes:
+                # Ninguém ouvindo: o próximo a conectar marca outro ponto de partida
+                self.com_clientes.clear()
+                self.versao = None
+                self.ultimo_id = None
+                self.stats = None
+
+    def conectado(self, fila):
+        return fila in self.clientes
+
+    def publicar(self, mensagem):
+        with self.lock:
+            clientes = list(self.clientes)
+        for fila in clientes:
+            try:
+                fila.put_nowait(mensagem)
+            except queue.Full:
+                self.cancelar(fila)  # cliente travado: ele reconecta e recupera pelo id
+
+    def _estado(self):
+        return {**get_stats(), 'ultima': get_ultima_atualizacao()}
+
+    def verificar(self):
+        versao = versao_dados()
+        if versao == self.versao:
+            return
+        self.versao = versao
+        with self.lock:
+            ultimo_id = self.ultimo_id
+        if ultimo_id is None:
+            return  # todos saíram desde a última volta
+        
+        while True:
+            novas = _promocoes_desde(ultimo_id)
+            if not novas:
+                break
+            ultimo_id = novas[-1]['id']
+            self.publicar(_evento_sse('promocoes', novas, ultimo_id))
+        with self.lock:
+            if self.ultimo_id is not None:
+                self.ultimo_id = ultimo_id
+        
+        stats = self._estado()
+        anteriores, self.stats = self.stats, stats
+        if anteriores is None:
+            return  # primeira leitura: só guarda para comparar
+        alteradas = {k: v for k, v in stats.items() if anteriores.get(k) != v}
+        if alteradas:
+            self.publicar(_evento_sse('stats', alteradas))
+
+    def _loop(self):
+        while True:
+            # Ninguém ouvindo: parada até alguém conectar
+            self.com_clientes.wait()
+            time.sleep(SSE_INTERVALO)
+            if not self.clientes:
+                continue
+            try:
+                self.verificar()
+            except Exception as e:
+                print(f"Erro no transmissor: {e}")
+
+transmissor = Transmissor()
+
+def eventos_stream(fila, desde=None):
+    """Gerador da resposta: recupera o que o cliente perdeu e segue a fila"""
+    try:
+        yield "retry: 5000\n\n"
+        if desde is not None:
+            perdidas = _promocoes_desde(desde)
+            if perdidas:
+                yield _evento_sse('promocoes', perdidas, perdidas[-1]['id'])
+        while transmissor.conectado(fila):
+            try:
+                yield fila.get(timeout=SSE_HEARTBEAT)
+            except queue.Empty:
+                yield ": ping\n\n"
+    finally:
+        transmissor.cancelar(fila)
+
+# ============================================================
+# HTML TEMPLATE
+# ============================================================
+
+CSS = '''
+* { box-sizing: border-box; }
+body { 
+    background: linear-gradient(135deg, #1a1a2e 0%, #16213e 50%, #0f3460 100%);
+    min-height: 100vh; 
+    color: #fff;
+    font-family: 'Segoe UI', system-ui, sans-serif;
+}
+.container { max-width: 1200px; padding: 20px; }
+
+.header {
+    background: rgba(255,255,255,0.05);
+    backdrop-filter: blur(10px);
+    border-radius: 20px;
+    padding: 25px;
+    margin-bottom: 25px;
+    border: 1px solid rgba(255,255,255,0.1);
+}
+.header h1 { 
+    font-size: 1.8rem; 
+    font-weight: 700;
+    background: linear-gradient(90deg, #00d4ff, #7b2cbf);
+    -webkit-background-clip: text;
+    -webkit-text-fill-color: transparent;
+}
+
+.auto-badge {
+    background: linear-gradient(90deg, #00ff88, #00d4ff);
+    color: #000;
+    padding: 4px 12px;
+    border-radius: 20px;
+    font-size: 0.75rem;
+    font-weight: 600;
+}
+
+.stats-grid { 
+    display: grid; 
+    grid-template-columns: repeat(auto-fit, minmax(140px, 1fr)); 
+    gap: 15px; 
+    margin-bottom: 25px; 
+}
+.stat-card {
+    background: rgba(255,255,255,0.05);
+    border-radius: 16px;
+    padding: 20px;
+    text-align: center;
+    border: 1px solid rgba(255,255,255,0.1);
+    transition: transform 0.3s;
+}
+.stat-card:hover { transform: translateY(-5px); }
+.stat-card .icon { font-size: 2rem; margin-bottom: 8px; }
+.stat-card .number { font-size: 1.8rem; font-weight: 700; }
+.stat-card .label { font-size: 0.8rem; opacity: 0.7; }
+
+.filters {
+    display: flex;
+    gap: 10px;
+    flex-wrap: wrap;
+    margin-bottom: 20px;
+}
+.filter-btn {
+    background: rgba(255,255,255,0.1);
+    border: 1px solid rgba(255,255,255,0.2);
+    color: #fff;
+    padding: 10px 20px;
+    border-radius: 25px;
+    cursor: pointer;
+    transition: all 0.3s;
+    font-size: 0.9rem;
+}
+.filter-btn:hover, .filter-btn.active {
+    background: linear-gradient(90deg, #00d4ff, #7b2cbf);
+    border-color: transparent;
+}
+
+.busca { flex: 1; min-width: 220px; }
+.busca input {
+    width: 100%;
+    background: rgba(255,255,255,0.1);
+    border: 1px solid rgba(255,255,255,0.2);
+    color: #fff;
+    padding: 10px 20px;
+    border-radius: 25px;
+}
+.busca input::placeholder { color: rgba(255,255,255,0.5); }
+mark { background: rgba(0,212,255,0.3); color: #fff; padding: 0; }
+
+.promo-card {
+    background: rgba(255,255,255,0.05);
+    border-radius: 16px;
+    padding: 20px;
+    margin-bottom: 15px;
+    border-left: 4px solid;
+    border: 1px solid rgba(255,255,255,0.1);
+    transition: all 0.3s;
+}
+.promo-card:hover {
+    background: rgba(255,255,255,0.08);
+    transform: translateX(5px);
+}
+.promo-card.passagem { border-left-color: #00d4ff; }
+.promo-card.milhas { border-left-color: #00ff88; }
+.promo-card.transferencia_bonificada { border-left-color: #ff6b6b; }
+
+.promo-badge {
+    display: inline-block;
+    padding: 4px 12px;
+    border-radius: 20px;
+    font-size: 0.75rem;
+    font-weight: 600;
+}
+.badge-passagem { background: rgba(0,212,255,0.2); color: #00d4ff; }
+.badge-milhas { background: rgba(0,255,136,0.2); color: #00ff88; }
+.badge-bonificada { background: rgba(255,107,107,0.2); color: #ff6b6b; }
+
+.promo-title {
+    color: #fff;
+    text-decoration: none;
+    font-weight: 600;
+    font-size: 1rem;
+    display: block;
+    margin: 12px 0;
+    line-height: 1.4;
+}
+.promo-title:hover { color: #00d4ff; }
+
+.promo-meta {
+    display: flex;
+    gap: 15px;
+    flex-wrap: wrap;
+    font-size: 0.8rem;
+    opacity: 0.7;
+}
+
+.price-tag {
+    background: linear-gradient(90deg, #00ff88, #00d4ff);
+    color: #000;
+    padding: 4px 12px;
+    border-radius: 20px;
+    font-weight: 700;
+    font-size: 0.85rem;
+}
+.bonus-tag {
+    background: linear-gradient(90deg, #ff6b6b, #ffa500);
+    color: #000;
+    padding: 4px 12px;
+    border-radius: 20px;
+    font-weight: 700;
+    font-size: 0.85rem;
+}
+
+.btn-atualizar {
+    background: linear-gradient(90deg, #00d4ff, #7b2cbf);
+    border: none;
+    color: #fff;
+    padding: 12px 25px;
+    border-radius: 25px;
+    font-weight: 600;
+    cursor: pointer;
+    transition: transform 0.3s;
+}
+.btn-atualizar:hover { transform: scale(1.05); color: #fff; }
+.btn-atualizar:disabled { opacity: 0.5; cursor: wait; }
+
+.telegram-box {
+    background: rgba(0,136,204,0.1);
+    border: 1px solid rgba(0,136,204,0.3);
+    border-radius: 12px;
+    padding: 15px;
+    margin-bottom: 20px;
+    display: flex;
+    align-items: center;
+    gap: 15px;
+    flex-wrap: wrap;
+}
+
+.empty-state {
+    text-align: center;
+    padding: 60px 20px;
+    opacity: 0.5;
+}
+
+.destino-tag {
+    background: rgba(255,255,255,0.1);
+    padding: 2px 8px;
+    border-radius: 10px;
+    font-size: 0.75rem;
+}
+
+.score-tag {
+    background: rgba(0,184,148,0.2);
+    color: #55efc4;
+    padding: 2px 8px;
+    border-radius: 10px;
+    font-size: 0.75rem;
+}
+
+@media (max-width: 768px) {
+    .header h1 { font-size: 1.4rem; }
+    .stat-card .number { font-size: 1.4rem; }
+}
+'''
+
+JS = '''
+const MAX_CONSULTAS_JOB = 300;
 
-def get_db():
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+async function atualizar() {
+    const btn = document.getElementById('btnAtualizar');
+    btn.disabled = true;
+    btn.innerHTML = '<i class="bi bi-hourglass-split"></i> Buscando...';
 
-def init_db():
-    conn = get_db()
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS promocoes (
-            hash_id TEXT PRIMARY KEY,
-            tipo TEXT,
-            titulo TEXT,
-            url TEXT,
-            fonte TEXT,
-            data_encontrada TEXT,
-            preco REAL,
-            bonus_percentual INTEGER,
-            programa TEXT,
-            destino TEXT,
-            notificado INTEGER DEFAULT 0
-        )
-    ''')
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS config (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    try {
+        const res = await fetch('/api/atualizar', {method: 'POST'});
+        if (!res.ok) throw new Error(res.status);
+        const {job_id} = await res.json();
+        // Acompanha o job até terminar (ou desiste depois de ~10 min)
+        for (let tentativa = 0; tentativa < MAX_CONSULTAS_JOB; tentativa++) {
+            await new Promise(r => setTimeout(r, 2000));
+            const resposta = await fetch('/api/jobs/' + job_id);
+            if (!resposta.ok) break;  // job apagado pela limpeza
+            const job = await resposta.json();
+            if (job.status === 'concluido' || job.status === 'erro') break;
+        }
+        // Com o stream aberto as novas já chegaram pelo SSE
+        if (!stream || stream.readyState !== EventSource.OPEN) location.reload();
+    } catch(e) {
+        alert('Erro ao atualizar');
+    }
+    btn.disabled = false;
+    btn.innerHTML = '<i class="bi bi-arrow-clockwise"></i> Atualizar';
+}
 
-def salvar_promocao(promo: Promocao) -> bool:
-    """Salva promoção. Retorna True se for nova."""
-    conn = get_db()
-    
-    # Verifica se já existe
-    existe = conn.execute(
-        'SELECT 1 FROM promocoes WHERE hash_id = ?', 
-        (promo.hash_id,)
-    ).fetchone()
-    
-    if existe:
-        conn.close()
-        return False
-    
-    # Nova promoção
-    conn.execute('''
-        INSERT INTO promocoes VALUES (?,?,?,?,?,?,?,?,?,?,0)
-    ''', (promo.hash_id, promo.tipo, promo.titulo, promo.url, promo.fonte,
-          promo.data_encontrada, promo.preco, promo.bonus_percentual, 
-          promo.programa, promo.destino))
-    conn.commit()
-    conn.close()
-    return True
+let stream = null;
+let modoBusca = false;
+const INTERVALO_CONSULTA = 60000;  // sem stream (servidor cheio): consulta a cada minuto
 
-def get_promocoes(tipo=None, limite=100):
-    conn = get_db()
-    if tipo and tipo != 'todas':
-        rows = conn.execute(
-            'SELECT * FROM promocoes WHERE tipo=? ORDER BY rowid DESC LIMIT ?',
-            (tipo, limite)
-        ).fetchall()
-    else:
-        rows = conn.execute(
-            'SELECT * FROM promocoes ORDER BY rowid DESC LIMIT ?',
-            (limite,)
-        ).fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+// promocoes: da mais antiga para a mais nova
+function inserirNovas(promocoes) {
+    if (modoBusca) return;
+    const novas = promocoes
+        .filter(p => filtroAtual === 'todas' || p.tipo === filtroAtual)
+        .filter(p => !document.querySelector(`.promo-card[data-id="${p.id}"]`))
+        .reverse();
+    if (!novas.length) return;
+    const lista = document.getElementById('lista');
+    lista.querySelector('.empty-state')?.remove();
+    lista.insertAdjacentHTML('afterbegin', novas.map(cartao).join(''));
+}
 
-def get_stats():
-    conn = get_db()
-    stats = {
-        'passagens': conn.execute("SELECT COUNT(*) FROM promocoes WHERE tipo='passagem'").fetchone()[0],
-        'milhas': conn.execute("SELECT COUNT(*) FROM promocoes WHERE tipo='milhas'").fetchone()[0],
-        'bonificadas': conn.execute("SELECT COUNT(*) FROM promocoes WHERE tipo='transferencia_bonificada'").fetchone()[0],
-        'menor_preco': conn.execute("SELECT MIN(preco) FROM promocoes WHERE preco > 0").fetchone()[0],
-        'maior_bonus': conn.execute("SELECT MAX(bonus_percentual) FROM promocoes").fetchone()[0],
+function aplicarStats(s) {
+    const campos = {passagens: 'sPassagens', milhas: 'sMilhas', bonificadas: 'sBonificadas', ultima: 'lastUpdate'};
+    for (const [campo, id] of Object.entries(campos)) {
+        if (campo in s) document.getElementById(id).textContent = s[campo];
     }
-    stats['total'] = stats['passagens'] + stats['milhas'] + stats['bonificadas']
-    conn.close()
-    return stats
+    if ('maior_bonus' in s) document.getElementById('sBonus').textContent = (s.maior_bonus || 0) + '%';
+}
 
-def get_ultima_atualizacao():
-    conn = get_db()
-    row = conn.execute("SELECT value FROM config WHERE key='ultima_atualizacao'").fetchone()
-    conn.close()
-    return row[0] if row else None
+async function consultarNovidades() {
+    try {
+        const mais_nova = Math.max(0, ...[...document.querySelectorAll('.promo-card[data-id]')].map(c => +c.dataset.id));
+        const data = await (await fetch('/api/promocoes?tipo=' + filtroAtual)).json();
+        inserirNovas(data.promocoes.filter(p => p.id > mais_nova).reverse());
+        aplicarStats(await (await fetch('/api/stats')).json());
+    } catch (e) {}
+    // Tenta o stream de novo: pode ter vagado uma conexão
+    setTimeout(conectarStream, INTERVALO_CONSULTA);
+}
 
-def set_ultima_atualizacao():
-    conn = get_db()
-    now = datetime.now().strftime("%d/%m/%Y %H:%M")
-    conn.execute("INSERT OR REPLACE INTO config VALUES ('ultima_atualizacao', ?)", (now,))
-    conn.commit()
-    conn.close()
-    return now
+function conectarStream() {
+    if (!window.EventSource) return;
+    // desde: a mais nova na página; nas reconexões o navegador manda Last-Event-ID
+    const mais_nova = Math.max(ULTIMO_ID, ...[...document.querySelectorAll('.promo-card[data-id]')].map(c => +c.dataset.id));
+    stream = new EventSource('/api/stream' + (mais_nova ? '?desde=' + mais_nova : ''));
+    stream.addEventListener('promocoes', ev => inserirNovas(JSON.parse(ev.data)));
+    stream.addEventListener('stats', ev => aplicarStats(JSON.parse(ev.data)));
+    stream.onerror = () => {
+        // Resposta que não é stream (503): o navegador desiste; passa a consultar
+        if (stream.readyState === EventSource.CLOSED) setTimeout(consultarNovidades, INTERVALO_CONSULTA);
+    };
+}
 
-# ============================================================
-# SCRAPERS
-# ============================================================
+document.addEventListener('DOMContentLoaded', conectarStream);
 
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36',
-    'Accept-Language': 'pt-BR,pt;q=0.9',
+let filtroAtual = 'todas';
+let proximo = PROXIMO;
+
+async function filtrar(tipo, el) {
+    document.querySelectorAll('.filters .filter-btn').forEach(b => b.classList.remove('active'));
+    el.classList.add('active');
+
+    filtroAtual = tipo;
+    modoBusca = false;
+    const res = await fetch('/api/promocoes?tipo=' + tipo);
+    const data = await res.json();
+    renderizar(data.promocoes);
+    paginar(data.proximo);
 }
 
-def fetch(url):
-    try:
-        r = requests.get(url, headers=HEADERS, timeout=15)
-        return BeautifulSoup(r.text, 'html.parser') if r.ok else None
-    except:
-        return None
+async function buscar(ev) {
+    ev.preventDefault();
+    const q = document.getElementById('q').value.trim();
+    if (!q) return;
+    document.querySelectorAll('.filters .filter-btn').forEach(b => b.classList.remove('active'));
+    modoBusca = true;
 
-def extrair_preco(texto):
-    m = re.search(r'R\$\s*([\d.,]+)', texto)
-    if m:
-        try:
-            return float(m.group(1).replace('.','').replace(',','.'))
-        except:
-            pass
-    return None
+    const res = await fetch('/api/busca?q=' + encodeURIComponent(q));
+    const data = await res.json();
+    renderizar(data.resultados || []);
+    paginar(null);
+}
 
-def extrair_bonus(texto):
-    m = re.search(r'(\d+)\s*%', texto)
-    return int(m.group(1)) if m else None
+async function carregarMais() {
+    if (!proximo) return;
+    const res = await fetch('/api/promocoes?tipo=' + filtroAtual + '&before=' + proximo);
+    const data = await res.json();
+    renderizar(data.promocoes, true);
+    paginar(data.proximo);
+}
 
-def extrair_destino(texto):
-    destinos = ['miami', 'orlando', 'nova york', 'new york', 'paris', 'londres', 
-                'roma', 'lisboa', 'porto', 'madrid', 'barcelona', 'cancun',
-                'buenos aires', 'santiago', 'dubai', 'tokyo', 'los angeles',
-                'nova iorque', 'milao', 'amsterdam', 'berlim']
-    texto_lower = texto.lower()
-    for d in destinos:
-        if d in texto_lower:
-            return d.title()
-    return None
+function paginar(cursor) {
+    proximo = cursor;
+    document.getElementById('btnMais').style.display = cursor ? '' : 'none';
+}
 
-def identificar_programa(texto):
-    programas = {'smiles': 'Smiles', 'latam': 'LATAM Pass', 'azul': 'TudoAzul',
-                 'livelo': 'Livelo', 'esfera': 'Esfera'}
-    for k, v in programas.items():
-        if k in texto.lower():
-            return v
-    return None
+function renderizar(promos, anexar = false) {
+    const lista = document.getElementById('lista');
+    if (!promos.length && !anexar) {
+        lista.innerHTML = '<div class="empty-state"><h4>Nenhuma promoção encontrada</h4></div>';
+        return;
+    }
 
-def buscar_melhores_destinos():
-    promocoes = []
-    urls = [
-        ("https://www.melhoresdestinos.com.br/promocoes-de-passagens-aereas", "passagem"),
-        ("https://www.melhoresdestinos.com.br/categoria/milhas-aereas", "milhas"),
-    ]
-    
-    for url, tipo_default in urls:
-        soup = fetch(url)
-        if not soup:
-            continue
-        
-        for article in soup.select('article, .post-item')[:25]:
-            try:
-                link_elem = article.select_one('h2 a, h3 a, a.post-title')
-                if not link_elem:
-                    continue
-                
-                titulo = link_elem.get_text(strip=True)
-                href = link_elem.get('href', '')
-                if not href.startswith('http'):
-                    href = "https://www.melhoresdestinos.com.br" + href
-                
-                is_bonus = any(x in titulo.lower() for x in ['bônus', 'bonus', 'bonificad'])
-                tipo = 'transferencia_bonificada' if is_bonus else tipo_default
-                
-                promo = Promocao(
-                    tipo=tipo,
-                    titulo=titulo[:150],
-                    url=href,
-                    fonte='Melhores Destinos',
-                    preco=extrair_preco(titulo),
-                    bonus_percentual=extrair_bonus(titulo) if is_bonus else None,
-                    programa=identificar_programa(titulo),
-                    destino=extrair_destino(titulo)
-                )
-                promocoes.append(promo)
-            except:
-                continue
-    
-    return promocoes
+    const html = promos.map(cartao).join('');
+    if (anexar) {
+        lista.insertAdjacentHTML('beforeend', html);
+    } else {
+        lista.innerHTML = html;
+    }
+}
 
-def buscar_passagens_imperdiveis():
-    promocoes = []
-    soup = fetch("https://www.passagensimperdiveis.com.br")
-    if not soup:
-        return promocoes
-    
-    for article in soup.select('article, .post')[:20]:
-        try:
-            link_elem = article.select_one('h2 a, h3 a, a.title')
-            if not link_elem:
-                continue
-            
-            titulo = link_elem.get_text(strip=True)
-            href = link_elem.get('href', '')
-            if not href.startswith('http'):
-                href = "https://www.passagensimperdiveis.com.br" + href
-            
-            promo = Promocao(
-                tipo='passagem',
-                titulo=titulo[:150],
-                url=href,
-                fonte='Passagens Imperdíveis',
-                preco=extrair_preco(titulo),
-                destino=extrair_destino(titulo)
-            )
-            promocoes.append(promo)
-        except:
-            continue
-    
-    return promocoes
+// Tudo que vem das fontes é texto de terceiros: escapa antes de montar o HTML
+function esc(valor) {
+    return String(valor ?? '').replace(/[&<>"']/g, c => ({
+        '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+    })[c]);
+}
 
-def buscar_todas(notificar=True):
-    """Busca todas as promoções e notifica as novas"""
-    todas = []
-    novas = []
-    
-    todas.extend(buscar_melhores_destinos())
-    todas.extend(buscar_passagens_imperdiveis())
-    
-    for p in todas:
-        is_nova = salvar_promocao(p)
-        if is_nova:
-            novas.append(p.__dict__ if hasattr(p, '__dict__') else asdict(p))
-    
-    set_ultima_atualizacao()
-    
-    # Notifica no Telegram se houver novas
-    if notificar and novas and TELEGRAM_BOT_TOKEN:
-        # Envia resumo
-        notificar_resumo(novas)
-        
-        # Envia detalhes das melhores (top 3)
-        # Prioriza: bonificadas com alto %, passagens baratas
-        bonus_altos = sorted(
-            [p for p in novas if p.get('bonus_percentual')],
-            key=lambda x: x.get('bonus_percentual', 0),
-            reverse=True
-        )[:2]
-        
-        passagens_baratas = sorted(
-            [p for p in novas if p.get('preco')],
-            key=lambda x: x.get('preco', 999999)
-        )[:2]
-        
-        destaques = bonus_altos + passagens_baratas
-        for p in destaques[:3]:
-            notificar_promocao(p)
-            time.sleep(1)  # Evita flood
-    
-    return len(todas), len(novas)
+function urlSegura(url) {
+    return /^https?:/i.test(url || '') ? esc(url) : '#';
+}
 
-# ============================================================
-# HTML TEMPLATE
-# ============================================================
+function cartao(p) {
+    const badge = p.tipo === 'passagem' ? '✈️ Passagem' : (p.tipo === 'milhas' ? '🎯 Milhas' : '🔥 Bonificada');
+    const badgeClass = p.tipo === 'transferencia_bonificada' ? 'bonificada' : p.tipo;
+    return `
+        <div class="promo-card ${esc(p.tipo)}" data-id="${esc(p.id)}">
+            <div class="d-flex justify-content-between align-items-start flex-wrap gap-2">
+                <span class="promo-badge badge-${esc(badgeClass)}">${badge}</span>
+                <div>
+                    ${p.preco ? `<span class="price-tag">R$ ${Math.round(p.preco)}</span>` : ''}
+                    ${p.bonus_percentual ? `<span class="bonus-tag">${esc(p.bonus_percentual)}%</span>` : ''}
+                </div>
+            </div>
+            <a href="${urlSegura(p.url)}" target="_blank" rel="noopener" class="promo-title">${esc(p.trecho || p.titulo)}</a>
+            <div class="promo-meta">
+                <span><i class="bi bi-newspaper"></i> ${esc(p.fonte)}</span>
+                <span><i class="bi bi-clock"></i> ${esc(p.data_encontrada)}</span>
+                ${p.destino ? `<span class="destino-tag">📍 ${esc(p.destino)}</span>` : ''}
+                ${p.score > 0 ? `<span class="score-tag" title="abaixo da mediana de 90 dias da rota">📉 ${Math.round(p.score)}% abaixo</span>` : ''}
+                ${p.programa ? `<span><i class="bi bi-tag"></i> ${esc(p.programa)}</span>` : ''}
+            </div>
+        </div>
+    `;
+}
+'''
 
 HTML = '''
 <!DOCTYPE html>
@@ -420,188 +3585,7 @@ HTML = '''
     <title>🛫 Promoções de Viagem</title>
     <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css" rel="stylesheet">
     <link href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.1/font/bootstrap-icons.css" rel="stylesheet">
-    <style>
-        * { box-sizing: border-box; }
-        body { 
-            background: linear-gradient(135deg, #1a1a2e 0%, #16213e 50%, #0f3460 100%);
-            min-height: 100vh; 
-            color: #fff;
-            font-family: 'Segoe UI', system-ui, sans-serif;
-        }
-        .container { max-width: 1200px; padding: 20px; }
-        
-        .header {
-            background: rgba(255,255,255,0.05);
-            backdrop-filter: blur(10px);
-            border-radius: 20px;
-            padding: 25px;
-            margin-bottom: 25px;
-            border: 1px solid rgba(255,255,255,0.1);
-        }
-        .header h1 { 
-            font-size: 1.8rem; 
-            font-weight: 700;
-            background: linear-gradient(90deg, #00d4ff, #7b2cbf);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-        }
-        
-        .auto-badge {
-            background: linear-gradient(90deg, #00ff88, #00d4ff);
-            color: #000;
-            padding: 4px 12px;
-            border-radius: 20px;
-            font-size: 0.75rem;
-            font-weight: 600;
-        }
-        
-        .stats-grid { 
-            display: grid; 
-            grid-template-columns: repeat(auto-fit, minmax(140px, 1fr)); 
-            gap: 15px; 
-            margin-bottom: 25px; 
-        }
-        .stat-card {
-            background: rgba(255,255,255,0.05);
-            border-radius: 16px;
-            padding: 20px;
-            text-align: center;
-            border: 1px solid rgba(255,255,255,0.1);
-            transition: transform 0.3s;
-        }
-        .stat-card:hover { transform: translateY(-5px); }
-        .stat-card .icon { font-size: 2rem; margin-bottom: 8px; }
-        .stat-card .number { font-size: 1.8rem; font-weight: 700; }
-        .stat-card .label { font-size: 0.8rem; opacity: 0.7; }
-        
-        .filters {
-            display: flex;
-            gap: 10px;
-            flex-wrap: wrap;
-            margin-bottom: 20px;
-        }
-        .filter-btn {
-            background: rgba(255,255,255,0.1);
-            border: 1px solid rgba(255,255,255,0.2);
-            color: #fff;
-            padding: 10px 20px;
-            border-radius: 25px;
-            cursor: pointer;
-            transition: all 0.3s;
-            font-size: 0.9rem;
-        }
-        .filter-btn:hover, .filter-btn.active {
-            background: linear-gradient(90deg, #00d4ff, #7b2cbf);
-            border-color: transparent;
-        }
-        
-        .promo-card {
-            background: rgba(255,255,255,0.05);
-            border-radius: 16px;
-            padding: 20px;
-            margin-bottom: 15px;
-            border-left: 4px solid;
-            border: 1px solid rgba(255,255,255,0.1);
-            transition: all 0.3s;
-        }
-        .promo-card:hover {
-            background: rgba(255,255,255,0.08);
-            transform: translateX(5px);
-        }
-        .promo-card.passagem { border-left-color: #00d4ff; }
-        .promo-card.milhas { border-left-color: #00ff88; }
-        .promo-card.transferencia_bonificada { border-left-color: #ff6b6b; }
-        
-        .promo-badge {
-            display: inline-block;
-            padding: 4px 12px;
-            border-radius: 20px;
-            font-size: 0.75rem;
-            font-weight: 600;
-        }
-        .badge-passagem { background: rgba(0,212,255,0.2); color: #00d4ff; }
-        .badge-milhas { background: rgba(0,255,136,0.2); color: #00ff88; }
-        .badge-bonificada { background: rgba(255,107,107,0.2); color: #ff6b6b; }
-        
-        .promo-title {
-            color: #fff;
-            text-decoration: none;
-            font-weight: 600;
-            font-size: 1rem;
-            display: block;
-            margin: 12px 0;
-            line-height: 1.4;
-        }
-        .promo-title:hover { color: #00d4ff; }
-        
-        .promo-meta {
-            display: flex;
-            gap: 15px;
-            flex-wrap: wrap;
-            font-size: 0.8rem;
-            opacity: 0.7;
-        }
-        
-        .price-tag {
-            background: linear-gradient(90deg, #00ff88, #00d4ff);
-            color: #000;
-            padding: 4px 12px;
-            border-radius: 20px;
-            font-weight: 700;
-            font-size: 0.85rem;
-        }
-        .bonus-tag {
-            background: linear-gradient(90deg, #ff6b6b, #ffa500);
-            color: #000;
-            padding: 4px 12px;
-            border-radius: 20px;
-            font-weight: 700;
-            font-size: 0.85rem;
-        }
-        
-        .btn-atualizar {
-            background: linear-gradient(90deg, #00d4ff, #7b2cbf);
-            border: none;
-            color: #fff;
-            padding: 12px 25px;
-            border-radius: 25px;
-            font-weight: 600;
-            cursor: pointer;
-            transition: transform 0.3s;
-        }
-        .btn-atualizar:hover { transform: scale(1.05); color: #fff; }
-        .btn-atualizar:disabled { opacity: 0.5; cursor: wait; }
-        
-        .telegram-box {
-            background: rgba(0,136,204,0.1);
-            border: 1px solid rgba(0,136,204,0.3);
-            border-radius: 12px;
-            padding: 15px;
-            margin-bottom: 20px;
-            display: flex;
-            align-items: center;
-            gap: 15px;
-            flex-wrap: wrap;
-        }
-        
-        .empty-state {
-            text-align: center;
-            padding: 60px 20px;
-            opacity: 0.5;
-        }
-        
-        .destino-tag {
-            background: rgba(255,255,255,0.1);
-            padding: 2px 8px;
-            border-radius: 10px;
-            font-size: 0.75rem;
-        }
-        
-        @media (max-width: 768px) {
-            .header h1 { font-size: 1.4rem; }
-            .stat-card .number { font-size: 1.4rem; }
-        }
-    </style>
+    <link href="{{ asset_url('app.css') }}" rel="stylesheet">
 </head>
 <body>
     <div class="container">
@@ -663,13 +3647,16 @@ HTML = '''
             <button class="filter-btn" onclick="filtrar('passagem', this)">✈️ Passagens</button>
             <button class="filter-btn" onclick="filtrar('milhas', this)">🎯 Milhas</button>
             <button class="filter-btn" onclick="filtrar('transferencia_bonificada', this)">🔥 Bonificadas</button>
+            <form class="busca" onsubmit="buscar(event)">
+                <input type="search" id="q" placeholder="Buscar: Lisboa executiva, Smiles 100%...">
+            </form>
         </div>
         
         <!-- Lista -->
         <div id="lista">
             {% if promos %}
                 {% for p in promos %}
-                <div class="promo-card {{ p.tipo }}">
+                <div class="promo-card {{ p.tipo }}" data-id="{{ p.id }}">
                     <div class="d-flex justify-content-between align-items-start flex-wrap gap-2">
                         <span class="promo-badge badge-{{ 'bonificada' if p.tipo == 'transferencia_bonificada' else p.tipo }}">
                             {{ '✈️ Passagem' if p.tipo == 'passagem' else ('🎯 Milhas' if p.tipo == 'milhas' else '🔥 Bonificada') }}
@@ -679,11 +3666,12 @@ HTML = '''
                             {% if p.bonus_percentual %}<span class="bonus-tag">{{ p.bonus_percentual }}%</span>{% endif %}
                         </div>
                     </div>
-                    <a href="{{ p.url }}" target="_blank" class="promo-title">{{ p.titulo }}</a>
+                    <a href="{{ p.url if p.url.startswith(('http://', 'https://')) else '#' }}" target="_blank" rel="noopener" class="promo-title">{{ p.titulo }}</a>
                     <div class="promo-meta">
                         <span><i class="bi bi-newspaper"></i> {{ p.fonte }}</span>
                         <span><i class="bi bi-clock"></i> {{ p.data_encontrada }}</span>
                         {% if p.destino %}<span class="destino-tag">📍 {{ p.destino }}</span>{% endif %}
+                        {% if p.score and p.score > 0 %}<span class="score-tag" title="abaixo da mediana de 90 dias da rota">📉 {{ p.score|round|int }}% abaixo</span>{% endif %}
                         {% if p.programa %}<span><i class="bi bi-tag"></i> {{ p.programa }}</span>{% endif %}
                     </div>
                 </div>
@@ -694,95 +3682,277 @@ HTML = '''
                 </div>
             {% endif %}
         </div>
+        
+        <div class="text-center mb-4">
+            <button class="filter-btn" id="btnMais" onclick="carregarMais()"
+                    {% if not proximo %}style="display:none"{% endif %}>
+                Carregar mais
+            </button>
+        </div>
     </div>
     
-    <script>
-        async function atualizar() {
-            const btn = document.getElementById('btnAtualizar');
-            btn.disabled = true;
-            btn.innerHTML = '<i class="bi bi-hourglass-split"></i> Buscando...';
-            
-            try {
-                await fetch('/api/atualizar', {method: 'POST'});
-                location.reload();
-            } catch(e) {
-                alert('Erro ao atualizar');
-                btn.disabled = false;
-                btn.innerHTML = '<i class="bi bi-arrow-clockwise"></i> Atualizar';
-            }
-        }
-        
-        async function filtrar(tipo, el) {
-            document.querySelectorAll('.filter-btn').forEach(b => b.classList.remove('active'));
-            el.classList.add('active');
-            
-            const res = await fetch('/api/promocoes?tipo=' + tipo);
-            const data = await res.json();
-            renderizar(data.promocoes);
-        }
-        
-        function renderizar(promos) {
-            const lista = document.getElementById('lista');
-            if (!promos.length) {
-                lista.innerHTML = '<div class="empty-state"><h4>Nenhuma promoção encontrada</h4></div>';
-                return;
-            }
-            
-            lista.innerHTML = promos.map(p => {
-                const badge = p.tipo === 'passagem' ? '✈️ Passagem' : (p.tipo === 'milhas' ? '🎯 Milhas' : '🔥 Bonificada');
-                const badgeClass = p.tipo === 'transferencia_bonificada' ? 'bonificada' : p.tipo;
-                return `
-                    <div class="promo-card ${p.tipo}">
-                        <div class="d-flex justify-content-between align-items-start flex-wrap gap-2">
-                            <span class="promo-badge badge-${badgeClass}">${badge}</span>
-                            <div>
-                                ${p.preco ? `<span class="price-tag">R$ ${Math.round(p.preco)}</span>` : ''}
-                                ${p.bonus_percentual ? `<span class="bonus-tag">${p.bonus_percentual}%</span>` : ''}
-                            </div>
-                        </div>
-                        <a href="${p.url}" target="_blank" class="promo-title">${p.titulo}</a>
-                        <div class="promo-meta">
-                            <span><i class="bi bi-newspaper"></i> ${p.fonte}</span>
-                            <span><i class="bi bi-clock"></i> ${p.data_encontrada}</span>
-                            ${p.destino ? `<span class="destino-tag">📍 ${p.destino}</span>` : ''}
-                            ${p.programa ? `<span><i class="bi bi-tag"></i> ${p.programa}</span>` : ''}
-                        </div>
-                    </div>
-                `;
-            }).join('');
-        }
-    </script>
+    <script>const PROXIMO = {{ proximo|tojson }}; const ULTIMO_ID = {{ (promos[0].id if promos else 0)|tojson }};</script>
+    <script src="{{ asset_url('app.js') }}"></script>
 </body>
 </html>
 '''
 
+# CSS e JS saem da página: URL com hash do conteúdo, cache longo no navegador
+ASSETS = {
+    'app.css': (CSS.encode(), 'text/css'),
+    'app.js': (JS.encode(), 'application/javascript'),
+}
+ASSETS_HASH = {nome: hashlib.md5(conteudo).hexdigest()[:10] for nome, (conteudo, _) in ASSETS.items()}
+
+def asset_url(nome):
+    base, ext = nome.rsplit('.', 1)
+    return f"/assets/{base}.{ASSETS_HASH[nome]}.{ext}"
+
+# Compilado uma vez no import (render_template_string recompila/busca a cada request)
+app.jinja_env.globals['asset_url'] = asset_url
+TEMPLATE_INDEX = app.jinja_env.from_string(HTML)
+
+# Opcional: renderiza a página inicial logo após cada atualização
+PAGINA_PRECOMPUTADA = os.environ.get('PAGINA_PRECOMPUTADA', '') == '1'
+
+def renderizar_index():
+    promos, proximo = consultar_promocoes(limite=50)
+    return TEMPLATE_INDEX.render(
+        stats=get_stats(),
+        promos=promos,
+        proximo=proximo,
+        ultima=get_ultima_atualizacao() or 'Nunca',
+        telegram_ativo=bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID)
+    )
+
+def precomputar_pagina():
+    """Deixa a página inicial pronta em bytes no cache de respostas"""
+    guardar_resposta(('/', ()), versao_dados(), renderizar_index().encode(), 'text/html')
+
 # ============================================================
 # ROTAS
 # ============================================================
 
+# No gunicorn o post_worker_init (gunicorn.conf.py) já iniciou o processo
+# ao subir; isto só vale para servidores WSGI sem esse gancho
+@app.before_request
+def _antes_da_requisicao():
+    iniciar_processo()
+
 @app.route('/')
+@cache_resposta
 def index():
-    return render_template_string(HTML,
-        stats=get_stats(),
-        promos=get_promocoes(limite=50),
-        ultima=get_ultima_atualizacao() or 'Nunca',
-        telegram_ativo=bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID)
-    )
+    return renderizar_index()
+
+@app.route('/assets/<arquivo>')
+def assets(arquivo):
+    partes = arquivo.split('.')
+    nome = f"{partes[0]}.{partes[-1]}"
+    if len(partes) != 3 or nome not in ASSETS:
+        return jsonify({'error': 'Not found'}), 404
+    conteudo, mimetype = ASSETS[nome]
+    resposta = app.response_class(conteudo, mimetype=mimetype)
+    if partes[1] == ASSETS_HASH[nome]:
+        resposta.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        # Hash antigo (página de antes de um deploy): entrega o atual sem cache longo
+        resposta.headers['Cache-Control'] = 'no-cache'
+    resposta.set_etag(ASSETS_HASH[nome])
+    return resposta.make_conditional(request)
+
+def _arg_numero(nome, tipo=float):
+    valor = request.args.get(nome)
+    if valor in (None, ''):
+        return None
+    try:
+        return tipo(valor)
+    except ValueError:
+        raise ValueError(f"Parâmetro inválido: {nome}")
+
+def _cursor_score(valor):
+    """'score:id' do ranking -> (float, int); ValueError se não for nesse formato"""
+    score, separador, rowid = valor.partition(':')
+    if not separador:
+        raise ValueError(valor)
+    return float(score), int(rowid)
 
 @app.route('/api/promocoes')
+@cache_resposta
 def api_promocoes():
-    tipo = request.args.get('tipo', 'todas')
-    return jsonify({'promocoes': get_promocoes(tipo=tipo, limite=50)})
+    ordem = request.args.get('ordem', 'recentes')
+    try:
+        if ordem == 'score' and request.args.get('before'):
+            antes = _arg_numero('before', _cursor_score)
+        else:
+            antes = _arg_numero('before', int)
+        preco_min = _arg_numero('preco_min')
+        preco_max = _arg_numero('preco_max')
+        limite = _arg_numero('limite', int) or 50
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    filtros = dict(
+        tipo=request.args.get('tipo', 'todas'),
+        antes=antes,
+        preco_min=preco_min,
+        preco_max=preco_max,
+        destino=request.args.get('destino'),
+        programa=request.args.get('programa'),
+        fonte=request.args.get('fonte'),
+        limite=max(1, min(limite, 200)),
+    )
+    if ordem == 'recentes':
+        pagina = promocoes_recentes.pagina(**filtros)
+        if pagina is not None:
+            # Junta o JSON já pronto de cada promoção, sem montar dicts
+            registros, proximo = pagina
+            corpo = (f'{{"promocoes":[{",".join(r.json for r in registros)}],'
+                     f'"proximo":{json.dumps(proximo)}}}\n')
+            return app.response_class(corpo, mimetype='application/json')
+    
+    promocoes, proximo = consultar_promocoes(ordem=ordem, **filtros)
+    return jsonify({'promocoes': promocoes, 'proximo': proximo})
+
+@app.route('/api/rotas/<path:rota>/precos')
+def api_precos_rota(rota):
+    return jsonify(get_historico_rota(rota))
+
+@app.route('/api/busca')
+def api_busca():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'error': 'Informe o parâmetro q'}), 400
+    if not FTS_DISPONIVEL:
+        return jsonify({'error': 'Busca indisponível (SQLite sem FTS5)'}), 503
+    try:
+        limite = max(1, min(int(request.args.get('limite', 20)), 100))
+    except ValueError:
+        return jsonify({'error': 'Parâmetro inválido: limite'}), 400
+    return jsonify({'q': q, 'resultados': buscar_texto(q, limite)})
 
 @app.route('/api/atualizar', methods=['POST'])
 def api_atualizar():
-    total, novas = buscar_todas(notificar=True)
-    return jsonify({'success': True, 'total': total, 'novas': novas})
+    # Botão do dashboard: busca todas as fontes, sem esperar a agenda
+    job_id, _ = enfileirar_job(parametros={'notificar': True, 'forcar': True})
+    return jsonify({'success': True, 'job_id': job_id}), 202
+
+@app.route('/api/promocoes/<hash_id>/duplicatas')
+def api_duplicatas(hash_id):
+    return jsonify({'canonico': hash_id, 'duplicatas': get_duplicatas(hash_id)})
+
+@app.route('/api/stream')
+def api_stream():
+    """Server-Sent Events: promoções novas e estatísticas que mudaram"""
+    desde = request.headers.get('Last-Event-ID') or request.args.get('desde')
+    try:
+        desde = int(desde) if desde else None
+    except ValueError:
+        desde = None
+    fila = transmissor.inscrever()
+    if fila is None:
+        metricas.contar('sse_recusados_total')
+        return jsonify({'error': 'Muitas conexões ao vivo; use /api/promocoes'}), 503
+    return Response(eventos_stream(fila, desde), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/arquivo')
+def api_arquivo():
+    mes = request.args.get('mes')
+    if not mes:
+        return jsonify({'meses': listar_arquivos()})
+    promocoes = consultar_arquivo(mes, texto=request.args.get('q'), tipo=request.args.get('tipo'),
+                                  destino=request.args.get('destino'))
+    if promocoes is None:
+        return jsonify({'error': 'Mês não arquivado'}), 404
+    return jsonify({'mes': mes, 'promocoes': promocoes})
+
+@app.route('/api/exportar')
+def api_exportar():
+    formato = request.args.get('formato', 'ndjson')
+    if formato not in formatos_disponiveis():
+        return jsonify({'error': f"Formato indisponível: {formato}", 'formatos': formatos_disponiveis()}), 400
+    try:
+        filtros = {
+            'preco_min': _arg_numero('preco_min'),
+            'preco_max': _arg_numero('preco_max'),
+            'desde': _arg_numero('desde', epoch_de_data),
+            'ate': _arg_numero('ate', epoch_de_data),
+        }
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    for nome in ('tipo', 'destino', 'programa', 'fonte'):
+        filtros[nome] = request.args.get(nome)
+    
+    tipo_mime, extensao = FORMATOS_EXPORTACAO[formato]
+    metricas.contar('exportacoes_total', formato=formato)
+    return Response(exportar_promocoes(formato, **filtros), mimetype=tipo_mime, headers={
+        'Content-Disposition': f'attachment; filename="promocoes.{extensao}"',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/api/fontes')
+def api_fontes():
+    return jsonify({'fontes': get_agenda()})
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    return jsonify(job)
 
 @app.route('/api/stats')
+@cache_resposta
 def api_stats():
     return jsonify(get_stats())
 
+# Assinantes e regras: protegidos pela mesma chave do cron
+def _autorizado():
+    return request.args.get('secret', '') == CRON_SECRET
+
+@app.route('/api/assinantes', methods=['GET', 'POST'])
+def api_assinantes():
+    if not _autorizado():
+        return jsonify({'error': 'Unauthorized'}), 401
+    if request.method == 'GET':
+        return jsonify({'assinantes': get_assinantes()})
+    
+    dados = request.get_json(silent=True) or {}
+    if not dados.get('chat_id'):
+        return jsonify({'error': 'Informe chat_id'}), 400
+    ativo = dados.get('ativo', True)
+    if not isinstance(ativo, bool):
+        # Só booleano JSON: o texto "false" contaria como verdadeiro
+        return jsonify({'error': 'ativo: informe true ou false'}), 400
+    assinante_id = salvar_assinante(dados['chat_id'], dados.get('nome'), ativo)
+    return jsonify({'id': assinante_id}), 201
+
+CAMPOS_REGRA = ('destinos', 'programas', 'tipos', 'preco_max', 'bonus_min', 'score_min')
+
+@app.route('/api/assinantes/<int:assinante_id>/regras', methods=['POST'])
+def api_adicionar_regra(assinante_id):
+    if not _autorizado():
+        return jsonify({'error': 'Unauthorized'}), 401
+    dados = request.get_json(silent=True) or {}
+    regra = {c: dados.get(c) for c in CAMPOS_REGRA}
+    if not any(v is not None for v in regra.values()):
+        return jsonify({'error': f"Informe ao menos um de: {', '.join(CAMPOS_REGRA)}"}), 400
+    try:
+        regra = validar_regra(**regra)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not get_db().execute('SELECT 1 FROM assinantes WHERE id = ?', (assinante_id,)).fetchone():
+        return jsonify({'error': 'Assinante não encontrado'}), 404
+    return jsonify({'id': adicionar_regra(assinante_id, **regra)}), 201
+
+@app.route('/api/regras/<int:regra_id>', methods=['DELETE'])
+def api_remover_regra(regra_id):
+    if not _autorizado():
+        return jsonify({'error': 'Unauthorized'}), 401
+    if not remover_regra(regra_id):
+        return jsonify({'error': 'Regra não encontrada'}), 404
+    return jsonify({'success': True})
+
 # Endpoint para o CRON externo chamar
 @app.route('/cron/atualizar')
 def cron_atualizar():
@@ -792,15 +3962,46 @@ def cron_atualizar():
     if secret != CRON_SECRET:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    total, novas = buscar_todas(notificar=True)
+    # Responde na hora; o scraping segue em segundo plano, só com as
+    # fontes vencidas na agenda (?forcar=1 busca todas)
+    forcar = request.args.get('forcar') == '1'
+    job_id, criado = enfileirar_job(parametros={'notificar': True, 'forcar': forcar})
+    # Uma vez por dia, na carona do cron: arquivamento e compactação
+    if manutencao_vencida():
+        enfileirar_job('manutencao')
     return jsonify({
         'success': True,
-        'total': total,
-        'novas': novas,
+        'job_id': job_id,
+        'ja_em_andamento': not criado,
         'timestamp': datetime.now().isoformat()
-    })
+    }), 202
 
 # Health check para manter o serviço ativo
+def _medidas_do_banco():
+    """Gauges lidos na hora: valem para todos os workers, não só este processo"""
+    conn = get_db()
+    medidas = [('promocoes', {}, get_stats()['total']),
+               ('notificacoes_pendentes', {}, conn.execute(
+                   'SELECT COUNT(*) FROM promocoes WHERE notificado = ?', (NOTIF_PENDENTE,)).fetchone()[0]),
+               ('entregas_pendentes', {}, conn.execute(
+                   'SELECT COUNT(*) FROM entregas WHERE status = ?', (NOTIF_PENDENTE,)).fetchone()[0]),
+               ('sse_clientes', {}, len(transmissor.clientes))]
+    for row in conn.execute('SELECT nome, intervalo, ultimo_sucesso FROM agenda_fontes'):
+        medidas.append(('fonte_intervalo_segundos', {'fonte': row['nome']}, row['intervalo']))
+        if row['ultimo_sucesso']:
+            medidas.append(('fonte_ultimo_sucesso_timestamp', {'fonte': row['nome']}, row['ultimo_sucesso']))
+    return medidas
+
+@app.route('/metrics')
+def metrics():
+    return Response(metricas.prometheus(_medidas_do_banco()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/metricas')
+def api_metricas():
+    return jsonify({**metricas.resumo(), 'processo': id_processo(), 'lider': sou_lider(),
+                    'banco': {nome + ''.join(f"[{v}]" for v in rotulos.values()): valor
+                              for nome, rotulos, valor in _medidas_do_banco()}})
+
 @app.route('/health')
 def health():
     return jsonify({'status': 'ok', 'timestamp': datetime.now().isoformat()})
@@ -810,6 +4011,47 @@ def health():
 # ============================================================
 
 if __name__ == '__main__':
-    init_db()
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Dashboard de promoções de viagem')
+    comandos = parser.add_subparsers(dest='comando')
+    comandos.add_parser('servidor', help='sobe o servidor web (padrão)')
+    comandos.add_parser('reconstruir-stats', help='recalcula a tabela de estatísticas')
+    reextrair = comandos.add_parser('reextrair', help='refaz a extração de preço/destino/programa do histórico')
+    reextrair.add_argument('--lote', type=int, default=2000, help='linhas por lote')
+    reextrair.add_argument('--processos', type=int, default=None, help='processos (padrão: núcleos da CPU)')
+    reextrair.add_argument('--reiniciar', action='store_true', help='ignora o checkpoint e começa do início')
+    comandos.add_parser('manutencao', help='arquiva promoções vencidas, limpa tabelas auxiliares e compacta o banco')
+    exportar = comandos.add_parser('exportar', help='exporta o histórico de promoções (NDJSON, CSV, Arrow ou Parquet)')
+    exportar.add_argument('--formato', choices=list(FORMATOS_EXPORTACAO), default='ndjson')
+    exportar.add_argument('--saida', default='-', help='arquivo de saída (padrão: stdout)')
+    for filtro in ('tipo', 'destino', 'programa', 'fonte'):
+        exportar.add_argument(f'--{filtro}')
+    exportar.add_argument('--preco-min', type=float)
+    exportar.add_argument('--preco-max', type=float)
+    exportar.add_argument('--desde', type=epoch_de_data, help='AAAA-MM-DD')
+    exportar.add_argument('--ate', type=epoch_de_data, help='AAAA-MM-DD (exclusivo)')
+    args = parser.parse_args()
+    
+    preparar_banco()
+    if args.comando == 'reconstruir-stats':
+        print(reconstruir_estatisticas())
+    elif args.comando == 'reextrair':
+        processadas, alteradas = reextrair_historico(args.lote, args.processos, args.reiniciar)
+        print(f"Concluído: {processadas} linhas processadas, {alteradas} alteradas")
+    elif args.comando == 'manutencao':
+        print(manutencao())
+    elif args.comando == 'exportar':
+        if args.formato not in formatos_disponiveis():
+            parser.error(f"formato {args.formato} requer o pacote pyarrow")
+        saida = sys.stdout.buffer if args.saida == '-' else open(args.saida, 'wb')
+        with saida:
+            for pedaco in exportar_promocoes(args.formato, tipo=args.tipo, destino=args.destino,
+                                             programa=args.programa, fonte=args.fonte,
+                                             preco_min=args.preco_min, preco_max=args.preco_max,
+                                             desde=args.desde, ate=args.ate):
+                saida.write(pedaco)
+    else:
+        iniciar_processo()
+        port = int(os.environ.get('PORT', 5000))
+        app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,111 @@
+"""
+Benchmark dos parsers de HTML
+=============================
+Compara tempo de parse e pico de memória (RSS) de cada backend de
+`extrair_links` nas páginas de bench/fixtures/ (sintéticas: ver o
+README de lá).
+
+Uso:
+    python bench/parse_bench.py [--repeticoes 50]
+
+Cada backend roda num subprocesso próprio para o pico de RSS de um não
+contaminar o do outro.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(RAIZ, 'bench', 'fixtures')
+sys.path.insert(0, RAIZ)
+
+# (arquivo, seletor de artigo, seletor de link, limite) - iguais aos scrapers
+PAGINAS = [
+    ('melhoresdestinos.html', 'article, .post-item', 'h2 a, h3 a, a.post-title', 25),
+    ('passagensimperdiveis.html', 'article, .post', 'h2 a, h3 a, a.title', 20),
+]
+
+# 'arvore-completa' é o caminho antigo: BeautifulSoup(html, 'html.parser') inteiro
+BACKENDS = ['arvore-completa', 'html.parser', 'lxml', 'stream']
+
+
+def _arvore_completa(html, seletor_artigo, seletor_link, limite):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    links = []
+    for article in soup.select(seletor_artigo)[:limite]:
+        link_elem = article.select_one(seletor_link)
+        if link_elem:
+            links.append((link_elem.get_text(strip=True), link_elem.get('href', '')))
+    return links
+
+
+def rodar_backend(backend, repeticoes):
+    """Executa no processo atual e devolve as medidas em dict"""
+    import app
+
+    if backend == 'lxml' and not app.LXML_DISPONIVEL:
+        return {'backend': backend, 'erro': 'lxml não instalado'}
+
+    paginas = []
+    for arquivo, seletor_artigo, seletor_link, limite in PAGINAS:
+        with open(os.path.join(FIXTURES, arquivo), encoding='utf-8') as f:
+            paginas.append((f.read(), seletor_artigo, seletor_link, limite))
+
+    def uma_rodada():
+        total = 0
+        for html, seletor_artigo, seletor_link, limite in paginas:
+            if backend == 'arvore-completa':
+                links = _arvore_completa(html, seletor_artigo, seletor_link, limite)
+            else:
+                links = app.extrair_links(html, seletor_artigo, seletor_link, limite, parser=backend)
+            total += len(links)
+        return total
+
+    rss_antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    links = uma_rodada()
+    rss_depois = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        uma_rodada()
+    decorrido = time.perf_counter() - inicio
+
+    return {
+        'backend': backend,
+        'links': links,
+        'ms_por_rodada': decorrido / repeticoes * 1000,
+        'pico_rss_kb': rss_depois - rss_antes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeticoes', type=int, default=50)
+    parser.add_argument('--backend', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        print(json.dumps(rodar_backend(args.backend, args.repeticoes)))
+        return
+
+    print(f"{'backend':<16} {'links':>6} {'ms/rodada':>10} {'pico RSS':>10}")
+    for backend in BACKENDS:
+        saida = subprocess.run(
+            [sys.executable, __file__, '--backend', backend, '--repeticoes', str(args.repeticoes)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        r = json.loads(saida.strip().splitlines()[-1])
+        if 'erro' in r:
+            print(f"{backend:<16} {r['erro']}")
+            continue
+        print(f"{backend:<16} {r['links']:>6} {r['ms_por_rodada']:>10.2f} {r['pico_rss_kb']:>8} KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+Benchmark da atualização completa
+=================================
+Roda `buscar_todas` contra um servidor local que devolve as páginas
+sintéticas de bench/fixtures/ (com latência configurável) e um Telegram
+falso, e mede cada etapa: download, parse, extração, gravação e
+notificação. Cada escala (1×, 10×, 100× fontes) roda num subprocesso
+com banco novo.
+
+Uso:
+    python bench/refresh_bench.py [--escalas 1 10 100] [--latencia 50]
+
+Cada cópia de fonte responde num host de loopback próprio (127.0.0.k),
+como sites diferentes: o limite de conexões por host vale como em
+produção. Em sistemas sem a faixa 127/8 inteira use --um-host.
+
+As cópias trocam destinos e preços entre si para não virarem
+quase-duplicatas; promoções sem destino nem preço (bônus de
+transferência) continuam iguais e exercitam a deduplicação.
+"""
+
+import argparse
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(RAIZ, 'bench', 'fixtures')
+sys.path.insert(0, RAIZ)
+
+# slug da URL -> arquivo gravado
+PAGINAS = {
+    'melhoresdestinos': 'melhoresdestinos.html',
+    'passagensimperdiveis': 'passagensimperdiveis.html',
+}
+ESTAGIOS = ['download', 'parse', 'extracao', 'gravacao', 'notificacao']
+
+
+# ------------------------------------------------------------
+# Servidor local (processo próprio, para não pesar na memória medida)
+# ------------------------------------------------------------
+
+def _nomes_destinos(html):
+    import app
+    return sorted({n for n in app.DESTINOS.values() if n in html})
+
+@lru_cache(maxsize=None)
+def variante(slug, v):
+    """Página `slug` com destinos rodados e preços escalados pela variante v"""
+    with open(os.path.join(FIXTURES, PAGINAS[slug]), encoding='utf-8') as f:
+        html = f.read()
+    # Links únicos por variante (hash_id muda)
+    html = re.sub(r'href="(?:https?://[^/"]+)?/', f'href="/v{v}/', html)
+    if v == 0:
+        return html.encode()
+    nomes = _nomes_destinos(html)
+    troca = {n: nomes[(i + v) % len(nomes)] for i, n in enumerate(nomes)}
+    por_tamanho = sorted(nomes, key=len, reverse=True)
+    html = re.sub(r'\b(' + '|'.join(map(re.escape, por_tamanho)) + r')\b', lambda m: troca[m.group()], html)
+    fator = 1.12 ** (v // len(nomes))
+    html = re.sub(r'R\$ ([\d.]+)',
+                  lambda m: 'R$ ' + f"{round(int(m.group(1).replace('.', '')) * fator):,}".replace(',', '.'),
+                  html)
+    return html.encode()
+
+class Handler(BaseHTTPRequestHandler):
+    latencia = 0.0
+    latencia_telegram = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, corpo, tipo):
+        self.send_response(200)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_GET(self):
+        # /<copia>/<slug>/<pagina>
+        partes = self.path.strip('/').split('/')
+        if len(partes) != 3 or partes[1] not in PAGINAS:
+            self.send_error(404)
+            return
+        time.sleep(self.latencia)
+        copia, slug, pagina = int(partes[0]), partes[1], int(partes[2])
+        self._responder(variante(slug, copia * 3 + pagina + (2 if slug == 'passagensimperdiveis' else 0)),
+                        'text/html; charset=utf-8')
+
+    def do_POST(self):
+        # Telegram falso: /bot<token>/sendMessage
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.latencia_telegram)
+        self._responder(b'{"ok": true, "result": {}}', 'application/json')
+
+def servir(porta, latencia_ms, latencia_telegram_ms):
+    Handler.latencia = latencia_ms / 1000
+    Handler.latencia_telegram = latencia_telegram_ms / 1000
+    servidor = ThreadingHTTPServer(('', porta), Handler)
+    servidor.daemon_threads = True
+    servidor.request_queue_size = 256
+    print('pronto', flush=True)
+    servidor.serve_forever()
+
+
+# ------------------------------------------------------------
+# Uma escala (subprocesso com banco novo)
+# ------------------------------------------------------------
+
+def _cronometrar(modulo, nome, tempos, chave):
+    """Troca modulo.nome por uma versão que soma a duração em tempos[chave].
+    Retorna a função que desfaz a troca."""
+    original = getattr(modulo, nome)
+    lock = threading.Lock()
+
+    def medido(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            with lock:
+                tempos[chave] += time.perf_counter() - inicio
+
+    setattr(modulo, nome, medido)
+    return lambda: setattr(modulo, nome, original)
+
+def rodar_escala(escala, porta, assinantes, um_host, limitador):
+    import app
+
+    app.init_db()
+    app.TELEGRAM_BOT_TOKEN = 'bench'
+    app.TELEGRAM_CHAT_ID = '1'
+    app.TELEGRAM_API_URL = f"http://127.0.0.1:{porta}"
+    if not limitador:
+        app.limitador_telegram = app.LimitadorTelegram(0, 0)
+    # A notificação é medida aqui, não na thread do despachante
+    app.acordar_despachante = lambda: None
+
+    originais = list(app.FONTES.values())
+    app.FONTES.clear()
+    for copia in range(escala):
+        host = '127.0.0.1' if um_host else f"127.0.{copia // 250}.{copia % 250 + 1}"
+        for fonte in originais:
+            slug = re.sub(r'^https?://(www\.)?|\.com\.br.*$', '', fonte.base_url)
+            base = f"http://{host}:{porta}"
+            app.registrar_fonte(app.Fonte(
+                nome=f"{fonte.nome} #{copia}",
+                urls=[(f"{base}/{copia}/{slug}/{i}", tipo) for i, (_, tipo) in enumerate(fonte.urls)],
+                base_url=base,
+                seletor_artigo=fonte.seletor_artigo,
+                seletor_link=fonte.seletor_link,
+                limite=fonte.limite,
+                detecta_bonus=fonte.detecta_bonus,
+            ))
+
+    for i in range(assinantes):
+        assinante_id = app.salvar_assinante(f"bench-{i}")
+        destinos = sorted(set(app.DESTINOS.values()))
+        app.adicionar_regra(assinante_id, destinos=[destinos[i % len(destinos)]])
+
+    def uma_rodada():
+        tempos = dict.fromkeys(ESTAGIOS + ['download_threads'], 0.0)
+        desfazer = [
+            _cronometrar(app, 'fetch', tempos, 'download_threads'),
+            _cronometrar(app, 'extrair_links', tempos, 'parse'),
+            _cronometrar(app, 'extrair_campos', tempos, 'extracao'),
+            _cronometrar(app, 'salvar_promocoes', tempos, 'gravacao'),
+            _cronometrar(app, 'distribuir_alertas', tempos, 'notificacao'),
+            _cronometrar(app, 'baixar_fontes', tempos, 'download'),
+        ]
+
+        rss_antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        inicio = time.perf_counter()
+        total, novas = app.buscar_todas(notificar=True, forcar=True)
+        inicio_notif = time.perf_counter()
+        enviadas = app.despachar_notificacoes()
+        tempos['notificacao'] += time.perf_counter() - inicio_notif
+        decorrido = time.perf_counter() - inicio
+        rss_depois = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # baixar_fontes inclui parse e extração (feitos conforme as páginas chegam)
+        tempos['download'] -= tempos['parse'] + tempos['extracao']
+        for desfaz in desfazer:
+            desfaz()
+        return {
+            'promocoes': total,
+            'novas': novas,
+            'notificadas': enviadas,
+            'segundos': decorrido,
+            'promocoes_por_s': total / decorrido if decorrido else 0,
+            'pico_rss_kb': rss_depois - rss_antes,
+            **{f"ms_{k}": v * 1000 for k, v in tempos.items()},
+        }
+
+    fria = uma_rodada()
+    quente = uma_rodada()   # mesmas páginas: tudo já gravado
+    return {'escala': escala, 'fontes': len(app.FONTES),
+            'paginas': sum(len(f.urls) for f in app.FONTES.values()),
+            'fria': fria, 'quente': quente}
+
+
+# ------------------------------------------------------------
+
+def _imprimir(r):
+    for rodada in ('fria', 'quente'):
+        m = r[rodada]
+        etapas = ' '.join(f"{m['ms_' + e]:>9.0f}" for e in ESTAGIOS)
+        print(f"{r['escala']:>4}× {rodada:<6} {r['paginas']:>6} {m['promocoes']:>7} {m['novas']:>6} "
+              f"{etapas} {m['segundos'] * 1000:>9.0f} {m['promocoes_por_s']:>9.0f} {m['pico_rss_kb']:>8} KB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--escalas', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--latencia', type=float, default=50, help='ms por página')
+    parser.add_argument('--latencia-telegram', type=float, default=20, help='ms por mensagem')
+    parser.add_argument('--assinantes', type=int, default=100, help='assinantes com uma regra de destino cada')
+    parser.add_argument('--porta', type=int, default=8765)
+    parser.add_argument('--um-host', action='store_true', help='todas as fontes em 127.0.0.1')
+    parser.add_argument('--limitador', action='store_true',
+                        help='mantém os limites reais do Telegram (1 msg/s por chat)')
+    parser.add_argument('--json', action='store_true', help='uma linha JSON por escala')
+    parser.add_argument('--servidor', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--escala', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.servidor:
+        servir(args.porta, args.latencia, args.latencia_telegram)
+        return
+    if args.escala:
+        print(json.dumps(rodar_escala(args.escala, args.porta, args.assinantes, args.um_host, args.limitador)))
+        return
+
+    servidor = subprocess.Popen(
+        [sys.executable, __file__, '--servidor', '--porta', str(args.porta),
+         '--latencia', str(args.latencia), '--latencia-telegram', str(args.latencia_telegram)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        servidor.stdout.readline()  # 'pronto'
+        if not args.json:
+            print(f"{'':>5} {'rodada':<6} {'páginas':>6} {'promos':>7} {'novas':>6} "
+                  + ' '.join(f"{e[:9]:>9}" for e in ESTAGIOS)
+                  + f" {'total ms':>9} {'promos/s':>9} {'pico RSS':>11}")
+        for escala in args.escalas:
+            with tempfile.TemporaryDirectory() as pasta:
+                comando = [sys.executable, __file__, '--escala', str(escala), '--porta', str(args.porta),
+                           '--assinantes', str(args.assinantes)]
+                comando += ['--um-host'] if args.um_host else []
+                comando += ['--limitador'] if args.limitador else []
+                saida = subprocess.run(
+                    comando, capture_output=True, text=True, check=True,
+                    env={**os.environ, 'DATABASE_PATH': os.path.join(pasta, 'bench.db'),
+                         'ARQUIVO_DIR': os.path.join(pasta, 'arquivo')},
+                ).stdout
+            r = json.loads(saida.strip().splitlines()[-1])
+            if args.json:
+                print(json.dumps(r))
+            else:
+                _imprimir(r)
+    finally:
+        servidor.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+# Configuração do gunicorn (carregada pelo Procfile / render.yaml)
+
+def post_worker_init(worker):
+    """Cada worker, ao subir: prepara o banco e se candidata a líder.
+
+    Assim um worker que ainda não recebeu nenhuma requisição também pode
+    assumir o scraping e as notificações.
+    """
+    from app import iniciar_processo
+    iniciar_processo()
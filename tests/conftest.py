@@ -0,0 +1,25 @@
+"""Cada teste usa um banco novo num diretório temporário"""
+import os
+import sys
+import tempfile
+
+# Antes de importar o app: nada de promocoes.db no diretório de trabalho
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'promocoes.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    """Banco vazio e estado em memória zerado; devolve a conexão da thread"""
+    monkeypatch.setattr(app, 'DATABASE_PATH', str(tmp_path / 'promocoes.db'))
+    monkeypatch.setitem(app._versao, 'valor', None)
+    monkeypatch.setattr(app, 'promocoes_recentes', app.PromocoesRecentes(app.RECENTES_MAX))
+    monkeypatch.setattr(app, 'cache_respostas', app.CacheRespostas(app.CACHE_MAX_ENTRADAS))
+    # Processo já "iniciado": o cliente de teste não sobe o líder (nem scraping)
+    monkeypatch.setitem(app._inicio, 'pid', os.getpid())
+    app.init_db()
+    return app.get_db()
@@ -0,0 +1,75 @@
+"""IndiceRegras contra conferir todas as regras, e o filtro de assinantes ativos"""
+import random
+
+import app
+
+DESTINOS = ['Lisboa', 'Paris', 'Roma', 'Miami', None]
+PROGRAMAS = ['Smiles', 'Livelo', 'Esfera', None]
+TIPOS = ['passagem', 'milhas', 'transferencia_bonificada']
+
+
+def sortear_regras(sorteio, n):
+    subconjunto = lambda valores: frozenset(sorteio.sample([v for v in valores if v], sorteio.choice([0, 0, 1, 2])))
+    return [app.Regra(
+        id=i, assinante_id=i % 40,
+        destinos=subconjunto(DESTINOS), programas=subconjunto(PROGRAMAS), tipos=subconjunto(TIPOS),
+        preco_max=sorteio.choice([None, 1500, 2000, 3000]),
+        bonus_min=sorteio.choice([None, 50, 80, 100]),
+        score_min=sorteio.choice([None, None, 10, 30]),
+    ) for i in range(n)]
+
+
+def sortear_promocao(sorteio):
+    return {
+        'hash_id': f"{sorteio.getrandbits(48):012x}",
+        'tipo': sorteio.choice(TIPOS),
+        'destino': sorteio.choice(DESTINOS),
+        'programa': sorteio.choice(PROGRAMAS),
+        'preco': sorteio.choice([None, 0, 999, 1500, 2000, 2999, 4000]),
+        'bonus_percentual': sorteio.choice([None, 30, 80, 100, 120]),
+        'score': sorteio.choice([None, -5, 10, 45]),
+    }
+
+
+def test_indice_equivale_a_conferir_todas():
+    sorteio = random.Random(11)
+    regras = sortear_regras(sorteio, 300)
+    indice = app.IndiceRegras(regras)
+    casadas = 0
+    for _ in range(2000):
+        promo = sortear_promocao(sorteio)
+        esperado = {r.assinante_id for r in regras if r.casa(promo)}
+        assert indice.casar(promo) == esperado, promo
+        casadas += bool(esperado)
+    assert casadas > 100
+
+
+def test_ativo_precisa_ser_booleano(banco):
+    cliente = app.app.test_client()
+    url = f"/api/assinantes?secret={app.CRON_SECRET}"
+    assert cliente.post(url, json={'chat_id': '1', 'ativo': 'false'}).status_code == 400
+    assert cliente.post(url, json={'chat_id': '1', 'ativo': 0}).status_code == 400
+    assert cliente.post(url, json={'chat_id': '1', 'ativo': False}).status_code == 201
+    assert banco.execute("SELECT ativo FROM assinantes WHERE chat_id = '1'").fetchone()[0] == 0
+
+
+def test_desativado_nao_recebe_pendentes(banco, monkeypatch):
+    promo = app.Promocao(tipo='passagem', titulo='Voos para Lisboa por R$ 1999', url='https://x.example/1',
+                         fonte='X', preco=1999, destino='Lisboa')
+    app.salvar_promocoes([promo])
+    ativo = app.salvar_assinante('10')
+    inativo = app.salvar_assinante('20')
+    with banco:
+        banco.executemany('INSERT INTO entregas VALUES (?, ?, ?, 0)',
+                          [(ativo, promo.hash_id, app.NOTIF_PENDENTE), (inativo, promo.hash_id, app.NOTIF_PENDENTE)])
+    app.salvar_assinante('20', ativo=False)
+
+    enviados = []
+    def enviar_em_massa(mensagens):
+        enviados.extend(mensagens)
+        return {chat: ['ok'] * len(lista) for chat, lista in mensagens.items()}
+    monkeypatch.setattr(app, 'enviar_em_massa', enviar_em_massa)
+    assert app.despachar_entregas('teste') == 1
+    assert enviados == ['10']
+    status = dict(banco.execute('SELECT assinante_id, status FROM entregas').fetchall())
+    assert status == {ativo: app.NOTIF_ENVIADA, inativo: app.NOTIF_DESCARTADA}
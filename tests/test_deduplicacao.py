@@ -0,0 +1,72 @@
+"""deduplicar (SimHash por faixas) contra a comparação com todas as aceitas"""
+import random
+import sqlite3
+
+import app
+
+DESTINOS = ['Lisboa', 'Paris', 'Roma', 'Miami', 'Santiago', 'Orlando']
+PROGRAMAS = [None, 'Smiles', 'Livelo', 'Azul Fidelidade']
+EXTRAS = ['', 'imperdível', 'promoção', 'últimos dias', 'oferta relâmpago', 'hoje']
+
+
+def gerar(semente, n):
+    sorteio = random.Random(semente)
+    promos = []
+    for i in range(n):
+        destino = sorteio.choice(DESTINOS)
+        preco = sorteio.choice([1800, 1900, 2500, 3100])
+        tipo = sorteio.choice(['passagem', 'milhas', 'transferencia_bonificada'])
+        bonus = sorteio.choice([None, 80, 100]) if tipo == 'transferencia_bonificada' else None
+        extra = sorteio.choice(EXTRAS)
+        titulo = f"Voos para {destino} com tarifas desde R$ {preco} {extra}".strip()
+        promos.append(app.Promocao(
+            tipo=tipo, titulo=titulo, url=f"https://fonte{i % 3}.example/{i}", fonte=f"Fonte {i % 3}",
+            preco=preco, destino=sorteio.choice([destino, None]), programa=sorteio.choice(PROGRAMAS),
+            bonus_percentual=bonus,
+        ))
+    return promos
+
+
+def aceitas_forca_bruta(lotes):
+    """Cada promoção contra todas as aceitas antes dela (ou já conhecidas)"""
+    aceitas, duplicadas = {}, set()
+    for lote in lotes:
+        for p in lote:
+            if p.hash_id in aceitas or p.hash_id in duplicadas:
+                continue
+            h = app.simhash(p.titulo)
+            if any(app._mesma_oferta(h, app._oferta(p), h2, oferta) for h2, oferta in aceitas.values()):
+                duplicadas.add(p.hash_id)
+            else:
+                aceitas[p.hash_id] = (h, app._oferta(p))
+    return set(aceitas)
+
+
+def test_faixas_equivalem_a_forca_bruta(banco):
+    promos = gerar(7, 600)
+    lotes = [promos[i:i + 150] for i in range(0, len(promos), 150)]
+    for lote in lotes:
+        app.salvar_promocoes(lote)
+
+    gravadas = {r[0] for r in banco.execute('SELECT hash_id FROM promocoes')}
+    assert gravadas == aceitas_forca_bruta(lotes)
+    # O gerador precisa produzir os dois casos para o teste valer alguma coisa
+    assert 0 < len(gravadas) < len({p.hash_id for p in promos})
+
+
+def test_lote_maior_que_o_limite_de_variaveis(banco):
+    banco.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    promos = [app.Promocao(tipo='passagem', titulo=f"Oferta número {i} {i * 7919}",
+                           url=f"https://x.example/{i}", fonte='X') for i in range(2500)]
+    assert len(app.salvar_promocoes(promos)) == 2500
+    assert app.salvar_promocoes(promos) == set()
+
+
+def test_programa_tipo_e_bonus_separam_ofertas():
+    h = app.simhash('Transfira pontos Livelo para Smiles com bônus')
+    base = ('Lisboa', 2000, 'transferencia_bonificada', 'Smiles', 80)
+    assert app._mesma_oferta(h, base, h, base)
+    assert app._mesma_oferta(h, base, h, ('Lisboa', 2000, 'transferencia_bonificada', None, None))
+    assert not app._mesma_oferta(h, base, h, ('Lisboa', 2000, 'transferencia_bonificada', 'Smiles', 100))
+    assert not app._mesma_oferta(h, base, h, ('Lisboa', 2000, 'transferencia_bonificada', 'Livelo', 80))
+    assert not app._mesma_oferta(h, base, h, ('Lisboa', 2000, 'milhas', 'Smiles', 80))
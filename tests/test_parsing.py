@@ -0,0 +1,57 @@
+"""Extrator em streaming contra a árvore completa do html.parser"""
+import os
+import random
+
+import pytest
+from bs4 import BeautifulSoup
+
+import app
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench', 'fixtures')
+
+PAGINAS = [
+    ('melhoresdestinos.html', 'article, .post-item', 'h2 a, h3 a, a.post-title', 25),
+    ('passagensimperdiveis.html', 'article, .post', 'h2 a, h3 a, a.title', 20),
+]
+
+# Pedaços de HTML quebrado: tags sem fechar, fechamentos soltos, <a>
+# aninhados, <a> que é artigo, texto de script e comentários
+PEDACOS = [
+    '<article>', '</article>', '<li class="post-item">', '</li>', '<ul>', '</ul>', '<h2>', '</h2>',
+    '<h3>', '</h3>', '<a href="/{}">', '</a>', 'T{} ', '<div>', '</div>', '<p class="post">', '</p>',
+    '<a class="title" href="/{}">', '<a class="post" href="/{}">', '<span>', '</span>', '</h2></a>',
+    '<b>', '</b>', '<a href="/{}"/>', '<br>', 'x &amp; y ', '<script>if (a<b) x</script>',
+    '<!-- c -->', '<img src="{}">', '<ARTICLE>', '<h2 class="x">',
+]
+
+
+def arvore_completa(html, seletor_artigo, seletor_link, limite):
+    """O caminho antigo: BeautifulSoup(html, 'html.parser') inteiro"""
+    soup = BeautifulSoup(html, 'html.parser')
+    links = []
+    for article in soup.select(seletor_artigo)[:limite]:
+        link_elem = article.select_one(seletor_link)
+        if link_elem:
+            links.append((link_elem.get_text(strip=True), link_elem.get('href', '')))
+    return links
+
+
+@pytest.mark.parametrize('arquivo, seletor_artigo, seletor_link, limite', PAGINAS)
+def test_paginas_iguais_em_todos_os_backends(arquivo, seletor_artigo, seletor_link, limite):
+    with open(os.path.join(FIXTURES, arquivo), encoding='utf-8') as f:
+        html = f.read()
+    esperado = arvore_completa(html, seletor_artigo, seletor_link, limite)
+    assert len(esperado) == limite
+    for parser in ('stream', 'html.parser', 'lxml'):
+        assert app.extrair_links(html, seletor_artigo, seletor_link, limite, parser=parser) == esperado
+
+
+@pytest.mark.parametrize('semente', range(4))
+def test_html_quebrado_igual_a_arvore_completa(semente):
+    sorteio = random.Random(semente)
+    seletor_artigo, seletor_link = 'article, .post-item, .post', 'h2 a, h3 a, a.title'
+    for _ in range(400):
+        html = ''.join(sorteio.choice(PEDACOS).format(i) for i in range(sorteio.randint(3, 40)))
+        for limite in (1, 3, 10):
+            assert (app.extrair_links(html, seletor_artigo, seletor_link, limite, parser='stream')
+                    == arvore_completa(html, seletor_artigo, seletor_link, limite)), (html, limite)
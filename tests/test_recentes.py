@@ -0,0 +1,78 @@
+"""Páginas do anel de promoções recentes contra a mesma consulta no SQLite"""
+import json
+import random
+
+import pytest
+
+import app
+
+FILTROS = [
+    {},
+    {'tipo': 'passagem'},
+    {'tipo': 'todas', 'destino': 'Lisboa'},
+    {'programa': 'Smiles', 'preco_max': 2500},
+    {'preco_min': 1500, 'fonte': 'Fonte 1'},
+]
+
+
+class SemAnel:
+    def pagina(self, *args, **kwargs):
+        return None
+
+
+def paginas(limite, **filtros):
+    """Todas as páginas (e cursores) de consultar_promocoes"""
+    resultado, antes = [], None
+    while True:
+        promocoes, antes = app.consultar_promocoes(antes=antes, limite=limite, **filtros)
+        resultado.append((promocoes, antes))
+        if antes is None:
+            return resultado
+
+
+def paginas_sql(monkeypatch, limite, **filtros):
+    with monkeypatch.context() as m:
+        m.setattr(app, 'promocoes_recentes', SemAnel())
+        return paginas(limite, **filtros)
+
+
+@pytest.fixture
+def anel(banco, monkeypatch):
+    anel = app.PromocoesRecentes(60)
+    monkeypatch.setattr(app, 'promocoes_recentes', anel)
+    sorteio = random.Random(3)
+    for lote in range(4):
+        app.salvar_promocoes([app.Promocao(
+            tipo=sorteio.choice(['passagem', 'milhas']),
+            titulo=f"Promoção {lote}-{i} {sorteio.getrandbits(40):x}",
+            url=f"https://fonte.example/{lote}/{i}", fonte=f"Fonte {i % 3}",
+            preco=sorteio.choice([None, 999, 1800, 2400, 3200]),
+            destino=sorteio.choice([None, 'Lisboa', 'Paris']),
+            programa=sorteio.choice([None, 'Smiles', 'Livelo']),
+        ) for i in range(40)])
+    return anel
+
+
+@pytest.mark.parametrize('filtros', FILTROS)
+def test_paginas_iguais_ao_sql(anel, monkeypatch, filtros):
+    for limite in (7, 25):
+        assert paginas(limite, **filtros) == paginas_sql(monkeypatch, limite, **filtros)
+
+
+def test_atualizacao_de_linhas_chega_ao_anel(anel, monkeypatch):
+    paginas(10)  # anel carregado
+    hashes = [r[0] for r in app.get_db().execute('SELECT hash_id FROM promocoes ORDER BY rowid DESC LIMIT 5')]
+    app.marcar_notificacao(hashes, app.NOTIF_ENVIADA)
+    assert paginas(10) == paginas_sql(monkeypatch, 10)
+
+
+def test_corpo_da_api_igual_ao_jsonify(anel, monkeypatch):
+    cliente = app.app.test_client()
+    for url in ('/api/promocoes?limite=30', '/api/promocoes?tipo=milhas&limite=5&before=120'):
+        do_anel = cliente.get(url)
+        assert do_anel.headers.get('Content-Type') == 'application/json'
+        with monkeypatch.context() as m:
+            m.setattr(app, 'promocoes_recentes', SemAnel())
+            do_sql = cliente.get(url)
+        assert do_anel.data == do_sql.data
+        assert json.loads(do_anel.data)['promocoes']